@@ -0,0 +1,6 @@
+"""
+Code partagé par le service d'ingestion (ingestion-capteurs) et le worker ETL (pretraitement)
+
+Installé dans les deux images Docker (pip install ./common), et en local par
+pip install -e common. Sans dépendance: le consumer n'embarque ni pandas ni numpy.
+"""
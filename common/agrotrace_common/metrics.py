@@ -0,0 +1,286 @@
+"""
+Métriques au format texte Prometheus
+
+Implémentation minimale (compteurs, jauges, histogrammes à seaux fixes) pour
+instrumenter les chemins critiques sans dépendance supplémentaire. Chaque
+thread incrémente sa propre cellule: aucune prise de verrou lors d'un
+incrément, les cellules ne sont additionnées qu'au moment de la collecte.
+
+Module commun au service d'ingestion, au consumer et au worker ETL: chaque
+processus a son propre registre et expose ses métriques (render ou
+start_http_server).
+"""
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import logging
+import math
+import threading
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seaux par défaut (secondes): de 50 µs à 10 s
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+class _Cells:
+    """Valeurs réparties par thread: chaque thread n'écrit que dans sa cellule"""
+    
+    def __init__(self, size: int):
+        self._size = size
+        self._local = threading.local()
+        self._cells: List[List[float]] = []
+        self._lock = threading.Lock()
+    
+    def cell(self) -> List[float]:
+        """Cellule du thread courant (créée au premier appel)"""
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = [0.0] * self._size
+            with self._lock:
+                self._cells.append(cell)
+            self._local.cell = cell
+            return cell
+    
+    def totals(self) -> List[float]:
+        """Somme des cellules de tous les threads"""
+        with self._lock:
+            cells = list(self._cells)
+        totals = [0.0] * self._size
+        for cell in cells:
+            for index, value in enumerate(cell):
+                totals[index] += value
+        return totals
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    """Base commune: nom, description et enfants par combinaison de labels"""
+    
+    kind = "untyped"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._children_lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+    
+    def labels(self, *values: str):
+        """Retourne la série correspondant aux valeurs de labels (mise en cache)"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: labels attendus {self.labelnames}, reçus {values}")
+            with self._children_lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+    
+    def _default(self):
+        """Série sans label"""
+        return self.labels()
+    
+    def _new_child(self):
+        raise NotImplementedError
+    
+    def _samples(self, labelvalues: Tuple[str, ...], child) -> List[str]:
+        raise NotImplementedError
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labelvalues, child in sorted(self._children.items()):
+            lines.extend(self._samples(labelvalues, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("_cells",)
+    
+    def __init__(self):
+        self._cells = _Cells(1)
+    
+    def inc(self, amount: float = 1.0) -> None:
+        self._cells.cell()[0] += amount
+    
+    def value(self) -> float:
+        return self._cells.totals()[0]
+
+
+class Counter(_Metric):
+    """Compteur monotone"""
+    
+    kind = "counter"
+    
+    def _new_child(self):
+        return _CounterChild()
+    
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+    
+    def _samples(self, labelvalues, child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(child.value())}"]
+
+
+class _GaugeChild:
+    __slots__ = ("_value", "_function")
+    
+    def __init__(self):
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+    
+    def set(self, value: float) -> None:
+        self._value = value
+    
+    def set_function(self, function: Callable[[], float]) -> None:
+        """La valeur est calculée par function à chaque collecte"""
+        self._function = function
+    
+    def value(self) -> float:
+        if self._function is not None:
+            return float(self._function())
+        return self._value
+
+
+class Gauge(_Metric):
+    """Jauge: valeur instantanée, fixée ou calculée à la collecte"""
+    
+    kind = "gauge"
+    
+    def _new_child(self):
+        return _GaugeChild()
+    
+    def set(self, value: float) -> None:
+        self._default().set(value)
+    
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._default().set_function(function)
+    
+    def _samples(self, labelvalues, child) -> List[str]:
+        try:
+            value = child.value()
+        except Exception as e:
+            logger.debug(f"Jauge {self.name} indisponible: {e}")
+            return []
+        return [f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"]
+
+
+class _HistogramChild:
+    __slots__ = ("_bounds", "_cells")
+    
+    def __init__(self, bounds: Tuple[float, ...]):
+        self._bounds = bounds
+        # Un compteur par seau (+Inf inclus), puis la somme des observations
+        self._cells = _Cells(len(bounds) + 2)
+    
+    def observe(self, value: float) -> None:
+        cell = self._cells.cell()
+        cell[bisect_left(self._bounds, value)] += 1
+        cell[-1] += value
+    
+    def totals(self) -> List[float]:
+        return self._cells.totals()
+
+
+class Histogram(_Metric):
+    """Histogramme à seaux fixes (bornes supérieures inclusives)"""
+    
+    kind = "histogram"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+    
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+    
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+    
+    def _samples(self, labelvalues, child) -> List[str]:
+        totals = child.totals()
+        lines = []
+        cumulative = 0.0
+        for bound, count in zip(self.buckets + (math.inf,), totals):
+            cumulative += count
+            labels = _format_labels(self.labelnames, labelvalues, ("le", _format_value(bound)))
+            lines.append(f"{self.name}_bucket{labels} {_format_value(cumulative)}")
+        labels = _format_labels(self.labelnames, labelvalues)
+        lines.append(f"{self.name}_sum{labels} {_format_value(totals[-1])}")
+        lines.append(f"{self.name}_count{labels} {_format_value(cumulative)}")
+        return lines
+
+
+def render() -> str:
+    """Exporte toutes les métriques enregistrées au format texte Prometheus"""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines: List[str] = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        logger.debug(f"Requête métriques: {format % args}")
+
+
+def start_http_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Expose /metrics sur un serveur HTTP d'arrière-plan (processus sans API)
+    
+    Args:
+        port: Port d'écoute
+        host: Adresse d'écoute
+    
+    Returns:
+        Serveur HTTP démarré dans un thread démon
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    logger.info(f"Métriques exposées sur http://{host}:{port}/metrics")
+    return server
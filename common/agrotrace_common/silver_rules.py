@@ -0,0 +1,127 @@
+"""
+Règles Silver partagées par l'ETL (pretraitement/pipeline/silver.py) et le
+nettoyage en continu du consumer (ingestion-capteurs/app/silver_stream.py)
+
+Plages valides par défaut, bits de quality_flags, définition des tables
+clean_sensor_data et sensor_registry, et chargement incrémental du registre
+des capteurs: chaque service n'en construit que sa propre représentation en
+mémoire (tableaux numpy pour l'ETL, bornes par capteur pour le consumer).
+"""
+
+from typing import Any, Dict, Optional, Tuple
+
+MEASURE_COLUMNS = ['temperature', 'humidite', 'humidite_sol', 'niveau_ph', 'luminosite']
+
+# Plages valides par défaut de chaque métrique (voir sensor_registry)
+VALID_RANGES = {
+    'temperature': (-10, 50),      # °C
+    'humidite': (0, 100),          # %
+    'humidite_sol': (0, 100),      # %
+    'niveau_ph': (0, 14),          # pH
+    'luminosite': (0, 150000)      # lux
+}
+
+# Bits de quality_flags: QUALITY_FLAG_BITS bits par métrique, dans l'ordre de
+# MEASURE_COLUMNS (temperature: bits 0-3, humidite: bits 4-7...)
+QUALITY_FLAG_BITS = 4
+FLAG_INTERPOLATED = 1   # Valeur manquante ou écartée, remplacée par interpolation
+FLAG_OUT_OF_RANGE = 2   # Valeur hors plage valide (sentinelle, panne), écartée
+FLAG_OUTLIER = 4        # Écart à la médiane glissante du capteur supérieur au seuil (MAD)
+FLAG_STUCK = 8          # Valeur identique sur toute la fenêtre glissante (capteur figé)
+
+
+def quality_flag(column: str, flag: int) -> int:
+    """Bit de quality_flags d'un indicateur pour une métrique"""
+    return flag << (QUALITY_FLAG_BITS * MEASURE_COLUMNS.index(column))
+
+
+CLEAN_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS clean_sensor_data (
+        id SERIAL,
+        capteur_id VARCHAR(50) NOT NULL,
+        timestamp TIMESTAMPTZ NOT NULL,
+        temperature DOUBLE PRECISION,
+        humidite DOUBLE PRECISION,
+        humidite_sol DOUBLE PRECISION,
+        niveau_ph DOUBLE PRECISION,
+        luminosite DOUBLE PRECISION,
+        quality_flags INTEGER NOT NULL DEFAULT 0,
+        processed_at TIMESTAMPTZ DEFAULT NOW(),
+        PRIMARY KEY (capteur_id, timestamp)
+    );
+    -- Tables créées avant l'ajout de quality_flags
+    ALTER TABLE clean_sensor_data ADD COLUMN IF NOT EXISTS quality_flags INTEGER NOT NULL DEFAULT 0;
+    SELECT create_hypertable('clean_sensor_data', 'timestamp', if_not_exists => TRUE);
+"""
+
+# Un trigger attribue à chaque ligne insérée ou modifiée la version suivante,
+# sous un verrou tenu jusqu'à la fin de la transaction: les versions sont
+# visibles dans l'ordre, et read_registry ne relit que les lignes de version
+# supérieure à la dernière chargée.
+REGISTRY_TABLE_DDL = """
+    CREATE SEQUENCE IF NOT EXISTS sensor_registry_version_seq;
+    CREATE TABLE IF NOT EXISTS sensor_registry (
+        capteur_id VARCHAR(50) NOT NULL,
+        metric VARCHAR(20) NOT NULL,
+        min_value DOUBLE PRECISION,
+        max_value DOUBLE PRECISION,
+        scale DOUBLE PRECISION NOT NULL DEFAULT 1,
+        calibration_offset DOUBLE PRECISION NOT NULL DEFAULT 0,
+        unit VARCHAR(20),
+        version BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (capteur_id, metric)
+    );
+    CREATE OR REPLACE FUNCTION sensor_registry_touch() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtext('sensor_registry'));
+        NEW.version := nextval('sensor_registry_version_seq');
+        NEW.updated_at := NOW();
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    CREATE OR REPLACE TRIGGER sensor_registry_touch
+    BEFORE INSERT OR UPDATE ON sensor_registry
+    FOR EACH ROW EXECUTE FUNCTION sensor_registry_touch();
+"""
+
+REGISTRY_COLUMNS = ['capteur_id', 'metric', 'min_value', 'max_value', 'scale', 'calibration_offset', 'unit', 'version']
+_REGISTRY_QUERY = f"SELECT {', '.join(REGISTRY_COLUMNS)} FROM sensor_registry WHERE version > %s"
+
+# (capteur_id, metric) -> ligne du registre (colonnes REGISTRY_COLUMNS)
+RegistryEntries = Dict[Tuple[Any, str], Tuple[Any, ...]]
+
+
+def read_registry(cursor, entries: RegistryEntries, version: int) -> Optional[RegistryEntries]:
+    """
+    Relit les lignes du registre modifiées depuis le dernier chargement
+    
+    Seules les lignes de version supérieure à version sont relues. Une
+    suppression (moins de lignes en base qu'en mémoire) provoque un
+    rechargement complet.
+    
+    Args:
+        cursor: Curseur ouvert sur la base
+        entries: Lignes déjà chargées (non modifiées)
+        version: Plus grande version chargée
+    
+    Returns:
+        Nouvelles lignes du registre, ou None si rien n'a changé
+    """
+    cursor.execute("SELECT COALESCE(MAX(version), 0), COUNT(*) FROM sensor_registry")
+    max_version, count = cursor.fetchone()
+    if max_version == version and count == len(entries):
+        return None
+    
+    changed = dict(entries)
+    cursor.execute(_REGISTRY_QUERY, (version,))
+    changed.update({(row[0], row[1]): tuple(row) for row in cursor.fetchall()})
+    if len(changed) != count:
+        cursor.execute(_REGISTRY_QUERY, (0,))
+        changed = {(row[0], row[1]): tuple(row) for row in cursor.fetchall()}
+    return changed
+
+
+def registry_version(entries: RegistryEntries) -> int:
+    """Plus grande version des lignes chargées"""
+    return max((row[-1] for row in entries.values()), default=0)
@@ -0,0 +1,122 @@
+"""
+Contrôle d'admission et contre-pression de l'ingestion
+
+Le niveau de pression est déduit de la file locale du producer Kafka
+(len(producer)), de la latence récente des accusés de livraison et du volume
+en attente dans le journal de débordement:
+- "normal": toutes les mesures sont admises;
+- "soft": chaque capteur dispose d'un seau à jetons; au-delà, la requête
+  reçoit un 429 avec Retry-After;
+- "hard": le débit et la rafale accordés à chaque capteur sont fortement
+  réduits, de sorte que la charge est délestée équitablement entre capteurs
+  plutôt qu'au profit des plus bavards.
+
+Un capteur inconnu reçoit la rafale du niveau courant, et aucune en "hard":
+une vague de reconnexions ne peut pas faire admettre une rafale complète par
+capteur au moment où le producer est saturé.
+"""
+
+from collections import OrderedDict
+from typing import Optional, Tuple
+import os
+import time
+
+from agrotrace_common import metrics
+
+from . import kafka_producer
+
+LEVEL_NORMAL = "normal"
+LEVEL_SOFT = "soft"
+LEVEL_HARD = "hard"
+
+ADMISSION_QUEUE_SOFT_LIMIT = int(os.getenv("ADMISSION_QUEUE_SOFT_LIMIT", "50000"))
+ADMISSION_QUEUE_HARD_LIMIT = int(os.getenv("ADMISSION_QUEUE_HARD_LIMIT", "90000"))
+ADMISSION_LATENCY_SOFT_MS = float(os.getenv("ADMISSION_LATENCY_SOFT_MS", "500"))
+ADMISSION_LATENCY_HARD_MS = float(os.getenv("ADMISSION_LATENCY_HARD_MS", "2000"))
+ADMISSION_SPILL_SOFT_RATIO = float(os.getenv("ADMISSION_SPILL_SOFT_RATIO", "0.1"))
+ADMISSION_SPILL_HARD_RATIO = float(os.getenv("ADMISSION_SPILL_HARD_RATIO", "0.5"))
+
+# Débit accordé à chaque capteur (mesures/s) et rafale autorisée, par niveau
+ADMISSION_SOFT_SENSOR_RATE = float(os.getenv("ADMISSION_SOFT_SENSOR_RATE", "2.0"))
+ADMISSION_HARD_SENSOR_RATE = float(os.getenv("ADMISSION_HARD_SENSOR_RATE", "0.1"))
+ADMISSION_SOFT_SENSOR_BURST = float(os.getenv("ADMISSION_SOFT_SENSOR_BURST", "10"))
+ADMISSION_HARD_SENSOR_BURST = float(os.getenv("ADMISSION_HARD_SENSOR_BURST", "1"))
+ADMISSION_MAX_SENSORS = int(os.getenv("ADMISSION_MAX_SENSORS", "100000"))
+
+# Seaux à jetons par capteur: capteur_id -> (jetons, dernier remplissage)
+_buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+_LEVEL_VALUES = {LEVEL_NORMAL: 0, LEVEL_SOFT: 1, LEVEL_HARD: 2}
+
+
+def pressure_level() -> str:
+    """Calcule le niveau de pression courant de l'ingestion"""
+    depth = kafka_producer.queue_depth()
+    # Sans message en vol, une latence ancienne ne traduit aucune congestion
+    latency_ms = kafka_producer.delivery_latency() * 1000 if depth else 0.0
+    spill_ratio = kafka_producer.spill_pending_bytes() / kafka_producer.KAFKA_SPILL_MAX_BYTES
+    
+    if (depth >= ADMISSION_QUEUE_HARD_LIMIT
+            or latency_ms >= ADMISSION_LATENCY_HARD_MS
+            or spill_ratio >= ADMISSION_SPILL_HARD_RATIO):
+        return LEVEL_HARD
+    if (depth >= ADMISSION_QUEUE_SOFT_LIMIT
+            or latency_ms >= ADMISSION_LATENCY_SOFT_MS
+            or spill_ratio >= ADMISSION_SPILL_SOFT_RATIO):
+        return LEVEL_SOFT
+    return LEVEL_NORMAL
+
+
+def admit(capteur_id: str, level: Optional[str] = None) -> Optional[float]:
+    """
+    Décide si une mesure est admise
+    
+    Args:
+        capteur_id: Capteur émetteur de la mesure
+        level: Niveau de pression déjà calculé (évite de le recalculer pour un lot)
+    
+    Returns:
+        None si la mesure est admise, sinon le délai (secondes) après lequel
+        le capteur peut réessayer
+    """
+    level = level or pressure_level()
+    if level == LEVEL_NORMAL:
+        # Les seaux sont conservés: ils se remplissent avec le temps écoulé, et
+        # une alternance normal/soft ne rend pas une rafale complète à chaque retour
+        return None
+    
+    if level == LEVEL_HARD:
+        rate, burst, initial = ADMISSION_HARD_SENSOR_RATE, ADMISSION_HARD_SENSOR_BURST, 0.0
+    else:
+        rate, burst, initial = ADMISSION_SOFT_SENSOR_RATE, ADMISSION_SOFT_SENSOR_BURST, ADMISSION_SOFT_SENSOR_BURST
+    now = time.monotonic()
+    tokens, updated_at = _buckets.pop(capteur_id, (initial, now))
+    tokens = min(burst, tokens + (now - updated_at) * rate)
+    
+    if tokens >= 1.0:
+        tokens -= 1.0
+        retry_after = None
+    else:
+        retry_after = (1.0 - tokens) / rate
+    
+    _buckets[capteur_id] = (tokens, now)
+    if len(_buckets) > ADMISSION_MAX_SENSORS:
+        _buckets.popitem(last=False)
+    return retry_after
+
+
+def status() -> dict:
+    """État de la contre-pression, exposé par /health"""
+    return {
+        "level": pressure_level(),
+        "queue_depth": kafka_producer.queue_depth(),
+        "delivery_latency_ms": round(kafka_producer.delivery_latency() * 1000, 1),
+        "spill_pending_bytes": kafka_producer.spill_pending_bytes(),
+        "tracked_sensors": len(_buckets)
+    }
+
+
+metrics.Gauge(
+    "ingestion_pressure_level",
+    "Niveau de contre-pression (0 = normal, 1 = soft, 2 = hard)"
+).set_function(lambda: _LEVEL_VALUES[pressure_level()])
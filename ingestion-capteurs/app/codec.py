@@ -0,0 +1,151 @@
+"""
+Encodage des mesures de capteurs sur le topic Kafka
+
+Deux formats coexistent sur le topic:
+- JSON (par défaut); tout message sans en-tête "schema-id" est lu comme du
+  JSON, ce qui couvre les messages produits avant l'ajout du format binaire;
+- binaire à disposition fixe, identifié par l'en-tête Kafka "schema-id".
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import os
+import struct
+
+from .models import CapteurData, CapteurDataAdapter
+
+WIRE_FORMAT_JSON = "json"
+WIRE_FORMAT_BINARY = "binary"
+KAFKA_WIRE_FORMAT = os.getenv("KAFKA_WIRE_FORMAT", WIRE_FORMAT_JSON)
+
+CONTENT_TYPE_HEADER = "content-type"
+SCHEMA_ID_HEADER = "schema-id"
+BINARY_CONTENT_TYPE = b"application/x-agrotrace-capteur"
+
+SCHEMA_ID_V1 = 1
+
+MEASURE_FIELDS = ('temperature', 'humidite', 'humidite_sol', 'niveau_ph', 'luminosite')
+
+# Schéma v1 (little-endian):
+#   q   timestamp en microsecondes depuis l'epoch UTC
+#   h   décalage UTC en minutes (NAIVE_OFFSET si le timestamp n'a pas de fuseau)
+#   B   masque de présence des mesures (bit i -> MEASURE_FIELDS[i])
+#   5d  mesures (0.0 si absentes)
+#   H   longueur du capteur_id, suivie du capteur_id en UTF-8
+_V1_LAYOUT = struct.Struct('<qhB5dH')
+NAIVE_OFFSET = -32768
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_ONE_MICROSECOND = timedelta(microseconds=1)
+_ONE_MINUTE = timedelta(minutes=1)
+
+Headers = List[Tuple[str, bytes]]
+
+_V1_HEADERS: Headers = [
+    (CONTENT_TYPE_HEADER, BINARY_CONTENT_TYPE),
+    (SCHEMA_ID_HEADER, str(SCHEMA_ID_V1).encode('ascii')),
+]
+
+
+def _encode_v1(data: CapteurData) -> bytes:
+    """Encode une mesure selon le schéma binaire v1"""
+    timestamp = data.timestamp
+    offset = timestamp.utcoffset()
+    if offset is None:
+        micros = (timestamp.replace(tzinfo=timezone.utc) - _EPOCH) // _ONE_MICROSECOND
+        offset_minutes = NAIVE_OFFSET
+    else:
+        micros = (timestamp - _EPOCH) // _ONE_MICROSECOND
+        offset_minutes = offset // _ONE_MINUTE
+    
+    mask = 0
+    values = []
+    for bit, field in enumerate(MEASURE_FIELDS):
+        value = getattr(data, field)
+        if value is None:
+            values.append(0.0)
+        else:
+            mask |= 1 << bit
+            values.append(value)
+    
+    capteur_id = data.capteur_id.encode('utf-8')
+    return _V1_LAYOUT.pack(micros, offset_minutes, mask, *values, len(capteur_id)) + capteur_id
+
+
+def _decode_v1(value: bytes) -> Dict[str, Any]:
+    """Décode une mesure encodée selon le schéma binaire v1"""
+    try:
+        micros, offset_minutes, mask, *values, id_length = _V1_LAYOUT.unpack_from(value)
+    except struct.error as e:
+        raise ValueError(f"Message binaire tronqué: {e}")
+    
+    capteur_id = value[_V1_LAYOUT.size:_V1_LAYOUT.size + id_length]
+    if len(capteur_id) != id_length:
+        raise ValueError("Message binaire tronqué: capteur_id incomplet")
+    
+    timestamp = _EPOCH + micros * _ONE_MICROSECOND
+    if offset_minutes == NAIVE_OFFSET:
+        timestamp = timestamp.replace(tzinfo=None)
+    else:
+        timestamp = timestamp.astimezone(timezone(offset_minutes * _ONE_MINUTE))
+    
+    data: Dict[str, Any] = {'capteur_id': capteur_id.decode('utf-8'), 'timestamp': timestamp}
+    for bit, field in enumerate(MEASURE_FIELDS):
+        data[field] = values[bit] if mask & (1 << bit) else None
+    return data
+
+
+_DECODERS = {
+    str(SCHEMA_ID_V1).encode('ascii'): _decode_v1,
+}
+
+
+def encode_reading(data: CapteurData, wire_format: str = KAFKA_WIRE_FORMAT) -> Tuple[bytes, Optional[Headers]]:
+    """
+    Sérialise une mesure pour Kafka
+    
+    Args:
+        data: Mesure validée
+        wire_format: "json" ou "binary"
+    
+    Returns:
+        Tuple (valeur du message, en-têtes Kafka ou None pour le JSON)
+    """
+    if wire_format == WIRE_FORMAT_BINARY:
+        return _encode_v1(data), _V1_HEADERS
+    return CapteurDataAdapter.dump_json(data), None
+
+
+def _header_value(headers: Optional[Headers], name: str) -> Optional[bytes]:
+    """Retourne la valeur d'un en-tête Kafka ou None"""
+    if not headers:
+        return None
+    for key, value in headers:
+        if key == name:
+            return value
+    return None
+
+
+def decode_reading(value: bytes, headers: Optional[Headers] = None) -> Dict[str, Any]:
+    """
+    Désérialise un message Kafka en dictionnaire de mesure
+    
+    Args:
+        value: Valeur brute du message
+        headers: En-têtes Kafka du message (msg.headers())
+    
+    Returns:
+        Dictionnaire avec les champs de CapteurData
+    
+    Raises:
+        ValueError: si le message est illisible ou le schéma inconnu
+    """
+    schema_id = _header_value(headers, SCHEMA_ID_HEADER)
+    if schema_id is None:
+        return json.loads(value)
+    
+    decoder = _DECODERS.get(schema_id)
+    if decoder is None:
+        raise ValueError(f"Schéma de message inconnu: {schema_id!r}")
+    return decoder(value)
@@ -1,13 +1,23 @@
-from confluent_kafka import Consumer, KafkaException, KafkaError
+from confluent_kafka import Consumer, KafkaException, KafkaError, TopicPartition
 import psycopg2
 from psycopg2.extras import execute_values
+import csv
+import io
 import json
 import os
 import logging
+import signal
+import threading
 import time
-from typing import Optional, Dict, Any
+import weakref
+from typing import Optional, Dict, Any, List, Tuple, Union
 from datetime import datetime
 
+from agrotrace_common import metrics, silver_rules
+
+from . import codec, consumer_stats, dead_letter, silver_stream
+from .dead_letter import DeadLetter
+
 logger = logging.getLogger(__name__)
 
 # Configuration Kafka
@@ -22,18 +32,73 @@ DB_NAME = os.getenv("DB_NAME", "agrotrace_db")
 DB_USER = os.getenv("DB_USER", "admin")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "password")
 
+# Mode de consommation: "batch" (lots de messages, une transaction et un
+# commit d'offsets par lot), "parallel" (lots répartis par partition sur
+# plusieurs workers, voir consumer_workers), "pipeline" (lecture, décodage et
+# écriture en parallèle, voir consumer_pipeline) ou "single" (un message à la fois)
+CONSUMER_MODE = os.getenv("CONSUMER_MODE", "batch")
+CONSUMER_BATCH_SIZE = int(os.getenv("CONSUMER_BATCH_SIZE", "500"))
+CONSUMER_BATCH_TIMEOUT_MS = int(os.getenv("CONSUMER_BATCH_TIMEOUT_MS", "500"))
+DB_RETRY_DELAY = 5
+
+# Écriture des lots: "values" (INSERT multi-lignes) ou "copy" (COPY vers une
+# table de staging puis fusion ensembliste dans raw_capteur_data)
+CONSUMER_WRITE_MODE = os.getenv("CONSUMER_WRITE_MODE", "values")
+
 consumer_config = {
     'bootstrap.servers': KAFKA_BOOTSTRAP_SERVERS,
     'group.id': KAFKA_GROUP_ID,
     'auto.offset.reset': 'earliest',
     'enable.auto.commit': False,  # Commit manuel pour plus de contrôle
     'max.poll.interval.ms': 300000,  # 5 minutes
-    'session.timeout.ms': 10000
+    'session.timeout.ms': 10000,
+    # Statistiques librdkafka: retard par partition (voir consumer_stats)
+    **consumer_stats.kafka_config()
 }
 
+# Port du serveur de métriques Prometheus (0 pour le désactiver)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9101"))
+
+POLL_TO_COMMIT_SECONDS = metrics.Histogram(
+    "consumer_poll_to_commit_seconds",
+    "Durée entre la réception d'un message (poll) et le commit de son offset"
+)
+DB_INSERT_SECONDS = metrics.Histogram(
+    "consumer_db_insert_seconds",
+    "Durée d'insertion en base (requête et commit de transaction)"
+)
+CONSUMER_MESSAGES = metrics.Counter(
+    "consumer_messages_total",
+    "Messages consommés, par issue (inserted, failed: mis en quarantaine)",
+    ["result"]
+)
+BATCH_MESSAGES = metrics.Histogram(
+    "consumer_batch_messages",
+    "Nombre de messages par lot consommé",
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000)
+)
+_INSERTED = CONSUMER_MESSAGES.labels("inserted")
+_FAILED = CONSUMER_MESSAGES.labels("failed")
+
 consumer: Optional[Consumer] = None
 db_connection: Optional[psycopg2.extensions.connection] = None
 
+# Nettoyage Silver dans le consumer (SILVER_MODE=streaming), voir silver_stream
+silver_cleaner: Optional[silver_stream.StreamingCleaner] = (
+    silver_stream.StreamingCleaner() if silver_stream.enabled() else None
+)
+
+# Connexions sur lesquelles la table de staging (temporaire) a été créée
+_staging_connections: "weakref.WeakSet[psycopg2.extensions.connection]" = weakref.WeakSet()
+
+# Demande d'arrêt (SIGTERM/SIGINT): le lot en cours est terminé avant la fermeture
+stop_requested = threading.Event()
+
+RawRow = Tuple[Any, ...]
+# Mesure décodée, partition et message Kafka d'origine (None hors Kafka):
+# une mesure refusée par la base est mise en quarantaine telle que reçue
+Reading = Tuple[Dict[str, Any], Optional[int], Any]
+
 
 def connect_to_database(max_retries: int = 5, retry_delay: int = 5) -> psycopg2.extensions.connection:
     """
@@ -89,52 +154,75 @@ def create_table_if_not_exists() -> None:
                 niveau_ph DOUBLE PRECISION,
                 luminosite DOUBLE PRECISION,
                 is_cleaned BOOLEAN NOT NULL DEFAULT FALSE,
+                kafka_partition SMALLINT,
                 PRIMARY KEY (capteur_id, timestamp)
             );
         """)
         
+        # Partition Kafka d'origine: les messages étant clés par capteur_id,
+        # elle sert d'identifiant de shard aux traitements en aval (ETL)
+        cursor.execute("""
+            ALTER TABLE raw_capteur_data
+            ADD COLUMN IF NOT EXISTS kafka_partition SMALLINT;
+        """)
+        
         # Convertir en hypertable TimescaleDB si ce n'est pas déjà fait
         cursor.execute("""
             SELECT create_hypertable('raw_capteur_data', 'timestamp', 
                                       if_not_exists => TRUE);
         """)
         
+        # Messages écartés par le consumer, en attente de réinjection
+        cursor.execute(dead_letter.QUARANTINE_TABLE_DDL)
+        
+        if silver_cleaner is not None:
+            cursor.execute(silver_rules.CLEAN_TABLE_DDL)
+            cursor.execute(silver_rules.REGISTRY_TABLE_DDL)
+        
         db_connection.commit()
         logger.info("Table 'raw_capteur_data' créée/vérifiée avec succès")
         cursor.close()
-        
+    
     except Exception as e:
         logger.error(f"Erreur lors de la création de la table: {e}")
         db_connection.rollback()
         raise
 
 
-def insert_capteur_data(data: Dict[str, Any]) -> bool:
+def insert_capteur_data(
+    data: Dict[str, Any],
+    partition: Optional[int] = None,
+    connection: Optional[psycopg2.extensions.connection] = None
+) -> bool:
     """
     Insère les données d'un capteur dans la base de données
     
     Args:
         data: Dictionnaire contenant les données du capteur
+        partition: Partition Kafka d'origine (shard du capteur)
+        connection: Connexion à utiliser (par défaut la connexion globale)
     
     Returns:
         True si l'insertion a réussi, False sinon
     """
-    global db_connection
+    connection = connection or db_connection
     
+    started_at = time.perf_counter()
     try:
-        cursor = db_connection.cursor()
+        cursor = connection.cursor()
         
         insert_query = """
             INSERT INTO raw_capteur_data 
-            (capteur_id, timestamp, temperature, humidite, humidite_sol, niveau_ph, luminosite, is_cleaned)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            (capteur_id, timestamp, temperature, humidite, humidite_sol, niveau_ph, luminosite, is_cleaned, kafka_partition)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
             ON CONFLICT (capteur_id, timestamp) DO UPDATE SET
                 temperature = EXCLUDED.temperature,
                 humidite = EXCLUDED.humidite,
                 humidite_sol = EXCLUDED.humidite_sol,
                 niveau_ph = EXCLUDED.niveau_ph,
                 luminosite = EXCLUDED.luminosite,
-                is_cleaned = EXCLUDED.is_cleaned;
+                is_cleaned = EXCLUDED.is_cleaned,
+                kafka_partition = EXCLUDED.kafka_partition;
         """
         
         cursor.execute(insert_query, (
@@ -145,57 +233,524 @@ def insert_capteur_data(data: Dict[str, Any]) -> bool:
             data.get('humidite_sol'),
             data.get('niveau_ph'),
             data.get('luminosite'),
-            False  
+            False,
+            partition
         ))
         
-        db_connection.commit()
+        connection.commit()
         cursor.close()
+        DB_INSERT_SECONDS.observe(time.perf_counter() - started_at)
         logger.debug(f"Données du capteur {data.get('capteur_id')} insérées avec succès")
         return True
-        
+    
     except Exception as e:
         logger.error(f"Erreur lors de l'insertion des données: {e}")
-        db_connection.rollback()
+        connection.rollback()
         return False
 
 
-def process_message(message_value: str) -> bool:
+def _reading_key(row: RawRow) -> Tuple[Any, Any]:
+    """Clé (capteur_id, timestamp) d'une ligne, timestamps texte normalisés"""
+    timestamp = row[1]
+    if isinstance(timestamp, str):
+        try:
+            timestamp = datetime.fromisoformat(timestamp)
+        except ValueError:
+            pass
+    return row[0], timestamp
+
+
+def _upsert_clean_rows(cursor, clean_rows: List[silver_stream.CleanRow]) -> None:
+    """Écrit des lignes nettoyées dans clean_sensor_data (dans la transaction en cours)"""
+    unique_rows = list({_reading_key(row): row for row in clean_rows}.values())
+    execute_values(cursor, """
+        INSERT INTO clean_sensor_data
+        (capteur_id, timestamp, temperature, humidite, humidite_sol, niveau_ph, luminosite, quality_flags)
+        VALUES %s
+        ON CONFLICT (capteur_id, timestamp) DO UPDATE SET
+            temperature = EXCLUDED.temperature,
+            humidite = EXCLUDED.humidite,
+            humidite_sol = EXCLUDED.humidite_sol,
+            niveau_ph = EXCLUDED.niveau_ph,
+            luminosite = EXCLUDED.luminosite,
+            quality_flags = EXCLUDED.quality_flags,
+            processed_at = NOW();
+    """, unique_rows, page_size=len(unique_rows))
+
+
+def upsert_raw_rows(cursor, rows: List[RawRow], cleaned: bool = False) -> int:
+    """
+    Écrit des lignes brutes dans raw_capteur_data (dans la transaction en
+    cours, sans commit), doublons du lot fusionnés
+    
+    Args:
+        cursor: Curseur de la transaction
+        rows: Lignes au format de insert_capteur_data_batch
+        cleaned: Marque les lignes is_cleaned (déjà nettoyées en continu)
+    
+    Returns:
+        Nombre de lignes écrites
+    """
+    unique_rows = list({_reading_key(row): row for row in rows}.values())
+    if not unique_rows:
+        return 0
+    
+    is_cleaned = "TRUE" if cleaned else "FALSE"
+    execute_values(cursor, """
+        INSERT INTO raw_capteur_data
+        (capteur_id, timestamp, temperature, humidite, humidite_sol, niveau_ph, luminosite, kafka_partition, is_cleaned)
+        VALUES %s
+        ON CONFLICT (capteur_id, timestamp) DO UPDATE SET
+            temperature = EXCLUDED.temperature,
+            humidite = EXCLUDED.humidite,
+            humidite_sol = EXCLUDED.humidite_sol,
+            niveau_ph = EXCLUDED.niveau_ph,
+            luminosite = EXCLUDED.luminosite,
+            is_cleaned = EXCLUDED.is_cleaned,
+            kafka_partition = EXCLUDED.kafka_partition;
+    """, unique_rows, template=f"(%s, %s, %s, %s, %s, %s, %s, %s, {is_cleaned})", page_size=len(unique_rows))
+    return len(unique_rows)
+
+
+def insert_capteur_data_batch(
+    rows: List[RawRow],
+    connection: Optional[psycopg2.extensions.connection] = None,
+    clean_rows: Optional[List[silver_stream.CleanRow]] = None
+) -> int:
+    """
+    Insère un lot de mesures en une seule requête multi-lignes et une transaction
+    
+    Une même clé (capteur_id, timestamp) ne pouvant être mise à jour deux fois
+    par un même INSERT ... ON CONFLICT, les doublons du lot sont d'abord
+    fusionnés (la dernière mesure reçue l'emporte).
+    
+    Args:
+        rows: Lignes (capteur_id, timestamp, temperature, humidite,
+            humidite_sol, niveau_ph, luminosite, kafka_partition)
+        connection: Connexion à utiliser (par défaut la connexion globale)
+        clean_rows: Lignes nettoyées du lot (mode Silver en continu): écrites
+            dans clean_sensor_data dans la même transaction, les lignes
+            brutes étant alors marquées is_cleaned
+    
+    Returns:
+        Nombre de lignes écrites
+    
+    Raises:
+        psycopg2.Error: si la requête échoue (la transaction est annulée)
+    """
+    connection = connection or db_connection
+    if not rows:
+        return 0
+    
+    started_at = time.perf_counter()
+    try:
+        with connection.cursor() as cursor:
+            written = upsert_raw_rows(cursor, rows, cleaned=bool(clean_rows))
+            if clean_rows:
+                _upsert_clean_rows(cursor, clean_rows)
+        connection.commit()
+    except psycopg2.Error:
+        connection.rollback()
+        raise
+    DB_INSERT_SECONDS.observe(time.perf_counter() - started_at)
+    return written
+
+
+def _ensure_staging_table(connection: psycopg2.extensions.connection) -> None:
+    """
+    Crée la table de staging du mode COPY sur une connexion
+    
+    Table temporaire: propre à la session (plusieurs consumers ne se gênent
+    pas), jamais journalisée dans le WAL et vidée à chaque commit.
+    """
+    if connection in _staging_connections:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS raw_capteur_data_stage (
+                seq INTEGER NOT NULL,
+                capteur_id VARCHAR(50),
+                timestamp TIMESTAMPTZ,
+                temperature DOUBLE PRECISION,
+                humidite DOUBLE PRECISION,
+                humidite_sol DOUBLE PRECISION,
+                niveau_ph DOUBLE PRECISION,
+                luminosite DOUBLE PRECISION,
+                kafka_partition SMALLINT
+            ) ON COMMIT DELETE ROWS;
+        """)
+    connection.commit()
+    _staging_connections.add(connection)
+
+
+def copy_capteur_data_batch(
+    rows: List[RawRow],
+    connection: Optional[psycopg2.extensions.connection] = None,
+    clean_rows: Optional[List[silver_stream.CleanRow]] = None
+) -> int:
+    """
+    Écrit un lot de mesures par COPY vers la table de staging, puis les
+    fusionne dans raw_capteur_data en une seule requête ensembliste
+    
+    Les doublons du lot sont résolus par la fusion: pour chaque clé
+    (capteur_id, timestamp), seule la dernière ligne reçue est retenue.
+    
+    Args:
+        rows: Lignes au format de insert_capteur_data_batch
+        connection: Connexion à utiliser (par défaut la connexion globale)
+        clean_rows: Lignes nettoyées du lot (voir insert_capteur_data_batch)
+    
+    Returns:
+        Nombre de lignes écrites ou mises à jour
+    
+    Raises:
+        psycopg2.Error: si la copie ou la fusion échoue (la transaction est annulée)
+    """
+    connection = connection or db_connection
+    if not rows:
+        return 0
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for seq, row in enumerate(rows):
+        writer.writerow((seq, *row))
+    buffer.seek(0)
+    
+    started_at = time.perf_counter()
+    try:
+        _ensure_staging_table(connection)
+        with connection.cursor() as cursor:
+            cursor.copy_expert("""
+                COPY raw_capteur_data_stage
+                (seq, capteur_id, timestamp, temperature, humidite, humidite_sol, niveau_ph, luminosite, kafka_partition)
+                FROM STDIN WITH (FORMAT csv)
+            """, buffer)
+            cursor.execute("""
+                INSERT INTO raw_capteur_data
+                (capteur_id, timestamp, temperature, humidite, humidite_sol, niveau_ph, luminosite, kafka_partition, is_cleaned)
+                SELECT DISTINCT ON (capteur_id, timestamp)
+                    capteur_id, timestamp, temperature, humidite, humidite_sol, niveau_ph, luminosite, kafka_partition, %s
+                FROM raw_capteur_data_stage
+                ORDER BY capteur_id, timestamp, seq DESC
+                ON CONFLICT (capteur_id, timestamp) DO UPDATE SET
+                    temperature = EXCLUDED.temperature,
+                    humidite = EXCLUDED.humidite,
+                    humidite_sol = EXCLUDED.humidite_sol,
+                    niveau_ph = EXCLUDED.niveau_ph,
+                    luminosite = EXCLUDED.luminosite,
+                    is_cleaned = EXCLUDED.is_cleaned,
+                    kafka_partition = EXCLUDED.kafka_partition;
+            """, (bool(clean_rows),))
+            written = cursor.rowcount
+            if clean_rows:
+                _upsert_clean_rows(cursor, clean_rows)
+        connection.commit()
+    except psycopg2.Error:
+        connection.rollback()
+        raise
+    DB_INSERT_SECONDS.observe(time.perf_counter() - started_at)
+    return written
+
+
+def check_message(
+    message_value: Union[str, bytes],
+    headers: Optional[List[Tuple[str, bytes]]] = None
+) -> Dict[str, Any]:
+    """
+    Décode et vérifie un message Kafka
+    
+    Args:
+        message_value: Valeur du message (JSON ou binaire selon les en-têtes)
+        headers: En-têtes Kafka du message (format et version du schéma)
+    
+    Returns:
+        Dictionnaire de la mesure
+    
+    Raises:
+        ValueError: si le message est illisible ou invalide (raison en message)
+    """
+    try:
+        data = codec.decode_reading(message_value, headers)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Erreur de décodage JSON: {e}") from e
+    except ValueError as e:
+        raise ValueError(f"Erreur de décodage du message: {e}") from e
+    
+    # Validation basique
+    if not isinstance(data, dict) or not data.get('capteur_id') or not data.get('timestamp'):
+        raise ValueError("Message invalide: capteur_id ou timestamp manquant")
+    return data
+
+
+def decode_message(
+    message_value: Union[str, bytes],
+    headers: Optional[List[Tuple[str, bytes]]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Décode et vérifie un message Kafka
+    
+    Args:
+        message_value: Valeur du message (JSON ou binaire selon les en-têtes)
+        headers: En-têtes Kafka du message (format et version du schéma)
+    
+    Returns:
+        Dictionnaire de la mesure, ou None si le message est illisible ou invalide
+    """
+    try:
+        return check_message(message_value, headers)
+    except ValueError as e:
+        logger.error(str(e))
+        return None
+
+
+def decode_messages(messages: list) -> Tuple[List[Reading], List[DeadLetter]]:
+    """
+    Décode un lot de messages Kafka
+    
+    Args:
+        messages: Messages renvoyés par consume()
+    
+    Returns:
+        Mesures décodées (avec leur partition et leur message d'origine) et
+        messages écartés
+    """
+    readings: List[Reading] = []
+    rejected: List[DeadLetter] = []
+    for msg in messages:
+        if msg.error():
+            if msg.error().code() == KafkaError._PARTITION_EOF:
+                logger.debug(f"Fin de partition atteinte: {msg.partition()}")
+            else:
+                logger.error(f"Erreur consumer: {msg.error()}")
+            continue
+        try:
+            readings.append((check_message(msg.value(), msg.headers()), msg.partition(), msg))
+        except ValueError as e:
+            rejected.append(dead_letter.from_message(msg, str(e)))
+    return readings, rejected
+
+
+def process_message(
+    message_value: Union[str, bytes],
+    partition: Optional[int] = None,
+    headers: Optional[List[Tuple[str, bytes]]] = None
+) -> bool:
     """
     Traite un message Kafka et l'insère dans la base de données
     
     Args:
-        message_value: Valeur du message (JSON string)
+        message_value: Valeur du message (JSON ou binaire selon les en-têtes)
+        partition: Partition Kafka d'origine du message
+        headers: En-têtes Kafka du message (format et version du schéma)
     
     Returns:
         True si le traitement a réussi, False sinon
     """
     try:
-        data = json.loads(message_value)
-        logger.info(f"Traitement du message pour le capteur: {data.get('capteur_id')}")
-        
-        # Validation basique
-        if not data.get('capteur_id') or not data.get('timestamp'):
-            logger.warning("Message invalide: capteur_id ou timestamp manquant")
+        data = decode_message(message_value, headers)
+        if data is None:
             return False
+        logger.debug(f"Traitement du message pour le capteur: {data.get('capteur_id')}")
         
         # Insertion dans la base de données
-        return insert_capteur_data(data)
-        
-    except json.JSONDecodeError as e:
-        logger.error(f"Erreur de décodage JSON: {e}")
-        return False
+        return insert_capteur_data(data, partition)
+    
     except Exception as e:
         logger.error(f"Erreur lors du traitement du message: {e}")
         return False
 
 
-def connect_consumer(max_retries: int = 5, retry_delay: int = 5) -> Consumer:
+def _to_row(data: Dict[str, Any], partition: Optional[int]) -> RawRow:
+    """Convertit une mesure décodée en ligne pour insert_capteur_data_batch"""
+    return (
+        data.get('capteur_id'),
+        data.get('timestamp'),
+        data.get('temperature'),
+        data.get('humidite'),
+        data.get('humidite_sol'),
+        data.get('niveau_ph'),
+        data.get('luminosite'),
+        partition
+    )
+
+
+def _reconnect_database() -> None:
+    """Remplace une connexion à la base devenue inutilisable"""
+    global db_connection
+    
+    try:
+        db_connection.close()
+    except psycopg2.Error:
+        pass
+    try:
+        db_connection = connect_to_database(max_retries=1)
+    except psycopg2.OperationalError:
+        pass
+
+
+def _clean_rows(
+    rows: List[RawRow],
+    connection: Optional[psycopg2.extensions.connection]
+) -> Tuple[List[Optional[silver_stream.CleanRow]], Optional[Dict[Any, silver_stream.Measures]]]:
+    """
+    Nettoie des lignes brutes en mode Silver en continu (voir silver_stream)
+    
+    Si la base refuse la lecture de l'état des capteurs, les lignes sont
+    écrites sans nettoyage (is_cleaned à FALSE): l'ETL les nettoiera.
+    
+    Returns:
+        Lignes nettoyées (None sans nettoyage) et nouvel état des capteurs
+        (None sans nettoyage)
+    
+    Raises:
+        psycopg2.OperationalError, psycopg2.InterfaceError: si la base est indisponible
+    """
+    if silver_cleaner is None:
+        return [None] * len(rows), None
+    connection = connection or db_connection
+    try:
+        return silver_cleaner.clean(rows, connection)
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        raise
+    except psycopg2.Error as e:
+        connection.rollback()
+        logger.error(f"Nettoyage Silver impossible ({e}), {len(rows)} mesures laissées à l'ETL")
+        return [None] * len(rows), None
+
+
+def _write_readings(
+    readings: List[Reading],
+    connection: Optional[psycopg2.extensions.connection]
+) -> Tuple[int, List[DeadLetter]]:
+    """
+    Écrit des mesures décodées; si la base rejette le lot à cause d'une ligne
+    invalide, les mesures sont réinsérées une à une afin que la ligne fautive
+    ne bloque pas les autres
+    
+    Returns:
+        Nombre de mesures enregistrées et mesures rejetées par la base
+    
+    Raises:
+        psycopg2.OperationalError, psycopg2.InterfaceError: si la base est indisponible
+    """
+    if not readings:
+        return 0, []
+    
+    rows = [_to_row(data, partition) for data, partition, _ in readings]
+    clean_rows, state = _clean_rows(rows, connection)
+    
+    write_rows = copy_capteur_data_batch if CONSUMER_WRITE_MODE == "copy" else insert_capteur_data_batch
+    try:
+        write_rows(rows, connection, clean_rows if state is not None else None)
+        if state is not None:
+            silver_cleaner.commit(state)
+        return len(rows), []
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        raise
+    except psycopg2.Error as e:
+        logger.warning(f"Lot de {len(rows)} mesures rejeté par la base ({e}), insertion ligne par ligne")
+    
+    stored = 0
+    refused: List[DeadLetter] = []
+    for (data, partition, msg), row in zip(readings, rows):
+        # Renettoyée depuis l'état des seules mesures enregistrées: les lignes
+        # nettoyées du lot supposaient que toutes ses mesures le seraient
+        clean_row, row_state = _clean_rows([row], connection) if state is not None else ([None], None)
+        try:
+            insert_capteur_data_batch([row], connection, clean_row if row_state is not None else None)
+            if row_state is not None:
+                silver_cleaner.commit(row_state)
+            stored += 1
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            raise
+        except psycopg2.Error as e:
+            reason = f"Rejet de la base: {str(e).strip()}"
+            refused.append(
+                dead_letter.from_message(msg, reason) if msg is not None
+                else dead_letter.from_reading(data, partition, reason)
+            )
+    return stored, refused
+
+
+def write_batch(
+    readings: List[Reading],
+    connection: Optional[psycopg2.extensions.connection] = None,
+    rejected: Optional[List[DeadLetter]] = None
+) -> int:
+    """
+    Écrit un lot de mesures décodées et met en quarantaine les messages écartés
+    
+    Tant que la base est indisponible, le lot est réessayé sur la connexion
+    globale (les offsets ne sont pas committés, rien n'est perdu); avec une
+    connexion fournie, l'erreur est remontée à l'appelant qui la remplace.
+    Les mesures rejetées par la base rejoignent les messages écartés au
+    décodage dans la quarantaine (voir dead_letter): au retour, tous les
+    messages du lot sont enregistrés ou en quarantaine et leurs offsets
+    peuvent être committés.
+    
+    Args:
+        readings: Mesures décodées (voir decode_messages)
+        connection: Connexion à utiliser (par défaut la connexion globale)
+        rejected: Messages écartés au décodage (voir decode_messages)
+    
+    Returns:
+        Nombre de mesures enregistrées
+    """
+    while True:
+        try:
+            stored, refused = _write_readings(readings, connection)
+            dead_letter.quarantine((rejected or []) + refused, connection or db_connection)
+            return stored
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            if connection is not None or stop_requested.is_set():
+                raise
+            logger.error(f"Base de données indisponible ({e}), nouvel essai dans {DB_RETRY_DELAY}s")
+            time.sleep(DB_RETRY_DELAY)
+            _reconnect_database()
+
+
+def _commit_offsets(messages: list) -> None:
+    """Committe, pour chaque partition du lot, l'offset qui suit le dernier message"""
+    offsets: Dict[Tuple[str, int], int] = {}
+    for msg in messages:
+        if msg.error() is None:
+            key = (msg.topic(), msg.partition())
+            offsets[key] = max(offsets.get(key, 0), msg.offset() + 1)
+    if not offsets:
+        return
+    
+    try:
+        consumer.commit(
+            offsets=[TopicPartition(topic, partition, offset) for (topic, partition), offset in offsets.items()],
+            asynchronous=False
+        )
+    except KafkaException as e:
+        # Partition réattribuée entre-temps: son nouveau propriétaire relira
+        # ces messages, l'upsert rendant la réécriture sans effet
+        logger.warning(f"Échec du commit des offsets du lot: {e}")
+
+
+def _on_revoke(consumer: Consumer, partitions: list) -> None:
+    # Chaque lot est écrit et committé avant l'appel suivant à consume(), seul
+    # moment où un rééquilibrage est signalé: il ne reste rien à vider ici
+    logger.info(f"Partitions révoquées: {[partition.partition for partition in partitions]}")
+
+
+def _on_assign(consumer: Consumer, partitions: list) -> None:
+    logger.info(f"Partitions assignées: {[partition.partition for partition in partitions]}")
+
+
+def connect_consumer(
+    max_retries: int = 5, retry_delay: int = 5, on_revoke=_on_revoke, on_assign=_on_assign
+) -> Consumer:
     """
     Établit la connexion au consumer Kafka avec retry logic
     
     Args:
         max_retries: Nombre maximum de tentatives de connexion
         retry_delay: Délai en secondes entre chaque tentative
+        on_revoke: Callback appelé avant la révocation de partitions (rééquilibrage)
+        on_assign: Callback appelé après l'attribution de partitions
     
     Returns:
         Consumer Kafka
@@ -203,7 +758,7 @@ def connect_consumer(max_retries: int = 5, retry_delay: int = 5) -> Consumer:
     for attempt in range(max_retries):
         try:
             consumer = Consumer(consumer_config)
-            consumer.subscribe([KAFKA_TOPIC])
+            consumer.subscribe([KAFKA_TOPIC], on_assign=on_assign, on_revoke=on_revoke)
             logger.info(f"Consumer connecté à Kafka: {KAFKA_BOOTSTRAP_SERVERS}, topic: {KAFKA_TOPIC}")
             return consumer
         except KafkaException as e:
@@ -216,6 +771,68 @@ def connect_consumer(max_retries: int = 5, retry_delay: int = 5) -> Consumer:
                 raise
 
 
+def _consume_single() -> None:
+    """Boucle historique: un poll, une insertion et un commit par message"""
+    while not stop_requested.is_set():
+        msg = consumer.poll(timeout=1.0)
+        
+        if msg is None:
+            continue
+        
+        if msg.error():
+            if msg.error().code() == KafkaError._PARTITION_EOF:
+                logger.debug(f"Fin de partition atteinte: {msg.partition()}")
+            else:
+                logger.error(f"Erreur consumer: {msg.error()}")
+            continue
+        
+        # Traiter le message
+        received_at = time.perf_counter()
+        logger.debug(f"Message reçu: offset={msg.offset()}, partition={msg.partition()}")
+        
+        # Un message en échec est mis en quarantaine: il est committé comme
+        # les autres au lieu d'être relu à chaque redémarrage
+        readings, rejected = decode_messages([msg])
+        stored = write_batch(readings, rejected=rejected)
+        consumer.commit(msg)
+        POLL_TO_COMMIT_SECONDS.observe(time.perf_counter() - received_at)
+        consumer_stats.observe_end_to_end([msg], readings)
+        _INSERTED.inc(stored)
+        _FAILED.inc(1 - stored)
+        logger.debug("Message committé avec succès")
+
+
+def _consume_batches() -> None:
+    """
+    Boucle par lots: jusqu'à CONSUMER_BATCH_SIZE messages ou CONSUMER_BATCH_TIMEOUT_MS
+    d'attente, une requête multi-lignes, une transaction et un commit d'offsets par lot
+    """
+    timeout = CONSUMER_BATCH_TIMEOUT_MS / 1000
+    
+    while not stop_requested.is_set():
+        messages = consumer.consume(num_messages=CONSUMER_BATCH_SIZE, timeout=timeout)
+        if not messages:
+            continue
+        
+        received_at = time.perf_counter()
+        readings, rejected = decode_messages(messages)
+        stored = write_batch(readings, rejected=rejected)
+        _commit_offsets(messages)
+        
+        POLL_TO_COMMIT_SECONDS.observe(time.perf_counter() - received_at)
+        consumer_stats.observe_end_to_end(messages, readings)
+        BATCH_MESSAGES.observe(len(messages))
+        _INSERTED.inc(stored)
+        _FAILED.inc(len(readings) + len(rejected) - stored)
+        logger.debug(f"Lot de {len(messages)} messages traité: {stored} mesures enregistrées")
+
+
+def _request_stop(signum, frame) -> None:
+    """Gestionnaire de SIGTERM/SIGINT: arrêt après le lot en cours"""
+    logger.info("Arrêt demandé, fin du traitement en cours...")
+    stop_requested.set()
+
+
 def start_consuming() -> None:
     """
     Démarre la boucle de consommation des messages Kafka
@@ -223,41 +840,38 @@ def start_consuming() -> None:
     global consumer, db_connection
     
     logger.info("Démarrage du consumer...")
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT)
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+    if consumer_stats.CONSUMER_STATS_INTERVAL_S > 0:
+        consumer_stats.SummaryReporter(_INSERTED, stop_requested).start()
     
     # Connexion à la base de données
     db_connection = connect_to_database()
     create_table_if_not_exists()
     
     # Connexion au consumer Kafka
-    consumer = connect_consumer()
+    if CONSUMER_MODE == "parallel":
+        # Imports locaux: ces moteurs s'appuient sur les fonctions de ce module
+        from .consumer_workers import ParallelConsumer
+        engine = ParallelConsumer()
+        consumer = engine.kafka_consumer
+    elif CONSUMER_MODE == "pipeline":
+        from .consumer_pipeline import StagedConsumer
+        engine = StagedConsumer()
+        consumer = engine.kafka_consumer
+    else:
+        consumer = connect_consumer()
     
     try:
-        logger.info("Consumer en attente de messages...")
-        while True:
-            msg = consumer.poll(timeout=1.0)
-            
-            if msg is None:
-                continue
-            
-            if msg.error():
-                if msg.error().code() == KafkaError._PARTITION_EOF:
-                    logger.debug(f"Fin de partition atteinte: {msg.partition()}")
-                else:
-                    logger.error(f"Erreur consumer: {msg.error()}")
-                continue
-            
-            # Traiter le message
-            message_value = msg.value().decode('utf-8')
-            logger.debug(f"Message reçu: offset={msg.offset()}, partition={msg.partition()}")
-            
-            if process_message(message_value):
-                # Commit seulement si le traitement a réussi
-                consumer.commit(msg)
-                logger.debug("Message committé avec succès")
-            else:
-                logger.warning(f"Échec du traitement du message, offset: {msg.offset()}")
-                # Option: implémenter une logique de dead letter queue ici
-                
+        logger.info(f"Consumer en attente de messages (mode {CONSUMER_MODE})...")
+        if CONSUMER_MODE == "single":
+            _consume_single()
+        elif CONSUMER_MODE in ("parallel", "pipeline"):
+            engine.run()
+        else:
+            _consume_batches()
     except KeyboardInterrupt:
         logger.info("Interruption par l'utilisateur...")
     except Exception as e:
@@ -275,20 +889,14 @@ def cleanup() -> None:
     logger.info("Nettoyage des ressources...")
     
     if consumer is not None:
+        # Quitte le groupe immédiatement: les partitions sont réattribuées sans
+        # attendre l'expiration de la session
         consumer.close()
         logger.info("Consumer Kafka fermé")
     
+    dead_letter.close()
+    
     if db_connection is not None:
         db_connection.close()
         logger.info("Connexion à la base de données fermée")
 
-
-if __name__ == "__main__":
-    # Configuration du logging
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    
-    logger.info("=== Consumer AgroTrace démarré ===")
-    start_consuming()
\ No newline at end of file
@@ -0,0 +1,28 @@
+"""
+Point d'entrée du consumer: python -m app.consumer_main
+
+Le module app.consumer est importé sous son nom de paquet, une seule fois:
+les moteurs parallel et pipeline (consumer_workers, consumer_pipeline)
+partagent ainsi son état (demande d'arrêt, métriques).
+"""
+
+import logging
+
+from . import consumer
+
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    # Configuration du logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
+    logger.info("=== Consumer AgroTrace démarré ===")
+    consumer.start_consuming()
+
+
+if __name__ == "__main__":
+    main()
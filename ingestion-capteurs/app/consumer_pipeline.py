@@ -0,0 +1,193 @@
+"""
+Consumer en pipeline asyncio: lecture → décodage → écriture
+
+Les trois étapes tournent en parallèle, reliées par des files bornées: pendant
+que le lot N est écrit en base, le lot N+1 est décodé et le lot N+2 lu depuis
+Kafka. Les appels bloquants (consume() de librdkafka, requêtes psycopg2) sont
+exécutés dans des threads dédiés; la boucle d'événements ne fait que le
+décodage et l'ordonnancement. L'écriture reste séquentielle, ce qui conserve
+l'ordre des lots et permet de committer les offsets au fil de l'eau.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from agrotrace_common import metrics
+from confluent_kafka import Consumer, KafkaException, TopicPartition
+
+from . import consumer as base_consumer
+from . import consumer_stats
+
+logger = logging.getLogger(__name__)
+
+# Lots en attente entre deux étapes avant de suspendre l'étape amont
+CONSUMER_PIPELINE_QUEUE_SIZE = int(os.getenv("CONSUMER_PIPELINE_QUEUE_SIZE", "4"))
+
+STAGE_SECONDS = metrics.Histogram(
+    "consumer_stage_seconds",
+    "Durée de chaque étape du pipeline consumer (fetch, decode, write)",
+    ["stage"]
+)
+PIPELINE_QUEUE_DEPTH = metrics.Gauge(
+    "consumer_pipeline_queue_depth",
+    "Lots en attente à l'entrée de chaque étape du pipeline consumer",
+    ["queue"]
+)
+
+_INSERTED = base_consumer.CONSUMER_MESSAGES.labels("inserted")
+_FAILED = base_consumer.CONSUMER_MESSAGES.labels("failed")
+
+PartitionKey = Tuple[str, int]
+
+
+def _to_topic_partitions(offsets: Dict[PartitionKey, int]) -> List[TopicPartition]:
+    return [TopicPartition(topic, partition, offset) for (topic, partition), offset in offsets.items()]
+
+
+class StagedConsumer:
+    """Pipeline fetch → decode → write relié par des files asyncio bornées"""
+    
+    def __init__(self, queue_size: int = CONSUMER_PIPELINE_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.kafka_consumer = base_consumer.connect_consumer(on_revoke=self._on_revoke)
+        self._fetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="consumer-fetch")
+        # Un seul thread d'écriture: la connexion globale n'est jamais partagée
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="consumer-db")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._decode_queue: Optional[asyncio.Queue] = None
+        self._write_queue: Optional[asyncio.Queue] = None
+        # Offsets écrits en base, par partition (committés de manière asynchrone).
+        # Mis à jour par la boucle d'événements, relevés aussi par le thread de
+        # lecture lors d'une révocation: le verrou protège les deux accès.
+        self._written: Dict[PartitionKey, int] = {}
+        self._written_lock = threading.Lock()
+    
+    def run(self) -> None:
+        """Exécute le pipeline jusqu'à une demande d'arrêt"""
+        try:
+            asyncio.run(self._run())
+        finally:
+            self._fetch_executor.shutdown(wait=True)
+            self._db_executor.shutdown(wait=True)
+    
+    async def _run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._decode_queue = asyncio.Queue(maxsize=self.queue_size)
+        self._write_queue = asyncio.Queue(maxsize=self.queue_size)
+        PIPELINE_QUEUE_DEPTH.labels("decode").set_function(self._decode_queue.qsize)
+        PIPELINE_QUEUE_DEPTH.labels("write").set_function(self._write_queue.qsize)
+        
+        tasks = [
+            asyncio.create_task(self._fetch(), name="consumer-fetch"),
+            asyncio.create_task(self._decode(), name="consumer-decode"),
+            asyncio.create_task(self._write(), name="consumer-write"),
+        ]
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in pending:
+                task.cancel()
+            for task in done:
+                task.result()
+        finally:
+            self._loop = None
+            self._commit_written()
+    
+    async def _fetch(self) -> None:
+        """Étape 1: lecture des lots Kafka dans un thread dédié"""
+        timeout = base_consumer.CONSUMER_BATCH_TIMEOUT_MS / 1000
+        while not base_consumer.stop_requested.is_set():
+            started_at = time.perf_counter()
+            messages = await self._loop.run_in_executor(
+                self._fetch_executor, self.kafka_consumer.consume, base_consumer.CONSUMER_BATCH_SIZE, timeout
+            )
+            if not messages:
+                continue
+            received_at = time.perf_counter()
+            STAGE_SECONDS.labels("fetch").observe(received_at - started_at)
+            base_consumer.BATCH_MESSAGES.observe(len(messages))
+            await self._decode_queue.put((messages, received_at))
+        await self._decode_queue.put(None)
+    
+    async def _decode(self) -> None:
+        """Étape 2: décodage et validation des messages"""
+        while True:
+            item = await self._decode_queue.get()
+            try:
+                if item is None:
+                    await self._write_queue.put(None)
+                    return
+                
+                messages, received_at = item
+                started_at = time.perf_counter()
+                readings, rejected = base_consumer.decode_messages(messages)
+                offsets: Dict[PartitionKey, int] = {}
+                for msg in messages:
+                    if msg.error() is None:
+                        offsets[(msg.topic(), msg.partition())] = msg.offset() + 1
+                STAGE_SECONDS.labels("decode").observe(time.perf_counter() - started_at)
+                
+                await self._write_queue.put((messages, readings, rejected, offsets, received_at))
+            finally:
+                self._decode_queue.task_done()
+    
+    async def _write(self) -> None:
+        """Étape 3: écriture en base dans un thread dédié, puis commit asynchrone des offsets"""
+        while True:
+            item = await self._write_queue.get()
+            try:
+                if item is None:
+                    return
+                
+                messages, readings, rejected, offsets, received_at = item
+                started_at = time.perf_counter()
+                stored = await self._loop.run_in_executor(
+                    self._db_executor, base_consumer.write_batch, readings, None, rejected
+                )
+                STAGE_SECONDS.labels("write").observe(time.perf_counter() - started_at)
+                
+                with self._written_lock:
+                    self._written.update(offsets)
+                self._commit(offsets, asynchronous=True)
+                base_consumer.POLL_TO_COMMIT_SECONDS.observe(time.perf_counter() - received_at)
+                consumer_stats.observe_end_to_end(messages, readings)
+                _INSERTED.inc(stored)
+                _FAILED.inc(len(readings) + len(rejected) - stored)
+            finally:
+                self._write_queue.task_done()
+    
+    def _commit(self, offsets: Dict[PartitionKey, int], asynchronous: bool) -> None:
+        if not offsets:
+            return
+        try:
+            self.kafka_consumer.commit(offsets=_to_topic_partitions(offsets), asynchronous=asynchronous)
+        except KafkaException as e:
+            logger.warning(f"Échec du commit des offsets: {e}")
+    
+    def _commit_written(self, partitions: Optional[List[TopicPartition]] = None) -> None:
+        """Commit synchrone des offsets écrits (toutes les partitions ou seulement celles indiquées)"""
+        with self._written_lock:
+            if partitions is None:
+                offsets, self._written = self._written, {}
+            else:
+                keys = [(partition.topic, partition.partition) for partition in partitions]
+                offsets = {key: self._written.pop(key) for key in keys if key in self._written}
+        self._commit(offsets, asynchronous=False)
+    
+    async def _drain(self) -> None:
+        """Attend que les lots déjà lus soient décodés et écrits"""
+        await self._decode_queue.join()
+        await self._write_queue.join()
+    
+    def _on_revoke(self, kafka_consumer: Consumer, partitions: List[TopicPartition]) -> None:
+        # Appelé depuis consume(), dans le thread de lecture: la boucle
+        # d'événements continue de vider les étapes aval pendant l'attente
+        logger.info(f"Partitions révoquées: {[partition.partition for partition in partitions]}")
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._drain(), loop).result()
+        self._commit_written(partitions)
@@ -0,0 +1,159 @@
+"""
+Retard, débit et latence de bout en bout du consumer
+
+- Retard par partition: calculé par librdkafka (offset haut de la partition
+  moins dernier offset committé) et publié dans ses statistiques périodiques
+  (statistics.interval.ms); aucune requête supplémentaire au broker.
+- Latence de bout en bout: pour chaque message enregistré, durée depuis le
+  timestamp de la mesure (horloge du capteur) et depuis le timestamp du
+  message Kafka (production par l'API).
+- Un résumé (débit, retard, latences moyennes) est journalisé périodiquement.
+
+La latence est mesurée sur un échantillon (un message sur
+CONSUMER_LATENCY_SAMPLE_EVERY): l'analyse d'un timestamp ISO et deux
+observations coûtent quelques microsecondes, de l'ordre de l'écriture d'une
+ligne en base. Le reste est calculé à chaque intervalle, hors du chemin
+critique.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Sequence
+import json
+import logging
+import os
+import threading
+import time
+
+from confluent_kafka import TIMESTAMP_NOT_AVAILABLE
+
+from agrotrace_common import metrics
+
+logger = logging.getLogger(__name__)
+
+# Intervalle des statistiques librdkafka et du résumé journalisé (0 pour désactiver)
+CONSUMER_STATS_INTERVAL_S = float(os.getenv("CONSUMER_STATS_INTERVAL_S", "30"))
+CONSUMER_LATENCY_SAMPLE_EVERY = max(1, int(os.getenv("CONSUMER_LATENCY_SAMPLE_EVERY", "16")))
+
+PARTITION_LAG = metrics.Gauge(
+    "consumer_partition_lag",
+    "Messages restant à consommer par partition assignée (offset haut - offset committé)",
+    ["partition"]
+)
+END_TO_END_SECONDS = metrics.Histogram(
+    "consumer_end_to_end_seconds",
+    "Durée entre le timestamp d'une mesure (reading) ou de son message Kafka (kafka) et son enregistrement",
+    ["source"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+)
+_FROM_READING = END_TO_END_SECONDS.labels("reading")
+_FROM_KAFKA = END_TO_END_SECONDS.labels("kafka")
+
+_lock = threading.Lock()
+# partition -> retard, d'après les dernières statistiques librdkafka
+_lag: Dict[int, int] = {}
+
+
+def _epoch_seconds(timestamp: Any) -> Optional[float]:
+    """Timestamp d'une mesure (texte ISO 8601 ou datetime) en secondes epoch, UTC si sans fuseau"""
+    if isinstance(timestamp, str):
+        try:
+            timestamp = datetime.fromisoformat(timestamp)
+        except ValueError:
+            return None
+    if not isinstance(timestamp, datetime):
+        return None
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+def observe_end_to_end(messages: Sequence, readings: Sequence) -> None:
+    """
+    Observe la latence de bout en bout d'un lot qui vient d'être enregistré
+    
+    Args:
+        messages: Messages Kafka du lot
+        readings: Mesures décodées enregistrées (voir consumer.decode_messages)
+    """
+    now = time.time()
+    step = CONSUMER_LATENCY_SAMPLE_EVERY
+    for msg in messages[::step]:
+        timestamp_type, timestamp_ms = msg.timestamp()
+        if timestamp_type != TIMESTAMP_NOT_AVAILABLE:
+            # Horloges non synchronisées: une latence négative compte pour zéro
+            _FROM_KAFKA.observe(max(0.0, now - timestamp_ms / 1000))
+    for data, *_ in readings[::step]:
+        epoch = _epoch_seconds(data.get('timestamp'))
+        if epoch is not None:
+            _FROM_READING.observe(max(0.0, now - epoch))
+
+
+def on_stats(stats_json: str) -> None:
+    """Callback stats_cb de librdkafka: met à jour le retard des partitions assignées"""
+    stats = json.loads(stats_json)
+    lag: Dict[int, int] = {}
+    for topic in stats.get('topics', {}).values():
+        for partition_id, partition in topic.get('partitions', {}).items():
+            partition_id = int(partition_id)
+            # -1: partition interne de librdkafka; consumer_lag vaut -1 tant
+            # qu'aucun offset n'est connu
+            if partition_id < 0 or not partition.get('desired') or partition.get('consumer_lag', -1) < 0:
+                continue
+            lag[partition_id] = lag.get(partition_id, 0) + partition['consumer_lag']
+    
+    with _lock:
+        # Partitions révoquées: elles ne sont plus en retard pour ce consumer
+        for partition_id in _lag.keys() - lag.keys():
+            PARTITION_LAG.labels(str(partition_id)).set(0)
+        for partition_id, value in lag.items():
+            PARTITION_LAG.labels(str(partition_id)).set(value)
+        _lag.clear()
+        _lag.update(lag)
+
+
+def kafka_config() -> Dict[str, Any]:
+    """Options du consumer Kafka activant les statistiques de retard"""
+    if CONSUMER_STATS_INTERVAL_S <= 0:
+        return {}
+    return {
+        'statistics.interval.ms': int(CONSUMER_STATS_INTERVAL_S * 1000),
+        'stats_cb': on_stats
+    }
+
+
+class SummaryReporter(threading.Thread):
+    """Journalise périodiquement débit, retard et latences moyennes"""
+    
+    def __init__(self, inserted, stop_event: threading.Event, interval: float = CONSUMER_STATS_INTERVAL_S):
+        super().__init__(name="consumer-stats", daemon=True)
+        self.interval = interval
+        self._inserted = inserted
+        self._stop_event = stop_event
+    
+    def run(self) -> None:
+        last_at = time.monotonic()
+        last_inserted = self._inserted.value()
+        last_latency = {source: child.totals() for source, child in (("reading", _FROM_READING), ("kafka", _FROM_KAFKA))}
+        
+        while not self._stop_event.wait(self.interval):
+            now = time.monotonic()
+            inserted = self._inserted.value()
+            rate = (inserted - last_inserted) / (now - last_at)
+            last_at, last_inserted = now, inserted
+            
+            averages = {}
+            for source, child in (("reading", _FROM_READING), ("kafka", _FROM_KAFKA)):
+                totals = child.totals()
+                count = sum(totals[:-1]) - sum(last_latency[source][:-1])
+                total = totals[-1] - last_latency[source][-1]
+                averages[source] = f"{total / count:.3f}s" if count else "n/a"
+                last_latency[source] = totals
+            
+            with _lock:
+                lag = dict(_lag)
+            worst = max(lag.items(), key=lambda item: item[1]) if lag else None
+            logger.info(
+                f"Consumer: {rate:.0f} lignes/s, retard {sum(lag.values())} messages"
+                + (f" (max {worst[1]} sur la partition {worst[0]})" if worst else "")
+                + f", latence moyenne depuis la mesure {averages['reading']}, depuis Kafka {averages['kafka']}"
+            )
@@ -0,0 +1,282 @@
+"""
+Consumer parallèle: workers par partition et pool de connexions
+
+Le thread principal lit Kafka par lots et répartit les messages de chaque
+partition vers un worker (partition % nombre de workers): une partition est
+toujours traitée par le même worker, dans l'ordre. Chaque worker décode et
+écrit ses lots avec une connexion du pool; psycopg2 relâchant le GIL pendant
+les échanges avec la base, les écritures des différents workers se
+recouvrent. Le coordinateur de commit ne committe un offset qu'une fois le
+lot correspondant écrit.
+"""
+
+from typing import Dict, List, Optional, Set, Tuple
+import logging
+import os
+import queue
+import threading
+import time
+
+from confluent_kafka import Consumer, KafkaError, KafkaException, TopicPartition
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from agrotrace_common import metrics
+
+from . import consumer as base_consumer
+from . import consumer_stats
+
+logger = logging.getLogger(__name__)
+
+CONSUMER_WORKERS = int(os.getenv("CONSUMER_WORKERS", "4"))
+# Lots en attente par worker avant de suspendre la lecture de Kafka
+CONSUMER_WORKER_QUEUE_SIZE = int(os.getenv("CONSUMER_WORKER_QUEUE_SIZE", "8"))
+CONSUMER_COMMIT_INTERVAL_MS = int(os.getenv("CONSUMER_COMMIT_INTERVAL_MS", "1000"))
+# Attente maximale des workers lors d'une révocation, bien en deçà de max.poll.interval.ms
+CONSUMER_REVOKE_TIMEOUT_MS = int(os.getenv("CONSUMER_REVOKE_TIMEOUT_MS", "60000"))
+
+WORKER_QUEUE_DEPTH = metrics.Gauge(
+    "consumer_worker_queue_depth",
+    "Lots en attente dans la file de chaque worker",
+    ["worker"]
+)
+WORKER_BATCH_SECONDS = metrics.Histogram(
+    "consumer_worker_batch_seconds",
+    "Durée de traitement d'un lot par un worker (décodage et écriture)"
+)
+
+_INSERTED = base_consumer.CONSUMER_MESSAGES.labels("inserted")
+_FAILED = base_consumer.CONSUMER_MESSAGES.labels("failed")
+
+PartitionKey = Tuple[str, int]
+
+
+class CommitCoordinator:
+    """Offsets écrits en base, en attente de commit dans Kafka"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (topic, partition) -> (offset suivant le dernier message écrit, réception du plus ancien lot non committé)
+        self._completed: Dict[PartitionKey, Tuple[int, float]] = {}
+        # Partitions rendues avant la fin de leurs lots: les lots terminés ensuite ne sont pas committés
+        self._abandoned: Set[PartitionKey] = set()
+    
+    def complete(self, key: PartitionKey, next_offset: int, received_at: float) -> None:
+        """Enregistre qu'un lot d'une partition est écrit (appelé par les workers)"""
+        with self._lock:
+            if key in self._abandoned:
+                return
+            previous = self._completed.get(key)
+            self._completed[key] = (next_offset, previous[1] if previous else received_at)
+    
+    def commit(self, kafka_consumer: Consumer) -> None:
+        """Committe les offsets écrits depuis le dernier commit (thread principal)"""
+        with self._lock:
+            completed, self._completed = self._completed, {}
+        if not completed:
+            return
+        
+        try:
+            kafka_consumer.commit(
+                offsets=[TopicPartition(topic, partition, offset) for (topic, partition), (offset, _) in completed.items()],
+                asynchronous=False
+            )
+        except KafkaException as e:
+            # Partition réattribuée entre-temps: son nouveau propriétaire relira
+            # ces messages, l'upsert rendant la réécriture sans effet
+            logger.warning(f"Échec du commit des offsets: {e}")
+            return
+        
+        now = time.perf_counter()
+        for _, received_at in completed.values():
+            base_consumer.POLL_TO_COMMIT_SECONDS.observe(now - received_at)
+    
+    def forget(self, partitions: List[TopicPartition], abandoned: bool = False) -> None:
+        """
+        Oublie les offsets de partitions révoquées
+        
+        Args:
+            partitions: Partitions révoquées
+            abandoned: Lots encore en cours: leurs offsets ne seront pas committés,
+                le nouveau propriétaire des partitions relira les messages
+        """
+        with self._lock:
+            for partition in partitions:
+                key = (partition.topic, partition.partition)
+                self._completed.pop(key, None)
+                if abandoned:
+                    self._abandoned.add(key)
+    
+    def assign(self, partitions: List[TopicPartition]) -> None:
+        """Accepte de nouveau les offsets de partitions (ré)attribuées"""
+        with self._lock:
+            for partition in partitions:
+                self._abandoned.discard((partition.topic, partition.partition))
+
+
+class PartitionWorker(threading.Thread):
+    """Thread qui décode et écrit, dans l'ordre, les lots des partitions qui lui sont attribuées"""
+    
+    def __init__(self, index: int, pool: ThreadedConnectionPool, coordinator: CommitCoordinator, failed: threading.Event):
+        super().__init__(name=f"consumer-worker-{index}", daemon=True)
+        self.queue: queue.Queue = queue.Queue(maxsize=CONSUMER_WORKER_QUEUE_SIZE)
+        self._pool = pool
+        self._coordinator = coordinator
+        self._failed = failed
+        WORKER_QUEUE_DEPTH.labels(str(index)).set_function(self.queue.qsize)
+    
+    def run(self) -> None:
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                # Après un échec, les lots suivants ne sont plus traités ni
+                # committés: ils seront relus au redémarrage
+                if not self._failed.is_set():
+                    self._process(*item)
+            except Exception as e:
+                logger.critical(f"{self.name}: échec du traitement d'un lot: {e}", exc_info=True)
+                self._failed.set()
+            finally:
+                self.queue.task_done()
+    
+    def _process(self, key: PartitionKey, messages: list, received_at: float) -> None:
+        started_at = time.perf_counter()
+        readings, rejected = base_consumer.decode_messages(messages)
+        stored = self._write(readings, rejected)
+        self._coordinator.complete(key, messages[-1].offset() + 1, received_at)
+        # Mesuré à l'écriture: le commit suit au plus CONSUMER_COMMIT_INTERVAL_MS plus tard
+        consumer_stats.observe_end_to_end(messages, readings)
+        
+        WORKER_BATCH_SECONDS.observe(time.perf_counter() - started_at)
+        _INSERTED.inc(stored)
+        _FAILED.inc(len(readings) + len(rejected) - stored)
+    
+    def _write(self, readings: list, rejected: list) -> int:
+        """Écrit un lot avec une connexion du pool, en remplaçant les connexions perdues"""
+        while True:
+            connection = None
+            try:
+                connection = self._pool.getconn()
+                stored = base_consumer.write_batch(readings, connection, rejected)
+                self._pool.putconn(connection)
+                return stored
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if connection is not None:
+                    self._pool.putconn(connection, close=True)
+                if base_consumer.stop_requested.is_set():
+                    raise
+                logger.error(f"Base de données indisponible ({e}), nouvel essai dans {base_consumer.DB_RETRY_DELAY}s")
+                time.sleep(base_consumer.DB_RETRY_DELAY)
+
+
+class ParallelConsumer:
+    """Lecture Kafka dans le thread principal, écritures réparties sur des workers"""
+    
+    def __init__(self, workers: int = CONSUMER_WORKERS):
+        self.coordinator = CommitCoordinator()
+        self._failed = threading.Event()
+        self.pool = ThreadedConnectionPool(
+            minconn=1,
+            maxconn=workers,
+            host=base_consumer.DB_HOST,
+            port=base_consumer.DB_PORT,
+            database=base_consumer.DB_NAME,
+            user=base_consumer.DB_USER,
+            password=base_consumer.DB_PASSWORD
+        )
+        self.workers = [PartitionWorker(index, self.pool, self.coordinator, self._failed) for index in range(workers)]
+        self.kafka_consumer = base_consumer.connect_consumer(on_revoke=self._on_revoke, on_assign=self._on_assign)
+        logger.info(f"Consumer parallèle: {workers} workers, pool de {workers} connexions")
+    
+    def _wait_for_workers(self, timeout: float) -> List[PartitionWorker]:
+        """
+        Attend que les lots déjà répartis soient traités, au plus timeout secondes
+        
+        Returns:
+            Workers dont des lots restent en cours à l'échéance
+        """
+        deadline = time.monotonic() + timeout
+        pending = []
+        for worker in self.workers:
+            with worker.queue.all_tasks_done:
+                while worker.queue.unfinished_tasks:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        pending.append(worker)
+                        break
+                    worker.queue.all_tasks_done.wait(remaining)
+        return pending
+    
+    def _on_assign(self, kafka_consumer: Consumer, partitions: List[TopicPartition]) -> None:
+        base_consumer._on_assign(kafka_consumer, partitions)
+        self.coordinator.assign(partitions)
+    
+    def _on_revoke(self, kafka_consumer: Consumer, partitions: List[TopicPartition]) -> None:
+        # Appelé depuis consume(), donc dans le thread principal: on termine et
+        # on committe les lots en cours avant de rendre les partitions. Un worker
+        # bloqué (base indisponible) ne doit pas retenir le rééquilibrage au-delà
+        # de max.poll.interval.ms: ses partitions sont rendues sans commit.
+        logger.info(f"Partitions révoquées: {[partition.partition for partition in partitions]}")
+        pending = self._wait_for_workers(CONSUMER_REVOKE_TIMEOUT_MS / 1000)
+        if pending:
+            unfinished = [
+                partition for partition in partitions
+                if self.workers[partition.partition % len(self.workers)] in pending
+            ]
+            logger.warning(
+                f"Lots toujours en cours après {CONSUMER_REVOKE_TIMEOUT_MS} ms, partitions "
+                f"{[partition.partition for partition in unfinished]} rendues sans commit"
+            )
+            self.coordinator.forget(unfinished, abandoned=True)
+        self.coordinator.commit(kafka_consumer)
+        self.coordinator.forget(partitions)
+    
+    def _dispatch(self, messages: list) -> None:
+        """Regroupe les messages par partition et les confie au worker de chaque partition"""
+        received_at = time.perf_counter()
+        by_partition: Dict[PartitionKey, list] = {}
+        for msg in messages:
+            if msg.error():
+                if msg.error().code() == KafkaError._PARTITION_EOF:
+                    logger.debug(f"Fin de partition atteinte: {msg.partition()}")
+                else:
+                    logger.error(f"Erreur consumer: {msg.error()}")
+                continue
+            by_partition.setdefault((msg.topic(), msg.partition()), []).append(msg)
+        
+        for key, partition_messages in by_partition.items():
+            # Bloque si la file du worker est pleine (contre-pression sur la lecture)
+            self.workers[key[1] % len(self.workers)].queue.put((key, partition_messages, received_at))
+        base_consumer.BATCH_MESSAGES.observe(len(messages))
+    
+    def run(self) -> None:
+        """Boucle principale, jusqu'à une demande d'arrêt ou l'échec d'un worker"""
+        for worker in self.workers:
+            worker.start()
+        
+        timeout = base_consumer.CONSUMER_BATCH_TIMEOUT_MS / 1000
+        commit_interval = CONSUMER_COMMIT_INTERVAL_MS / 1000
+        last_commit = time.monotonic()
+        try:
+            while not base_consumer.stop_requested.is_set() and not self._failed.is_set():
+                messages = self.kafka_consumer.consume(num_messages=base_consumer.CONSUMER_BATCH_SIZE, timeout=timeout)
+                if messages:
+                    self._dispatch(messages)
+                if time.monotonic() - last_commit >= commit_interval:
+                    self.coordinator.commit(self.kafka_consumer)
+                    last_commit = time.monotonic()
+        finally:
+            self.close()
+        
+        if self._failed.is_set():
+            raise RuntimeError("Un worker du consumer a échoué, arrêt pour relecture des lots non committés")
+    
+    def close(self) -> None:
+        """Termine les lots en cours, committe leurs offsets et ferme le pool"""
+        for worker in self.workers:
+            worker.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.coordinator.commit(self.kafka_consumer)
+        self.pool.closeall()
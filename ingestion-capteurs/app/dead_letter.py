@@ -0,0 +1,216 @@
+"""
+Lettres mortes: messages que le consumer ne peut pas enregistrer
+
+Un message illisible, invalide ou refusé par la base n'est plus relu à chaque
+redémarrage: il est publié sur le topic capteur_data.dlq (avec la raison de
+l'échec en en-tête) et conservé dans la table capteur_quarantine, puis son
+offset est committé avec le reste du lot. Une fois la cause corrigée, les
+lignes en quarantaine sont réinjectées en masse avec `python -m app.replay`.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import json
+import logging
+import os
+import time
+
+from confluent_kafka import KafkaException, Producer
+import psycopg2
+from psycopg2.extras import Json, execute_values
+
+from . import kafka_admin
+
+logger = logging.getLogger(__name__)
+
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092")
+KAFKA_DLQ_TOPIC = os.getenv("KAFKA_DLQ_TOPIC", f"{os.getenv('KAFKA_TOPIC', 'capteur_data')}.dlq")
+KAFKA_DLQ_PARTITIONS = int(os.getenv("KAFKA_DLQ_PARTITIONS", "1"))
+KAFKA_TOPIC_REPLICATION_FACTOR = int(os.getenv("KAFKA_TOPIC_REPLICATION_FACTOR", "1"))
+DLQ_FLUSH_TIMEOUT = 10.0
+# Délai avant de revérifier le topic DLQ après un échec (broker indisponible)
+DLQ_TOPIC_RETRY_DELAY = 30.0
+
+REASON_HEADER = "dlq-reason"
+PARTITION_HEADER = "dlq-source-partition"
+OFFSET_HEADER = "dlq-source-offset"
+TOPIC_HEADER = "dlq-source-topic"
+
+QUARANTINE_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS capteur_quarantine (
+        id BIGSERIAL PRIMARY KEY,
+        quarantined_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        source_topic TEXT,
+        source_partition SMALLINT,
+        source_offset BIGINT,
+        reason TEXT NOT NULL,
+        payload BYTEA NOT NULL,
+        headers JSONB,
+        replayed_at TIMESTAMPTZ
+    );
+    CREATE INDEX IF NOT EXISTS idx_capteur_quarantine_pending
+        ON capteur_quarantine (id) WHERE replayed_at IS NULL;
+"""
+
+Headers = List[Tuple[str, bytes]]
+
+_producer: Optional[Producer] = None
+_topic_retry_at = 0.0
+
+
+class DeadLetter(NamedTuple):
+    """Message écarté, avec la raison de l'échec"""
+    payload: bytes
+    headers: Optional[Headers]
+    partition: Optional[int]
+    offset: Optional[int]
+    reason: str
+    topic: Optional[str] = None
+
+
+def from_message(msg, reason: str) -> DeadLetter:
+    """Lettre morte à partir d'un message Kafka (contenu, en-têtes et position d'origine conservés tels quels)"""
+    return DeadLetter(msg.value() or b'', msg.headers(), msg.partition(), msg.offset(), reason, msg.topic())
+
+
+def from_reading(data: Dict[str, Any], partition: Optional[int], reason: str) -> DeadLetter:
+    """Lettre morte à partir d'une mesure décodée hors Kafka (réencodée en JSON, sans offset)"""
+    payload = json.dumps(data, default=str).encode('utf-8')
+    return DeadLetter(payload, None, partition, None, reason)
+
+
+def encode_headers(headers: Optional[Headers]) -> Optional[List[List[str]]]:
+    """En-têtes Kafka au format JSON (valeurs en latin-1, sans perte)"""
+    if not headers:
+        return None
+    return [[name, (value or b'').decode('latin-1')] for name, value in headers]
+
+
+def decode_headers(headers: Optional[List[List[str]]]) -> Optional[Headers]:
+    """Inverse de encode_headers"""
+    if not headers:
+        return None
+    return [(name, value.encode('latin-1')) for name, value in headers]
+
+
+def _get_producer() -> Optional[Producer]:
+    """
+    Producer du topic de lettres mortes, créé au premier usage
+    
+    Le topic n'est vérifié qu'une fois; après un échec, la vérification
+    (jusqu'à 10 s d'attente du broker) n'est retentée qu'au bout de
+    DLQ_TOPIC_RETRY_DELAY secondes.
+    
+    Returns:
+        Producer, ou None si le topic DLQ est désactivé ou en attente d'un nouvel essai
+    
+    Raises:
+        KafkaException: si le topic ne peut pas être vérifié ou créé
+    """
+    global _producer, _topic_retry_at
+    
+    if not KAFKA_DLQ_TOPIC:
+        return None
+    if _producer is None:
+        if time.monotonic() < _topic_retry_at:
+            return None
+        try:
+            kafka_admin.ensure_topic(
+                KAFKA_BOOTSTRAP_SERVERS, KAFKA_DLQ_TOPIC, KAFKA_DLQ_PARTITIONS, KAFKA_TOPIC_REPLICATION_FACTOR
+            )
+        except KafkaException:
+            _topic_retry_at = time.monotonic() + DLQ_TOPIC_RETRY_DELAY
+            raise
+        _producer = Producer({
+            'bootstrap.servers': KAFKA_BOOTSTRAP_SERVERS,
+            'client.id': 'agrotrace-consumer-dlq',
+            'acks': 'all',
+            'enable.idempotence': True
+        })
+    return _producer
+
+
+def _publish(letters: List[DeadLetter]) -> None:
+    """Publie les lettres mortes sur le topic DLQ et attend leur livraison"""
+    try:
+        producer = _get_producer()
+    except KafkaException as e:
+        logger.error(
+            f"Topic {KAFKA_DLQ_TOPIC} indisponible ({e}), lettres mortes conservées en "
+            f"quarantaine seulement pendant {DLQ_TOPIC_RETRY_DELAY:.0f}s"
+        )
+        return
+    if producer is None:
+        return
+    
+    for letter in letters:
+        headers = list(letter.headers or [])
+        headers.append((REASON_HEADER, letter.reason.encode('utf-8')))
+        if letter.topic is not None:
+            headers.append((TOPIC_HEADER, letter.topic.encode('utf-8')))
+        if letter.partition is not None:
+            headers.append((PARTITION_HEADER, str(letter.partition).encode('ascii')))
+        if letter.offset is not None:
+            headers.append((OFFSET_HEADER, str(letter.offset).encode('ascii')))
+        try:
+            producer.produce(KAFKA_DLQ_TOPIC, letter.payload, headers=headers)
+        except (BufferError, KafkaException) as e:
+            logger.error(f"Publication sur {KAFKA_DLQ_TOPIC} impossible: {e}")
+    
+    remaining = producer.flush(DLQ_FLUSH_TIMEOUT)
+    if remaining:
+        # La table de quarantaine reste la référence pour la réinjection
+        logger.error(f"{remaining} lettres mortes non confirmées par {KAFKA_DLQ_TOPIC}")
+
+
+def quarantine(letters: List[DeadLetter], connection: psycopg2.extensions.connection) -> None:
+    """
+    Publie les lettres mortes sur le topic DLQ et les enregistre en quarantaine
+    
+    À appeler avant le commit des offsets du lot: une fois la fonction
+    terminée, les messages écartés peuvent être réinjectés sans relire Kafka.
+    
+    Args:
+        letters: Messages écartés
+        connection: Connexion à la base
+    
+    Raises:
+        psycopg2.Error: si l'enregistrement en quarantaine échoue
+    """
+    if not letters:
+        return
+    
+    _publish(letters)
+    
+    quarantined_at = datetime.now(timezone.utc)
+    rows = [
+        (quarantined_at, letter.topic, letter.partition, letter.offset, letter.reason,
+         psycopg2.Binary(letter.payload), Json(encode_headers(letter.headers)))
+        for letter in letters
+    ]
+    try:
+        with connection.cursor() as cursor:
+            execute_values(cursor, """
+                INSERT INTO capteur_quarantine
+                (quarantined_at, source_topic, source_partition, source_offset, reason, payload, headers)
+                VALUES %s
+            """, rows)
+        connection.commit()
+    except psycopg2.Error:
+        connection.rollback()
+        raise
+    
+    for letter in letters:
+        logger.warning(
+            f"Message mis en quarantaine ({letter.topic} partition {letter.partition}, "
+            f"offset {letter.offset}): {letter.reason}"
+        )
+
+
+def close() -> None:
+    """Vide et libère le producer du topic DLQ"""
+    global _producer
+    
+    if _producer is not None:
+        _producer.flush(DLQ_FLUSH_TIMEOUT)
+        _producer = None
@@ -0,0 +1,108 @@
+"""
+Fenêtre de déduplication des mesures
+
+Certaines passerelles renvoient plusieurs fois la même mesure. Chaque copie
+coûte un message Kafka et un upsert en base; on mémorise donc les clés
+(capteur_id, timestamp) publiées récemment pour écarter les doublons avant
+le broker. La mémoire est bornée par une durée de rétention et un nombre
+maximum de clés (les plus anciennes sont évincées en premier).
+
+Le cache est utilisé depuis la boucle d'événements de l'API uniquement: il
+n'est pas protégé contre les accès concurrents depuis plusieurs threads.
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+from typing import Hashable, Tuple
+import os
+import time
+
+from agrotrace_common import metrics
+
+DEDUP_WINDOW_SECONDS = float(os.getenv("DEDUP_WINDOW_SECONDS", "300"))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "100000"))
+
+DEDUP_LOOKUPS = metrics.Counter(
+    "ingestion_dedup_lookups_total",
+    "Recherches dans la fenêtre de déduplication (hit = doublon écarté)",
+    ["result"]
+)
+_HITS = DEDUP_LOOKUPS.labels("hit")
+_MISSES = DEDUP_LOOKUPS.labels("miss")
+
+
+def reading_key(capteur_id: str, timestamp: datetime) -> Tuple[str, datetime]:
+    """Clé d'unicité d'une mesure, identique à la clé primaire de raw_capteur_data"""
+    return capteur_id, timestamp
+
+
+class DedupCache:
+    """Ensemble de clés à durée de vie limitée, ordonné par date d'insertion"""
+    
+    def __init__(self, window_seconds: float = DEDUP_WINDOW_SECONDS, max_entries: int = DEDUP_MAX_ENTRIES):
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, float]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.window_seconds > 0 and self.max_entries > 0
+    
+    def is_duplicate(self, key: Hashable) -> bool:
+        """
+        Indique si la clé a déjà été publiée dans la fenêtre
+        
+        Args:
+            key: Clé de la mesure (voir reading_key)
+        
+        Returns:
+            True si la mesure est un doublon à écarter
+        """
+        if not self.enabled:
+            return False
+        added_at = self._entries.get(key)
+        if added_at is not None and time.monotonic() - added_at < self.window_seconds:
+            self.hits += 1
+            _HITS.inc()
+            return True
+        self.misses += 1
+        _MISSES.inc()
+        return False
+    
+    def add(self, key: Hashable) -> None:
+        """Mémorise une clé publiée, en évinçant les clés expirées ou en surnombre"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        self._entries.pop(key, None)
+        self._entries[key] = now
+        
+        # Les clés sont ordonnées par date d'insertion: les expirées sont en tête
+        expired_before = now - self.window_seconds
+        while self._entries:
+            oldest_key, added_at = next(iter(self._entries.items()))
+            if added_at > expired_before and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[oldest_key]
+            self.evictions += 1
+    
+    def discard(self, key: Hashable) -> None:
+        """Oublie une clé (publication échouée: le renvoi doit être accepté)"""
+        self._entries.pop(key, None)
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def stats(self) -> dict:
+        """Taille de la fenêtre et taux de doublons écartés"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,52 @@
+"""
+Administration des topics Kafka, partagée par l'API (kafka_producer) et le
+consumer (dead_letter) sans que l'un n'importe les métriques de l'autre
+"""
+
+import logging
+
+from confluent_kafka import KafkaError, KafkaException
+from confluent_kafka.admin import AdminClient, NewTopic
+
+logger = logging.getLogger(__name__)
+
+ADMIN_TIMEOUT = 10
+
+
+def ensure_topic(bootstrap_servers: str, topic: str, num_partitions: int, replication_factor: int) -> None:
+    """
+    Crée le topic avec le nombre de partitions configuré s'il n'existe pas
+    
+    Le nombre de partitions d'un topic existant n'est jamais modifié: l'augmenter
+    changerait la partition (et donc le shard) de capteurs déjà en circulation.
+    
+    Args:
+        bootstrap_servers: Brokers Kafka
+        topic: Nom du topic
+        num_partitions: Nombre de partitions souhaité
+        replication_factor: Facteur de réplication à la création
+    
+    Raises:
+        KafkaException: si le broker ne répond pas ou refuse la création
+    """
+    admin = AdminClient({'bootstrap.servers': bootstrap_servers})
+    metadata = admin.list_topics(timeout=ADMIN_TIMEOUT)
+    existing = metadata.topics.get(topic)
+    
+    if existing is not None and existing.error is None:
+        if len(existing.partitions) != num_partitions:
+            logger.warning(
+                f"Le topic {topic} a {len(existing.partitions)} partitions "
+                f"({num_partitions} configurées), le partitionnement existant est conservé"
+            )
+        return
+    
+    futures = admin.create_topics([
+        NewTopic(topic, num_partitions=num_partitions, replication_factor=replication_factor)
+    ])
+    try:
+        futures[topic].result(timeout=ADMIN_TIMEOUT)
+        logger.info(f"Topic {topic} créé avec {num_partitions} partitions")
+    except KafkaException as e:
+        if e.args[0].code() != KafkaError.TOPIC_ALREADY_EXISTS:
+            raise
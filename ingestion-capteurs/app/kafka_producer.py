@@ -1,38 +1,222 @@
-from confluent_kafka import Producer, KafkaException
+from confluent_kafka import Producer, KafkaException, KafkaError
+import asyncio
+import functools
+import itertools
 import os
 import logging
+import threading
 import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Union
+
+from agrotrace_common import metrics
+from . import kafka_admin
+from .spill import SpillLog
 
 logger = logging.getLogger(__name__)
 
 KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092")
+KAFKA_TOPIC = os.getenv("KAFKA_TOPIC", "capteur_data")
+
+# Partitionnement par capteur: la clé de chaque message est le capteur_id.
+# murmur2_random reproduit le partitionneur du client Java, ce qui garantit
+# qu'un capteur tombe sur la même partition quel que soit le producteur.
+KAFKA_PARTITIONER = os.getenv("KAFKA_PARTITIONER", "murmur2_random")
+KAFKA_TOPIC_PARTITIONS = int(os.getenv("KAFKA_TOPIC_PARTITIONS", "6"))
+KAFKA_TOPIC_REPLICATION_FACTOR = int(os.getenv("KAFKA_TOPIC_REPLICATION_FACTOR", "1"))
+
+# Réglages du batching côté producer: les requêtes concurrentes partagent les lots envoyés au broker
+KAFKA_LINGER_MS = int(os.getenv("KAFKA_LINGER_MS", "5"))
+KAFKA_BATCH_SIZE = int(os.getenv("KAFKA_BATCH_SIZE", "131072"))  # octets par lot et par partition
+KAFKA_COMPRESSION_TYPE = os.getenv("KAFKA_COMPRESSION_TYPE", "lz4")
+KAFKA_DELIVERY_TIMEOUT_MS = int(os.getenv("KAFKA_DELIVERY_TIMEOUT_MS", "30000"))
+
+# Délai d'attente (secondes) quand la file locale du producer est pleine
+BUFFER_FULL_RETRY_DELAY = 0.05
+BUFFER_FULL_MAX_RETRIES = 20
+
+# Journal de débordement sur disque (vide pour le désactiver)
+KAFKA_SPILL_DIR = os.getenv("KAFKA_SPILL_DIR", "spill")
+KAFKA_SPILL_MAX_BYTES = int(os.getenv("KAFKA_SPILL_MAX_BYTES", str(1024 ** 3)))
+KAFKA_SPILL_SEGMENT_BYTES = int(os.getenv("KAFKA_SPILL_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+KAFKA_SPILL_DRAIN_BATCH = int(os.getenv("KAFKA_SPILL_DRAIN_BATCH", "500"))
+SPILL_RETRY_MIN_DELAY = 0.5
+SPILL_RETRY_MAX_DELAY = 10.0
+
+# Erreurs de livraison liées à l'indisponibilité du broker: le message est
+# alors conservé dans le journal plutôt que perdu
+SPILLABLE_ERRORS = {
+    KafkaError._MSG_TIMED_OUT,
+    KafkaError._TIMED_OUT,
+    KafkaError._TRANSPORT,
+    KafkaError._ALL_BROKERS_DOWN,
+    KafkaError.NOT_ENOUGH_REPLICAS,
+    KafkaError.NOT_ENOUGH_REPLICAS_AFTER_APPEND,
+    KafkaError.LEADER_NOT_AVAILABLE,
+    KafkaError.NOT_LEADER_FOR_PARTITION,
+    KafkaError.REQUEST_TIMED_OUT,
+}
 
 producer_config = {
     'bootstrap.servers': KAFKA_BOOTSTRAP_SERVERS,
     'client.id': 'agrotrace-ingestion-producer',
     'acks': 'all',  # Attendre la confirmation de tous les réplicas
     'retries': 3,   # Nombre de tentatives en cas d'échec
-    'enable.idempotence': True  # Éviter les doublons
+    'enable.idempotence': True,  # Éviter les doublons
+    'partitioner': KAFKA_PARTITIONER,
+    'linger.ms': KAFKA_LINGER_MS,
+    'batch.size': KAFKA_BATCH_SIZE,
+    'compression.type': KAFKA_COMPRESSION_TYPE,
+    'message.timeout.ms': KAFKA_DELIVERY_TIMEOUT_MS
 }
 
+Headers = List[Tuple[str, bytes]]
+
+# Moyenne glissante (exponentielle) de la latence produce -> accusé de livraison
+DELIVERY_LATENCY_SMOOTHING = 0.1
+
+DELIVERY_SECONDS = metrics.Histogram(
+    "kafka_produce_delivery_seconds",
+    "Latence entre produce() et l'accusé de livraison du broker"
+)
+PRODUCER_MESSAGES = metrics.Counter(
+    "kafka_producer_messages_total",
+    "Messages traités par le producer, par issue",
+    ["result"]
+)
+_DELIVERED = PRODUCER_MESSAGES.labels("delivered")
+_FAILED = PRODUCER_MESSAGES.labels("failed")
+_SPILLED = PRODUCER_MESSAGES.labels("spilled")
+_DRAINED = PRODUCER_MESSAGES.labels("drained")
+metrics.Gauge(
+    "kafka_producer_queue_depth",
+    "Messages en attente dans la file locale du producer"
+).set_function(lambda: queue_depth())
+metrics.Gauge(
+    "kafka_spill_pending_bytes",
+    "Octets en attente de réinjection dans le journal de débordement"
+).set_function(lambda: spill_pending_bytes())
+
 producer = None
+spill: Optional[SpillLog] = None
+_delivery_latency = 0.0
+_poll_thread: Optional[threading.Thread] = None
+_drain_thread: Optional[threading.Thread] = None
+_stop_polling = threading.Event()
+
+# Messages produits directement et pas encore confirmés, dans l'ordre d'envoi:
+# numéro d'envoi -> (message, boucle, future). Le verrou ordonne les envois,
+# les accusés et les ajouts au journal de débordement.
+_in_flight: "OrderedDict[int, tuple]" = OrderedDict()
+_order_lock = threading.Lock()
+_sequence = itertools.count()
+
+
+def _poll_loop(active_producer: Producer) -> None:
+    """Boucle du thread d'arrière-plan qui déclenche les callbacks de livraison"""
+    while not _stop_polling.is_set():
+        active_producer.poll(0.1)
+
+
+def _is_spillable(err: KafkaError) -> bool:
+    """Indique si un échec de livraison justifie de conserver le message sur disque"""
+    return err.code() in SPILLABLE_ERRORS or err.retriable()
+
+
+def _drain_batch(active_producer: Producer, records: list) -> bool:
+    """
+    Réinjecte un lot de messages du journal et attend leur confirmation
+    
+    Returns:
+        True si tous les messages du lot ont été livrés
+    """
+    remaining = [len(records)]
+    failed = [False]
+    done = threading.Event()
+    lock = threading.Lock()
+    
+    def delivery_report(err, msg):
+        with lock:
+            if err is not None:
+                failed[0] = True
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                done.set()
+    
+    for index, (topic, value, key, headers) in enumerate(records):
+        for _ in range(BUFFER_FULL_MAX_RETRIES):
+            try:
+                active_producer.produce(topic, value, key=key, headers=headers, callback=delivery_report)
+                break
+            except BufferError:
+                time.sleep(BUFFER_FULL_RETRY_DELAY)
+            except KafkaException as e:
+                logger.warning(f"Réinjection interrompue: {e}")
+                return False
+        else:
+            # File locale toujours pleine: les messages déjà produits seront
+            # renvoyés avec le lot (doublons absorbés par l'upsert du consumer)
+            return False
+    
+    if not done.wait(timeout=KAFKA_DELIVERY_TIMEOUT_MS / 1000 + 5):
+        return False
+    return not failed[0]
+
+
+def _drain_loop(active_producer: Producer, log: SpillLog) -> None:
+    """Boucle du thread qui réinjecte dans Kafka les messages du journal, dans l'ordre"""
+    retry_delay = SPILL_RETRY_MIN_DELAY
+    
+    while not _stop_polling.is_set():
+        if log.is_empty():
+            log.wait_for_records(timeout=1.0)
+            continue
+        
+        records, position = log.read_batch(KAFKA_SPILL_DRAIN_BATCH)
+        if position is None:
+            continue
+        
+        if not records or _drain_batch(active_producer, records):
+            log.commit(position, len(records))
+            _DRAINED.inc(len(records))
+            retry_delay = SPILL_RETRY_MIN_DELAY
+            if records:
+                logger.debug(f"{len(records)} messages réinjectés depuis le journal de débordement")
+        else:
+            logger.warning(f"Kafka indisponible, nouvelle réinjection dans {retry_delay:.1f}s")
+            _stop_polling.wait(retry_delay)
+            retry_delay = min(retry_delay * 2, SPILL_RETRY_MAX_DELAY)
+
+
+def ensure_topic(topic: str = KAFKA_TOPIC, num_partitions: int = KAFKA_TOPIC_PARTITIONS) -> None:
+    """
+    Crée le topic avec le nombre de partitions configuré s'il n'existe pas
+    (voir kafka_admin.ensure_topic)
+    
+    Args:
+        topic: Nom du topic
+        num_partitions: Nombre de partitions souhaité
+    """
+    kafka_admin.ensure_topic(KAFKA_BOOTSTRAP_SERVERS, topic, num_partitions, KAFKA_TOPIC_REPLICATION_FACTOR)
 
 
 def connect(max_retries: int = 5, retry_delay: int = 5) -> None:
     """
     Établit la connexion au producer Kafka avec retry logic
+    et démarre le thread de poll des accusés de livraison
     
     Args:
         max_retries: Nombre maximum de tentatives de connexion
         retry_delay: Délai en secondes entre chaque tentative
     """
-    global producer
+    global producer, spill, _poll_thread, _drain_thread
     
     for attempt in range(max_retries):
         try:
             producer = Producer(producer_config)
+            ensure_topic()
             logger.info(f"Connecté à Kafka: {KAFKA_BOOTSTRAP_SERVERS}")
-            return
+            break
         except KafkaException as e:
             logger.error(f"Tentative {attempt + 1}/{max_retries} - Échec de connexion à Kafka: {e}")
             if attempt < max_retries - 1:
@@ -41,48 +225,281 @@ def connect(max_retries: int = 5, retry_delay: int = 5) -> None:
             else:
                 logger.critical("Impossible de se connecter à Kafka après plusieurs tentatives")
                 raise
+    
+    _stop_polling.clear()
+    _poll_thread = threading.Thread(target=_poll_loop, args=(producer,), name="kafka-producer-poll", daemon=True)
+    _poll_thread.start()
+    
+    if KAFKA_SPILL_DIR:
+        spill = SpillLog(KAFKA_SPILL_DIR, KAFKA_SPILL_SEGMENT_BYTES, KAFKA_SPILL_MAX_BYTES)
+        _drain_thread = threading.Thread(
+            target=_drain_loop, args=(producer, spill), name="kafka-spill-drain", daemon=True
+        )
+        _drain_thread.start()
+
+
+def _resolve(future: asyncio.Future, err, msg) -> None:
+    """Complète la future d'un message à partir de son accusé de livraison"""
+    if future.done():
+        return
+    if isinstance(err, Exception):
+        future.set_exception(err)
+    elif err is not None:
+        future.set_exception(KafkaException(err))
+    else:
+        future.set_result(msg)
+
+
+def _settle(loop: asyncio.AbstractEventLoop, future: asyncio.Future, err, msg) -> None:
+    """Complète une future depuis un autre thread que celui de sa boucle"""
+    try:
+        loop.call_soon_threadsafe(_resolve, future, err, msg)
+    except RuntimeError:
+        # Boucle d'événements déjà fermée (arrêt de l'application)
+        pass
+
+
+def _spill_in_flight() -> None:
+    """
+    Reporte dans le journal tous les messages en vol, dans l'ordre d'envoi (verrou détenu)
+    
+    Appelé au premier échec (livraison refusée ou producer saturé): le journal
+    devient non vide, donc les messages suivants y sont ajoutés à la suite et
+    aucun ne peut dépasser un message plus ancien du même capteur. Un message
+    reporté peut encore être livré directement; il le sera alors deux fois
+    (doublon absorbé par l'upsert du consumer).
+    """
+    while _in_flight:
+        _, (record, loop, future) = _in_flight.popitem(last=False)
+        try:
+            spill.append(*record)
+            _SPILLED.inc()
+            _settle(loop, future, None, None)
+        except BufferError as e:
+            _FAILED.inc()
+            _settle(loop, future, e, None)
+
 
+def _delivery_report(sequence: int, produced_at: float, err, msg) -> None:
+    """Accusé de livraison d'un message produit directement (thread de poll)"""
+    global _delivery_latency
+    latency = time.monotonic() - produced_at
+    _delivery_latency += DELIVERY_LATENCY_SMOOTHING * (latency - _delivery_latency)
+    DELIVERY_SECONDS.observe(latency)
+    
+    with _order_lock:
+        entry = _in_flight.get(sequence)
+        if entry is None:
+            # Déjà reporté dans le journal (et sa future complétée)
+            return
+        if err is not None and spill is not None and _is_spillable(err):
+            logger.warning(f"Livraison impossible ({err}), messages en vol conservés sur disque")
+            _spill_in_flight()
+            return
+        del _in_flight[sequence]
+        _, loop, future = entry
+    
+    if err is not None:
+        _FAILED.inc()
+        logger.error(f"Échec de livraison du message: {err}")
+    else:
+        _DELIVERED.inc()
+        logger.debug(f"Message livré à {msg.topic()} [{msg.partition()}] offset {msg.offset()}")
+    _settle(loop, future, err, msg)
 
-def send_message(topic: str, message: str) -> None:
+
+def produce(
+    topic: str,
+    message: Union[str, bytes],
+    key: Optional[str] = None,
+    headers: Optional[Headers] = None
+) -> asyncio.Future:
     """
-    Envoie un message à Kafka avec confirmation de livraison
+    Publie un message sans attendre sa livraison
     
     Args:
         topic: Le topic Kafka de destination
-        message: Le message à envoyer (JSON string)
+        message: Le message à envoyer (JSON string ou octets déjà encodés)
+        key: Clé de partitionnement (capteur_id)
+        headers: En-têtes Kafka (format et version du schéma)
+    
+    Returns:
+        Future complétée par le thread de poll lorsque le broker a confirmé
+        (ou refusé) le message. Un message conservé dans le journal de
+        débordement est considéré comme accepté (résultat None).
+    
+    Raises:
+        BufferError: si la file locale du producer est pleine et que le
+            journal de débordement est désactivé ou plein
     """
     if producer is None:
         raise Exception("Producer is not connected")
     
-    def delivery_report(err, msg):
-        if err is not None:
-            logger.error(f"Échec de livraison du message: {err}")
-        else:
-            logger.debug(f"Message livré à {msg.topic()} [{msg.partition()}] offset {msg.offset()}")
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    value = message.encode('utf-8') if isinstance(message, str) else message
+    key_bytes = key.encode('utf-8') if key is not None else None
+    
+    with _order_lock:
+        # Tant que le journal n'est pas vidé, les nouveaux messages y sont ajoutés
+        # à la suite pour conserver l'ordre des mesures de chaque capteur
+        if spill is not None and not spill.is_empty():
+            spill.append(topic, value, key_bytes, headers)
+            _SPILLED.inc()
+            future.set_result(None)
+            return future
+        
+        sequence = next(_sequence)
+        callback = functools.partial(_delivery_report, sequence, time.monotonic())
+        try:
+            producer.produce(topic, value, key=key_bytes, headers=headers, callback=callback)
+        except (BufferError, KafkaException) as e:
+            if spill is None:
+                raise
+            logger.warning(f"Producer saturé ou indisponible ({e}), messages conservés sur disque")
+            _spill_in_flight()
+            spill.append(topic, value, key_bytes, headers)
+            _SPILLED.inc()
+            future.set_result(None)
+            return future
+        _in_flight[sequence] = ((topic, value, key_bytes, headers), loop, future)
+    return future
+
 
+async def enqueue_message(
+    topic: str,
+    message: Union[str, bytes],
+    key: Optional[str] = None,
+    headers: Optional[Headers] = None
+) -> asyncio.Future:
+    """
+    Publie un message en laissant le thread de poll vider la file si elle est pleine
+    
+    Args:
+        topic: Le topic Kafka de destination
+        message: Le message à envoyer (JSON string ou octets déjà encodés)
+        key: Clé de partitionnement (capteur_id)
+        headers: En-têtes Kafka (format et version du schéma)
+    
+    Returns:
+        Future de livraison du message (voir produce)
+    """
+    for attempt in range(BUFFER_FULL_MAX_RETRIES):
+        try:
+            return produce(topic, message, key, headers)
+        except BufferError:
+            if attempt == BUFFER_FULL_MAX_RETRIES - 1:
+                logger.error("Buffer plein, impossible d'envoyer le message")
+                raise
+            await asyncio.sleep(BUFFER_FULL_RETRY_DELAY)
+
+
+async def send_message(
+    topic: str,
+    message: Union[str, bytes],
+    key: Optional[str] = None,
+    headers: Optional[Headers] = None
+) -> None:
+    """
+    Envoie un message à Kafka et attend sa confirmation de livraison
+    sans bloquer la boucle d'événements
+    
+    Args:
+        topic: Le topic Kafka de destination
+        message: Le message à envoyer (JSON string ou octets déjà encodés)
+        key: Clé de partitionnement (capteur_id)
+        headers: En-têtes Kafka (format et version du schéma)
+    """
     try:
-        producer.produce(topic, message.encode('utf-8'), callback=delivery_report)
-        producer.poll(0)  # Déclenche les callbacks
-        producer.flush(timeout=10)  # Assure la livraison du message
-    except BufferError:
-        logger.error("Buffer plein, impossible d'envoyer le message")
-        producer.poll(1)  # Vide le buffer
-        raise
+        future = await enqueue_message(topic, message, key, headers)
+        await future
     except KafkaException as e:
         logger.error(f"Erreur Kafka lors de l'envoi: {e}")
         raise
 
 
+async def send_batch(
+    topic: str,
+    messages: List[Union[str, bytes]],
+    keys: Optional[List[Optional[str]]] = None,
+    headers: Optional[List[Optional[Headers]]] = None
+) -> List[Optional[str]]:
+    """
+    Envoie un lot de messages à Kafka puis attend l'ensemble des confirmations
+    
+    Args:
+        topic: Le topic Kafka de destination
+        messages: Les messages à envoyer (JSON strings ou octets déjà encodés)
+        keys: Clés de partitionnement (capteur_id), alignées sur messages
+        headers: En-têtes Kafka de chaque message, alignés sur messages
+    
+    Returns:
+        Pour chaque message, None s'il a été livré, sinon la raison de l'échec
+    """
+    errors: List[Optional[str]] = [None] * len(messages)
+    futures: List[asyncio.Future] = []
+    indexes: List[int] = []
+    
+    for index, message in enumerate(messages):
+        key = keys[index] if keys is not None else None
+        message_headers = headers[index] if headers is not None else None
+        try:
+            futures.append(await enqueue_message(topic, message, key, message_headers))
+            indexes.append(index)
+        except BufferError:
+            errors[index] = "Buffer du producer plein"
+        except KafkaException as e:
+            logger.error(f"Erreur Kafka lors de l'envoi du lot: {e}")
+            errors[index] = str(e)
+    
+    outcomes = await asyncio.gather(*futures, return_exceptions=True)
+    for index, outcome in zip(indexes, outcomes):
+        if isinstance(outcome, BaseException):
+            errors[index] = str(outcome)
+    
+    return errors
+
+
 def is_connected() -> bool:
     """Vérifie si le producer est connecté"""
     return producer is not None
 
 
+def queue_depth() -> int:
+    """Nombre de messages en attente dans la file locale du producer"""
+    return len(producer) if producer is not None else 0
+
+
+def delivery_latency() -> float:
+    """Latence récente (secondes) entre l'envoi d'un message et son accusé de livraison"""
+    return _delivery_latency
+
+
+def spill_pending_bytes() -> int:
+    """Volume (octets) en attente de réinjection dans le journal de débordement"""
+    return spill.pending_bytes if spill is not None else 0
+
+
+def spill_stats() -> Optional[dict]:
+    """Métriques du journal de débordement (None s'il est désactivé)"""
+    return spill.stats() if spill is not None else None
+
+
 def close() -> None:
     """Ferme proprement la connexion Kafka"""
-    global producer
+    global producer, spill, _poll_thread, _drain_thread
     if producer is not None:
         logger.info("Fermeture du producer Kafka...")
+        _stop_polling.set()
+        for thread in (_drain_thread, _poll_thread):
+            if thread is not None:
+                thread.join(timeout=5)
+        _poll_thread = None
+        _drain_thread = None
         producer.flush(timeout=30)  # Attendre l'envoi de tous les messages en attente
+        if spill is not None:
+            # Les messages non réinjectés restent sur disque pour le prochain démarrage
+            spill.close()
+            spill = None
         producer = None
-        logger.info("Kafka Producer déconnecté.")
\ No newline at end of file
+        logger.info("Kafka Producer déconnecté.")
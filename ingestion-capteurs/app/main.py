@@ -1,8 +1,19 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.exceptions import RequestValidationError
 from contextlib import asynccontextmanager
-from .models import CapteurData
-from . import kafka_producer
+from pydantic import ValidationError
+from typing import Any, List, Optional, Union
+from agrotrace_common import metrics
+from .models import CapteurData, CapteurDataAdapter, CapteurDataListAdapter
+from . import admission, codec, kafka_producer
+from .dedup import DedupCache, reading_key
+import asyncio
+import functools
+import json
 import logging
+import math
+import os
+import time
 
 # Configuration du logging
 logging.basicConfig(
@@ -11,6 +22,38 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Nombre maximum de mesures acceptées par appel à /ingest/batch
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "5000"))
+# Taille maximale du corps d'un lot, vérifiée avant lecture complète et validation
+MAX_BATCH_BYTES = int(os.getenv("MAX_BATCH_BYTES", str(MAX_BATCH_SIZE * 1024)))
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+# Ingestion WebSocket: nombre de mesures en vol par connexion avant de cesser
+# de lire les trames (contre-pression), et fréquence minimale des acquittements
+WS_MAX_IN_FLIGHT = int(os.getenv("WS_MAX_IN_FLIGHT", "1000"))
+WS_ACK_EVERY = int(os.getenv("WS_ACK_EVERY", "100"))
+
+VALIDATION_SECONDS = metrics.Histogram(
+    "ingestion_validation_seconds",
+    "Durée de validation d'une requête (ou d'une trame WebSocket)",
+    ["endpoint"]
+)
+READINGS = metrics.Counter(
+    "ingestion_readings_total",
+    "Mesures reçues par point d'entrée et par issue (accepted, duplicate, invalid, shed, failed)",
+    ["endpoint", "result"]
+)
+
+# Fenêtre de déduplication partagée par tous les points d'entrée
+dedup_cache = DedupCache()
+metrics.Gauge(
+    "ingestion_dedup_entries",
+    "Clés (capteur_id, timestamp) mémorisées dans la fenêtre de déduplication"
+).set_function(lambda: len(dedup_cache))
+
+DUPLICATE_MESSAGE = "Mesure déjà reçue, doublon ignoré"
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -36,24 +79,410 @@ async def health_check():
     return {
         "status": "healthy",
         "service": "ingestion-capteurs",
-        "kafka_connected": kafka_producer.is_connected()
+        "kafka_connected": kafka_producer.is_connected(),
+        "spill": kafka_producer.spill_stats(),
+        "pressure": admission.status(),
+        "dedup": dedup_cache.stats()
     }
 
 
-@app.post("/ingest")
-async def ingest_data(data: CapteurData):
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Métriques du service au format texte Prometheus"""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.post(
+    "/ingest",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": CapteurData.model_json_schema()}}
+        }
+    }
+)
+async def ingest_data(request: Request):
+    # Chemin rapide: les octets reçus sont validés directement par l'adaptateur
+    # précompilé, sans décodage JSON générique préalable de FastAPI
+    body = await request.body()
+    started_at = time.perf_counter()
     try:
-        logger.info(f"Réception des données du capteur {data.capteur_id}")
-        kafka_producer.send_message(
-            topic="capteur_data",
-            message=data.model_dump_json()
+        data = CapteurDataAdapter.validate_json(body)
+    except ValidationError as e:
+        READINGS.labels("ingest", "invalid").inc()
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)],
+            body=body
         )
-        logger.info(f"Données du capteur {data.capteur_id} envoyées à Kafka avec succès")
+    finally:
+        VALIDATION_SECONDS.labels("ingest").observe(time.perf_counter() - started_at)
+    
+    key = reading_key(data.capteur_id, data.timestamp)
+    if dedup_cache.is_duplicate(key):
+        READINGS.labels("ingest", "duplicate").inc()
+        return {
+            "status": "duplicate",
+            "message": DUPLICATE_MESSAGE,
+            "capteur_id": data.capteur_id
+        }
+    
+    retry_after = admission.admit(data.capteur_id)
+    if retry_after is not None:
+        READINGS.labels("ingest", "shed").inc()
+        raise HTTPException(
+            status_code=429,
+            detail="Service surchargé, réessayer plus tard",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+    
+    dedup_cache.add(key)
+    try:
+        logger.debug(f"Réception des données du capteur {data.capteur_id}")
+        payload, headers = codec.encode_reading(data)
+        await kafka_producer.send_message(
+            topic=kafka_producer.KAFKA_TOPIC,
+            message=payload,
+            key=data.capteur_id,
+            headers=headers
+        )
+        READINGS.labels("ingest", "accepted").inc()
+        logger.debug(f"Données du capteur {data.capteur_id} envoyées à Kafka avec succès")
         return {
             "status": "success",
             "message": "Données ingérées avec succès",
             "capteur_id": data.capteur_id
         }
     except Exception as e:
+        dedup_cache.discard(key)
+        READINGS.labels("ingest", "failed").inc()
         logger.error(f"Erreur lors de l'ingestion des données: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Erreur lors de l'ingestion des données: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Erreur lors de l'ingestion des données: {str(e)}")
+
+
+def _format_validation_error(error: ValidationError) -> str:
+    """Résume une erreur de validation Pydantic en une ligne lisible"""
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc']) or 'body'}: {err['msg']}"
+        for err in error.errors()
+    )
+
+
+def _validate_item(raw: Any, from_json: bool = True) -> Union[CapteurData, str]:
+    """
+    Valide une mesure
+    
+    Args:
+        raw: Document JSON brut, ou objet déjà décodé si from_json est False
+        from_json: Indique si raw doit être décodé comme du JSON
+    
+    Returns:
+        La mesure validée, ou la raison du rejet (str)
+    """
+    try:
+        if from_json:
+            return CapteurDataAdapter.validate_json(raw)
+        return CapteurDataAdapter.validate_python(raw)
+    except ValidationError as e:
+        return _format_validation_error(e)
+
+
+def _validate_ndjson(body: Union[str, bytes]) -> List[Union[CapteurData, str]]:
+    """Valide un flux NDJSON ligne par ligne (les lignes vides sont ignorées)"""
+    return [_validate_item(line) for line in body.splitlines() if line.strip()]
+
+
+def _validate_array(body: Union[str, bytes]) -> List[Union[CapteurData, str]]:
+    """
+    Valide un tableau JSON de mesures
+    
+    Le tableau complet est d'abord validé d'un seul appel par l'adaptateur de
+    liste; si un élément est invalide, chaque élément est revalidé séparément
+    pour obtenir un résultat individuel.
+    
+    Raises:
+        ValueError: si le corps n'est pas un tableau JSON
+    """
+    try:
+        return CapteurDataListAdapter.validate_json(body)
+    except ValidationError:
+        pass
+    
+    try:
+        payload = json.loads(body)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"JSON invalide: {e}")
+    if not isinstance(payload, list):
+        raise ValueError("Le corps doit être un tableau JSON ou un flux NDJSON")
+    return [_validate_item(item, from_json=False) for item in payload]
+
+
+def _batch_too_large(detail: str) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Lot trop volumineux: {detail}")
+
+
+async def _read_batch_body(request: Request) -> bytes:
+    """
+    Lit le corps d'un lot, en refusant dès que possible un corps trop volumineux
+    
+    Le Content-Length annoncé est vérifié avant toute lecture; un corps sans
+    Content-Length (chunked) est refusé dès qu'il dépasse MAX_BATCH_BYTES.
+    
+    Raises:
+        HTTPException: 413 si le corps dépasse MAX_BATCH_BYTES
+    """
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > MAX_BATCH_BYTES:
+        raise _batch_too_large(f"{length} octets (maximum {MAX_BATCH_BYTES})")
+    
+    chunks: List[bytes] = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > MAX_BATCH_BYTES:
+            raise _batch_too_large(f"plus de {MAX_BATCH_BYTES} octets")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+@app.post("/ingest/batch")
+async def ingest_batch(request: Request, response: Response):
+    """
+    Ingestion d'un lot de mesures (tableau JSON ou NDJSON)
+    
+    Toutes les mesures valides sont publiées dans Kafka d'un seul tenant puis
+    leurs accusés de livraison sont attendus ensemble; chaque élément reçoit
+    un résultat individuel. Un lot trop volumineux (MAX_BATCH_BYTES,
+    MAX_BATCH_SIZE) est refusé avant validation.
+    """
+    body = await _read_batch_body(request)
+    content_type = request.headers.get("content-type", "")
+    ndjson = content_type.split(";")[0].strip().lower() in NDJSON_CONTENT_TYPES
+    if ndjson:
+        # Majorant du nombre de mesures, sans décodage
+        line_count = body.count(b"\n") + 1
+        if line_count > MAX_BATCH_SIZE and sum(1 for line in body.splitlines() if line.strip()) > MAX_BATCH_SIZE:
+            raise _batch_too_large(f"plus de {MAX_BATCH_SIZE} mesures")
+    
+    started_at = time.perf_counter()
+    try:
+        items = _validate_ndjson(body) if ndjson else _validate_array(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        VALIDATION_SECONDS.labels("batch").observe(time.perf_counter() - started_at)
+    
+    # Tableau JSON: le nombre d'éléments n'est connu qu'après décodage (le
+    # volume validé reste borné par MAX_BATCH_BYTES)
+    if len(items) > MAX_BATCH_SIZE:
+        raise _batch_too_large(f"{len(items)} mesures (maximum {MAX_BATCH_SIZE})")
+    
+    results: List[dict] = []
+    valid_indexes: List[int] = []
+    messages: List[bytes] = []
+    keys: List[str] = []
+    headers: List[Optional[codec.Headers]] = []
+    dedup_keys: List[tuple] = []
+    level = admission.pressure_level()
+    max_retry_after = 0.0
+    failed = 0
+    
+    for index, data in enumerate(items):
+        if isinstance(data, str):
+            results.append({"index": index, "status": "rejected", "reason": data})
+            continue
+        key = reading_key(data.capteur_id, data.timestamp)
+        if dedup_cache.is_duplicate(key):
+            results.append({"index": index, "status": "duplicate", "capteur_id": data.capteur_id})
+            continue
+        retry_after = admission.admit(data.capteur_id, level)
+        if retry_after is not None:
+            max_retry_after = max(max_retry_after, retry_after)
+            results.append({
+                "index": index,
+                "status": "rejected",
+                "reason": "Service surchargé, réessayer plus tard",
+                "retry_after": math.ceil(retry_after)
+            })
+            continue
+        results.append({"index": index, "status": "accepted", "capteur_id": data.capteur_id})
+        # Mémorisée dès maintenant pour écarter aussi les doublons internes au lot
+        dedup_cache.add(key)
+        dedup_keys.append(key)
+        valid_indexes.append(index)
+        payload, message_headers = codec.encode_reading(data)
+        messages.append(payload)
+        keys.append(data.capteur_id)
+        headers.append(message_headers)
+    
+    if messages:
+        try:
+            errors = await kafka_producer.send_batch(
+                topic=kafka_producer.KAFKA_TOPIC,
+                messages=messages,
+                keys=keys,
+                headers=headers
+            )
+        except Exception as e:
+            for key in dedup_keys:
+                dedup_cache.discard(key)
+            logger.error(f"Erreur lors de l'ingestion du lot: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Erreur lors de l'ingestion du lot: {str(e)}")
+        
+        for index, key, error in zip(valid_indexes, dedup_keys, errors):
+            if error is not None:
+                failed += 1
+                dedup_cache.discard(key)
+                results[index]["status"] = "rejected"
+                results[index]["reason"] = f"Échec de livraison Kafka: {error}"
+    
+    if max_retry_after:
+        response.headers["Retry-After"] = str(math.ceil(max_retry_after))
+    
+    accepted = sum(1 for result in results if result["status"] == "accepted")
+    duplicates = sum(1 for result in results if result["status"] == "duplicate")
+    rejected = len(results) - accepted - duplicates
+    shed = sum(1 for result in results if "retry_after" in result)
+    READINGS.labels("batch", "accepted").inc(accepted)
+    READINGS.labels("batch", "duplicate").inc(duplicates)
+    READINGS.labels("batch", "shed").inc(shed)
+    READINGS.labels("batch", "failed").inc(failed)
+    READINGS.labels("batch", "invalid").inc(rejected - shed - failed)
+    logger.debug(f"Lot reçu: {accepted} mesures acceptées, {duplicates} doublons, {rejected} rejetées")
+    
+    return {
+        "status": "success" if rejected == 0 else "partial",
+        "accepted": accepted,
+        "duplicates": duplicates,
+        "rejected": rejected,
+        "results": results
+    }
+
+
+def _validate_ws_frame(frame: Union[str, bytes]) -> List[Union[CapteurData, str]]:
+    """
+    Valide une trame WebSocket: une mesure JSON, un tableau de mesures
+    ou plusieurs lignes NDJSON
+    """
+    if frame.lstrip()[:1] in ("[", b"["):
+        try:
+            return _validate_array(frame)
+        except ValueError as e:
+            return [str(e)]
+    
+    try:
+        return [CapteurDataAdapter.validate_json(frame)]
+    except ValidationError as e:
+        if any(err["type"] == "json_invalid" for err in e.errors()) and len(frame.splitlines()) > 1:
+            return _validate_ndjson(frame)
+        return [_format_validation_error(e)]
+
+
+def _forget_if_failed(future: asyncio.Future, key: tuple) -> None:
+    """Retire de la fenêtre de déduplication une mesure dont la livraison a échoué"""
+    if future.cancelled() or future.exception() is not None:
+        dedup_cache.discard(key)
+
+
+async def _acknowledge_ws(websocket: WebSocket, in_flight: asyncio.Queue) -> None:
+    """
+    Envoie les acquittements cumulatifs d'une connexion WebSocket
+    
+    Les mesures sont attendues dans l'ordre de réception; un acquittement
+    {"type": "ack", "seq": n} signifie que toutes les mesures jusqu'à n ont été
+    traitées (livrées à Kafka, ou rejetées et listées dans "rejected").
+    Les acquittements sont regroupés tant que des mesures restent en vol.
+    La tâche tourne jusqu'à son annulation à la déconnexion du client.
+    """
+    rejected: List[dict] = []
+    unacknowledged = 0
+    connected = True
+    
+    while True:
+        seq, future, reason, retry_after = await in_flight.get()
+        if future is not None:
+            try:
+                await future
+            except Exception as e:
+                reason = f"Échec de livraison Kafka: {e}"
+        if retry_after is not None:
+            rejected.append({"seq": seq, "reason": reason, "retry_after": math.ceil(retry_after)})
+        elif reason is not None:
+            rejected.append({"seq": seq, "reason": reason})
+        unacknowledged += 1
+        
+        if connected and (in_flight.empty() or unacknowledged >= WS_ACK_EVERY):
+            try:
+                await websocket.send_json({"type": "ack", "seq": seq, "rejected": rejected})
+            except Exception:
+                # Client parti: on continue de vider la file pour ne pas bloquer le lecteur
+                connected = False
+            rejected = []
+            unacknowledged = 0
+
+
+@app.websocket("/ws/ingest")
+async def ingest_websocket(websocket: WebSocket):
+    """
+    Ingestion continue pour les capteurs et passerelles connectés en permanence
+    
+    Chaque trame contient une mesure JSON, un tableau de mesures ou des lignes
+    NDJSON. Chaque mesure reçoit un numéro de séquence (à partir de 1, dans
+    l'ordre d'arrivée) repris par les acquittements cumulatifs.
+    """
+    await websocket.accept()
+    client = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else "inconnu"
+    logger.info(f"Passerelle {client} connectée en WebSocket")
+    
+    in_flight: asyncio.Queue = asyncio.Queue(maxsize=WS_MAX_IN_FLIGHT)
+    ack_task = asyncio.create_task(_acknowledge_ws(websocket, in_flight))
+    seq = 0
+    
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            
+            frame = message.get("text") if message.get("text") is not None else message.get("bytes")
+            started_at = time.perf_counter()
+            items = _validate_ws_frame(frame or "")
+            VALIDATION_SECONDS.labels("ws").observe(time.perf_counter() - started_at)
+            for data in items:
+                seq += 1
+                if isinstance(data, str):
+                    READINGS.labels("ws", "invalid").inc()
+                    await in_flight.put((seq, None, data, None))
+                    continue
+                key = reading_key(data.capteur_id, data.timestamp)
+                if dedup_cache.is_duplicate(key):
+                    # Doublon: acquitté sans être republié
+                    READINGS.labels("ws", "duplicate").inc()
+                    await in_flight.put((seq, None, None, None))
+                    continue
+                retry_after = admission.admit(data.capteur_id)
+                if retry_after is not None:
+                    READINGS.labels("ws", "shed").inc()
+                    await in_flight.put((seq, None, "Service surchargé, réessayer plus tard", retry_after))
+                    continue
+                
+                payload, headers = codec.encode_reading(data)
+                dedup_cache.add(key)
+                try:
+                    future = await kafka_producer.enqueue_message(
+                        kafka_producer.KAFKA_TOPIC, payload, data.capteur_id, headers
+                    )
+                except Exception as e:
+                    dedup_cache.discard(key)
+                    READINGS.labels("ws", "failed").inc()
+                    await in_flight.put((seq, None, f"Échec d'envoi Kafka: {e}", None))
+                    continue
+                future.add_done_callback(functools.partial(_forget_if_failed, key=key))
+                READINGS.labels("ws", "accepted").inc()
+                # Bloque la lecture des trames tant que la file est pleine
+                await in_flight.put((seq, future, None, None))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Le client est parti: les mesures en vol restent livrées par le producer
+        ack_task.cancel()
+        logger.info(f"Passerelle {client} déconnectée après {seq} mesures")
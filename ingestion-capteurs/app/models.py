@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, TypeAdapter
+from typing import List, Optional
 import datetime
 
 class CapteurData(BaseModel):
@@ -9,4 +9,10 @@ class CapteurData(BaseModel):
     humidite: Optional[float] = None
     humidite_sol: Optional[float] = None
     niveau_ph: Optional[float] = None
-    luminosite: Optional[float] = None
\ No newline at end of file
+    luminosite: Optional[float] = None
+
+
+# Adaptateurs précompilés: validation directe des octets JSON reçus et
+# sérialisation en octets, sans passer par des dict intermédiaires
+CapteurDataAdapter = TypeAdapter(CapteurData)
+CapteurDataListAdapter = TypeAdapter(List[CapteurData])
@@ -0,0 +1,205 @@
+"""
+Réinjection des messages en quarantaine
+
+    python -m app.replay [--reason TEXTE] [--limit N] [--batch-size N] [--dry-run]
+
+Relit les lignes de capteur_quarantine non encore réinjectées, par lots dans
+l'ordre des id, et écrit en masse dans raw_capteur_data celles qui sont
+désormais valides (cause corrigée, contenu réparé en base...). L'écriture
+d'un lot et la datation (replayed_at) de ses lignes de quarantaine forment une
+seule transaction: une ligne réinjectée n'est plus relue, une réinjection
+interrompue peut être relancée sans doublon. Les autres lignes restent en
+quarantaine avec leur position d'origine (topic, partition, offset); la
+réinjection ne republie rien sur le topic DLQ.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import logging
+
+import psycopg2
+
+from . import consumer, dead_letter
+
+logger = logging.getLogger(__name__)
+
+REPLAY_BATCH_SIZE = 1000
+
+QuarantineRow = Tuple[int, Optional[str], Optional[int], Optional[int], str, bytes, Any]
+
+
+def _fetch_batch(
+    connection: psycopg2.extensions.connection,
+    after_id: int,
+    batch_size: int,
+    reason: Optional[str]
+) -> List[QuarantineRow]:
+    """
+    Lot suivant de lignes en quarantaine non réinjectées (pagination par id)
+    
+    Les lignes sont verrouillées jusqu'à la fin de la transaction du lot: une
+    réinjection lancée en parallèle passe aux lignes suivantes au lieu de
+    réécrire les mêmes.
+    """
+    query = """
+        SELECT id, source_topic, source_partition, source_offset, reason, payload, headers
+        FROM capteur_quarantine
+        WHERE replayed_at IS NULL AND id > %s
+    """
+    params: list = [after_id]
+    if reason:
+        query += " AND reason ILIKE %s"
+        params.append(f"%{reason}%")
+    query += " ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED"
+    params.append(batch_size)
+    
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+
+def _write(
+    connection: psycopg2.extensions.connection,
+    readings: Dict[int, Tuple[Dict[str, Any], Optional[int]]]
+) -> List[int]:
+    """
+    Écrit les mesures réinjectables et date leurs lignes de quarantaine dans
+    une même transaction
+    
+    Si la base rejette le lot, les mesures sont réécrites une à une (un point
+    de sauvegarde par ligne); celles qui sont encore refusées restent dans
+    leur ligne de quarantaine, avec leur topic, partition et offset d'origine,
+    et la nouvelle raison du refus. Rien n'est republié sur le topic DLQ.
+    
+    Returns:
+        Identifiants de quarantaine des mesures écrites
+    
+    Raises:
+        psycopg2.Error: si la transaction échoue (elle est annulée, aucune
+            ligne n'est datée)
+    """
+    rows = {quarantine_id: consumer._to_row(data, partition) for quarantine_id, (data, partition) in readings.items()}
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SAVEPOINT replay_batch")
+            try:
+                consumer.upsert_raw_rows(cursor, list(rows.values()))
+                written = list(rows)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                raise
+            except psycopg2.Error as e:
+                logger.warning(f"Lot rejeté par la base ({e}), réinjection ligne par ligne")
+                cursor.execute("ROLLBACK TO SAVEPOINT replay_batch")
+                written = _write_rows(cursor, rows)
+            if written:
+                cursor.execute(
+                    "UPDATE capteur_quarantine SET replayed_at = now() WHERE id = ANY(%s)",
+                    (written,)
+                )
+        connection.commit()
+    except psycopg2.Error:
+        connection.rollback()
+        raise
+    return written
+
+
+def _write_rows(cursor, rows: Dict[int, consumer.RawRow]) -> List[int]:
+    """Écrit les lignes une à une, la raison des lignes refusées étant mise à jour sur place"""
+    written = []
+    for quarantine_id, row in rows.items():
+        cursor.execute("SAVEPOINT replay_row")
+        try:
+            consumer.upsert_raw_rows(cursor, [row])
+            cursor.execute("RELEASE SAVEPOINT replay_row")
+            written.append(quarantine_id)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            raise
+        except psycopg2.Error as e:
+            reason = f"Rejet de la base: {str(e).strip()}"
+            logger.warning(f"Quarantaine {quarantine_id} toujours rejetée par la base: {reason}")
+            cursor.execute("ROLLBACK TO SAVEPOINT replay_row")
+            cursor.execute("UPDATE capteur_quarantine SET reason = %s WHERE id = %s", (reason, quarantine_id))
+    return written
+
+
+def replay(
+    connection: psycopg2.extensions.connection,
+    reason: Optional[str] = None,
+    limit: Optional[int] = None,
+    batch_size: int = REPLAY_BATCH_SIZE,
+    dry_run: bool = False
+) -> Dict[str, int]:
+    """
+    Réinjecte en masse les messages en quarantaine
+    
+    Args:
+        connection: Connexion à la base
+        reason: Ne réinjecte que les lignes dont la raison contient ce texte
+        limit: Nombre maximum de lignes examinées
+        batch_size: Lignes lues et écrites par lot
+        dry_run: Décode seulement, sans rien écrire
+    
+    Returns:
+        Compteurs: lignes examinées, réinjectées et encore invalides
+    """
+    stats = {"examined": 0, "replayed": 0, "invalid": 0}
+    after_id = 0
+    while limit is None or stats["examined"] < limit:
+        size = batch_size if limit is None else min(batch_size, limit - stats["examined"])
+        batch = _fetch_batch(connection, after_id, size, reason)
+        if not batch:
+            connection.rollback()
+            break
+        after_id = batch[-1][0]
+        stats["examined"] += len(batch)
+        
+        readings: Dict[int, Tuple[Dict[str, Any], Optional[int]]] = {}
+        for quarantine_id, topic, partition, offset, _, payload, headers in batch:
+            try:
+                data = consumer.check_message(bytes(payload), dead_letter.decode_headers(headers))
+            except ValueError as e:
+                logger.info(f"Quarantaine {quarantine_id} ({topic} partition {partition}, offset {offset}) toujours invalide: {e}")
+                continue
+            readings[quarantine_id] = (data, partition)
+        
+        if dry_run or not readings:
+            # Rien à écrire: termine la transaction ouverte par le SELECT
+            connection.rollback()
+            if dry_run:
+                stats["replayed"] += len(readings)
+        else:
+            stats["replayed"] += len(_write(connection, readings))
+        stats["invalid"] = stats["examined"] - stats["replayed"]
+        logger.info(f"{stats['examined']} lignes examinées, {stats['replayed']} réinjectées")
+    
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Réinjecte les messages en quarantaine dans raw_capteur_data")
+    parser.add_argument("--reason", help="ne réinjecte que les lignes dont la raison contient ce texte")
+    parser.add_argument("--limit", type=int, help="nombre maximum de lignes examinées")
+    parser.add_argument("--batch-size", type=int, default=REPLAY_BATCH_SIZE, help="lignes par lot")
+    parser.add_argument("--dry-run", action="store_true", help="compte les lignes réinjectables sans rien écrire")
+    args = parser.parse_args()
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
+    connection = consumer.connect_to_database()
+    try:
+        stats = replay(connection, args.reason, args.limit, args.batch_size, args.dry_run)
+    finally:
+        connection.close()
+    
+    prefix = "Simulation: " if args.dry_run else ""
+    logger.info(
+        f"{prefix}{stats['replayed']} lignes réinjectées, {stats['invalid']} toujours invalides "
+        f"sur {stats['examined']} examinées"
+    )
+
+
+if __name__ == "__main__":
+    main()
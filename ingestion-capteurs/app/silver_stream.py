@@ -0,0 +1,232 @@
+"""
+Nettoyage Silver en continu, dans le consumer
+
+Avec SILVER_MODE=streaming, le consumer applique aux mesures, au fil de leur
+arrivée, les règles du SilverTransformer de l'ETL (pretraitement/pipeline/
+silver.py): les valeurs manquantes ou hors plage sont remplacées par la
+dernière valeur connue du capteur et signalées dans quality_flags. Les lignes
+nettoyées sont écrites dans clean_sensor_data dans la même transaction que
+raw_capteur_data, déjà marquées is_cleaned: l'ETL n'a plus rien à relire.
+
+Les plages valides, les bits de quality_flags, la définition des tables et
+le chargement du registre des capteurs sont partagés avec l'ETL
+(agrotrace_common.silver_rules). La détection des valeurs aberrantes par médiane glissante reste
+propre à l'ETL: elle demande la fenêtre récente de chaque capteur.
+
+Les messages étant clés par capteur_id, toutes les mesures d'un capteur
+arrivent dans l'ordre par la même partition: la « dernière valeur connue »
+est celle du dernier message écrit. L'état de chaque capteur est chargé
+depuis clean_sensor_data la première fois qu'il est vu, puis tenu en mémoire.
+
+Les plages valides et l'étalonnage propres à un capteur sont lus dans la
+table sensor_registry (voir SensorRegistry), relue toutes les
+SENSOR_REGISTRY_REFRESH_S secondes (lignes modifiées seulement).
+"""
+
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+import logging
+import os
+import threading
+import time
+
+import psycopg2
+
+from agrotrace_common import silver_rules
+from agrotrace_common.silver_rules import (
+    FLAG_INTERPOLATED, FLAG_OUT_OF_RANGE, MEASURE_COLUMNS, QUALITY_FLAG_BITS, VALID_RANGES
+)
+
+logger = logging.getLogger(__name__)
+
+# "etl" (nettoyage par l'ETL planifié) ou "streaming" (nettoyage dans le consumer)
+SILVER_MODE = os.getenv("SILVER_MODE", "etl")
+
+MEASURE_FIELDS = tuple(MEASURE_COLUMNS)
+
+# Intervalle de relecture du registre des capteurs
+SENSOR_REGISTRY_REFRESH_S = float(os.getenv("SENSOR_REGISTRY_REFRESH_S", "30"))
+
+# (capteur_id, timestamp, temperature, humidite, humidite_sol, niveau_ph, luminosite, quality_flags)
+CleanRow = Tuple[Any, ...]
+Measures = Tuple[Optional[float], ...]
+# Par métrique (ordre de MEASURE_FIELDS): (min, max, scale, calibration_offset)
+Bounds = Tuple[Tuple[float, float, float, float], ...]
+
+DEFAULT_BOUNDS: Bounds = tuple((*VALID_RANGES[field], 1.0, 0.0) for field in MEASURE_FIELDS)
+
+
+def enabled() -> bool:
+    return SILVER_MODE == "streaming"
+
+
+def _clean_value(
+    index: int,
+    value: Optional[float],
+    last: Optional[float],
+    bounds: Tuple[float, float, float, float]
+) -> Tuple[Optional[float], int]:
+    """Valeur nettoyée (étalonnée) d'une métrique et ses bits de quality_flags"""
+    shift = QUALITY_FLAG_BITS * index
+    if value is None:
+        return last, (FLAG_INTERPOLATED << shift) if last is not None else 0
+    min_val, max_val, scale, offset = bounds
+    value = value * scale + offset
+    if min_val <= value <= max_val:
+        return value, 0
+    # Hors plage (sentinelle, panne): écartée, comme une valeur manquante
+    return last, (FLAG_OUT_OF_RANGE | (FLAG_INTERPOLATED if last is not None else 0)) << shift
+
+
+class SensorRegistry:
+    """
+    Registre des capteurs (table sensor_registry) tenu en mémoire
+    
+    Une ligne (capteur_id, metric) remplace, pour ce capteur, la plage par
+    défaut de la métrique (borne NULL: borne par défaut) et étalonne ses
+    mesures: valeur * scale + calibration_offset. Les bornes de chaque
+    capteur sont précalculées pour toutes ses métriques: une seule recherche
+    par mesure.
+    """
+    
+    def __init__(self, refresh_interval: float = SENSOR_REGISTRY_REFRESH_S):
+        self.refresh_interval = refresh_interval
+        # Plus grande version chargée
+        self.version = 0
+        # (capteur_id, metric) -> ligne du registre
+        self._entries: silver_rules.RegistryEntries = {}
+        # capteur_id -> bornes (remplacé d'un bloc: lu sans verrou par les workers)
+        self._bounds: Dict[Hashable, Bounds] = {}
+        self._refreshed_at: Optional[float] = None
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._bounds)
+    
+    def bounds(self, capteur_id: Hashable) -> Bounds:
+        return self._bounds.get(capteur_id, DEFAULT_BOUNDS)
+    
+    def refresh(self, connection: psycopg2.extensions.connection) -> None:
+        """
+        Relit les lignes modifiées du registre (voir silver_rules.read_registry),
+        au plus toutes les refresh_interval secondes
+        
+        Si la table est illisible, le registre déjà chargé reste en vigueur.
+        
+        Raises:
+            psycopg2.OperationalError, psycopg2.InterfaceError: si la base est indisponible
+        """
+        now = time.monotonic()
+        if self._refreshed_at is not None and now - self._refreshed_at < self.refresh_interval:
+            return
+        # Un seul worker relit le registre, les autres gardent l'état courant
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._refreshed_at = now
+            try:
+                with connection.cursor() as cursor:
+                    entries = silver_rules.read_registry(cursor, self._entries, self.version)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                raise
+            except psycopg2.Error as e:
+                # Registre illisible: les bornes chargées restent en vigueur
+                connection.rollback()
+                logger.error(f"Relecture du registre des capteurs impossible: {e}")
+                return
+            if entries is None:
+                return
+            
+            bounds: Dict[Hashable, List[Tuple[float, float, float, float]]] = {}
+            for capteur_id, metric, min_value, max_value, scale, offset, *_ in entries.values():
+                if metric not in MEASURE_FIELDS:
+                    continue
+                index = MEASURE_FIELDS.index(metric)
+                default_min, default_max, _, _ = DEFAULT_BOUNDS[index]
+                bounds.setdefault(capteur_id, list(DEFAULT_BOUNDS))[index] = (
+                    default_min if min_value is None else min_value,
+                    default_max if max_value is None else max_value,
+                    scale,
+                    offset
+                )
+            
+            self._entries = entries
+            self.version = silver_rules.registry_version(entries)
+            self._bounds = {capteur_id: tuple(values) for capteur_id, values in bounds.items()}
+            logger.info(f"Registre des capteurs: {len(self._bounds)} capteurs (version {self.version})")
+        finally:
+            self._lock.release()
+
+
+class StreamingCleaner:
+    """Nettoyage mesure par mesure, avec la dernière valeur connue de chaque capteur"""
+    
+    def __init__(self, registry: Optional[SensorRegistry] = None):
+        # capteur_id -> dernières valeurs nettoyées (ordre de MEASURE_FIELDS)
+        self._last_known: Dict[Hashable, Measures] = {}
+        self.registry = registry if registry is not None else SensorRegistry()
+    
+    def __len__(self) -> int:
+        return len(self._last_known)
+    
+    def _load_state(self, capteur_ids: List[Hashable], connection: psycopg2.extensions.connection) -> None:
+        """Charge depuis clean_sensor_data l'état des capteurs encore inconnus"""
+        unknown = [capteur_id for capteur_id in capteur_ids if capteur_id not in self._last_known]
+        if not unknown:
+            return
+        
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT DISTINCT ON (capteur_id)
+                    capteur_id, temperature, humidite, humidite_sol, niveau_ph, luminosite
+                FROM clean_sensor_data
+                WHERE capteur_id = ANY(%s)
+                ORDER BY capteur_id, timestamp DESC
+            """, (unknown,))
+            for capteur_id, *values in cursor.fetchall():
+                self._last_known[capteur_id] = tuple(values)
+        for capteur_id in unknown:
+            self._last_known.setdefault(capteur_id, (None,) * len(MEASURE_FIELDS))
+    
+    def clean(
+        self,
+        rows: List[Tuple[Any, ...]],
+        connection: psycopg2.extensions.connection
+    ) -> Tuple[List[CleanRow], Dict[Hashable, Measures]]:
+        """
+        Nettoie un lot de lignes brutes, dans l'ordre de réception
+        
+        L'état n'est pas modifié: il ne doit l'être qu'une fois le lot
+        enregistré (voir commit). Il sert ainsi d'instantané: un lot réessayé
+        est nettoyé à l'identique, et un lot refusé par la base est renettoyé
+        ligne à ligne depuis l'état des seules mesures enregistrées.
+        
+        Args:
+            rows: Lignes (capteur_id, timestamp, temperature, humidite,
+                humidite_sol, niveau_ph, luminosite, ...)
+            connection: Connexion utilisée pour charger l'état des nouveaux capteurs
+        
+        Returns:
+            Lignes nettoyées et nouvel état des capteurs du lot
+        
+        Raises:
+            psycopg2.Error: si l'état des nouveaux capteurs ne peut être lu
+        """
+        self.registry.refresh(connection)
+        self._load_state(list({row[0] for row in rows}), connection)
+        
+        state: Dict[Hashable, Measures] = {}
+        cleaned: List[CleanRow] = []
+        for row in rows:
+            capteur_id = row[0]
+            last_known = state.get(capteur_id) or self._last_known[capteur_id]
+            values, flags = zip(*(
+                _clean_value(index, value, last, bounds)
+                for index, (value, last, bounds) in enumerate(zip(row[2:7], last_known, self.registry.bounds(capteur_id)))
+            ))
+            state[capteur_id] = values
+            cleaned.append((capteur_id, row[1], *values, sum(flags)))
+        return cleaned, state
+    
+    def commit(self, state: Dict[Hashable, Measures]) -> None:
+        """Retient l'état d'un lot nettoyé, une fois ce lot enregistré"""
+        self._last_known.update(state)
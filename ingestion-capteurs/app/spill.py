@@ -0,0 +1,294 @@
+"""
+Journal de débordement (spill) sur disque pour le producer Kafka
+
+Quand Kafka est lent ou indisponible, les messages sont ajoutés à un journal
+local append-only découpé en segments, puis réinjectés dans l'ordre une fois
+le broker revenu. Chaque enregistrement est préfixé par sa longueur et un
+CRC32 afin qu'une écriture interrompue (crash) soit détectée à la relecture.
+La position de relecture est conservée dans un fichier "cursor": un segment
+n'est supprimé qu'une fois tous ses messages confirmés par le broker
+(livraison au moins une fois, les doublons étant absorbés par l'upsert du consumer).
+"""
+
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+Headers = List[Tuple[str, bytes]]
+SpillRecord = Tuple[str, bytes, Optional[bytes], Optional[Headers]]
+# (segment, offset après le dernier enregistrement lu, fin du segment atteinte)
+SpillPosition = Tuple[int, int, bool]
+
+_FRAME = struct.Struct('<II')     # crc32 du contenu, longueur du contenu
+_RECORD = struct.Struct('<HHIH')  # longueur topic, longueur clé, longueur valeur, nombre d'en-têtes
+_HEADER = struct.Struct('<HI')    # longueur du nom, longueur de la valeur
+NO_KEY = 0xFFFF
+
+SEGMENT_SUFFIX = '.seg'
+CURSOR_FILE = 'cursor'
+RATE_WINDOW_SECONDS = 60.0
+
+
+def _encode_record(topic: str, value: bytes, key: Optional[bytes], headers: Optional[Headers]) -> bytes:
+    """Sérialise un message Kafka en enregistrement du journal (avec son cadre)"""
+    topic_bytes = topic.encode('utf-8')
+    headers = headers or []
+    parts = [_RECORD.pack(len(topic_bytes), NO_KEY if key is None else len(key), len(value), len(headers)), topic_bytes]
+    if key is not None:
+        parts.append(key)
+    for name, header_value in headers:
+        name_bytes = name.encode('utf-8')
+        header_value = header_value or b''
+        parts.extend((_HEADER.pack(len(name_bytes), len(header_value)), name_bytes, header_value))
+    parts.append(value)
+    payload = b''.join(parts)
+    return _FRAME.pack(zlib.crc32(payload), len(payload)) + payload
+
+
+def _decode_record(payload: bytes) -> SpillRecord:
+    """Reconstruit un message Kafka à partir du contenu d'un enregistrement"""
+    topic_length, key_length, value_length, header_count = _RECORD.unpack_from(payload)
+    position = _RECORD.size
+    topic = payload[position:position + topic_length].decode('utf-8')
+    position += topic_length
+    key = None
+    if key_length != NO_KEY:
+        key = payload[position:position + key_length]
+        position += key_length
+    headers: Headers = []
+    for _ in range(header_count):
+        name_length, header_length = _HEADER.unpack_from(payload, position)
+        position += _HEADER.size
+        name = payload[position:position + name_length].decode('utf-8')
+        position += name_length
+        headers.append((name, payload[position:position + header_length]))
+        position += header_length
+    value = payload[position:position + value_length]
+    return topic, value, key, headers or None
+
+
+def _read_frame(file) -> Optional[bytes]:
+    """Lit un enregistrement; None en fin de segment ou sur une écriture interrompue"""
+    frame = file.read(_FRAME.size)
+    if len(frame) < _FRAME.size:
+        return None
+    crc, length = _FRAME.unpack(frame)
+    payload = file.read(length)
+    if len(payload) < length or zlib.crc32(payload) != crc:
+        return None
+    return payload
+
+
+class SpillLog:
+    """Journal append-only en segments, relu dans l'ordre d'écriture"""
+    
+    def __init__(self, directory: str, segment_bytes: int = 16 * 1024 * 1024, max_bytes: int = 1024 ** 3):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        
+        self._lock = threading.Lock()
+        self._appended = threading.Event()
+        self._write_file = None
+        self._write_id: Optional[int] = None
+        self._write_size = 0
+        
+        self.pending_records = 0
+        self.pending_bytes = 0
+        self.spilled_total = 0
+        self.drained_total = 0
+        self._drain_samples: Deque[Tuple[float, int]] = deque()
+        
+        os.makedirs(directory, exist_ok=True)
+        self._segments: Deque[int] = deque(sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        ))
+        self._cursor = self._load_cursor()
+        self._scan_pending()
+        
+        if self.pending_records:
+            logger.warning(
+                f"Journal de débordement: {self.pending_records} messages en attente "
+                f"({self.pending_bytes} octets) dans {directory}"
+            )
+    
+    def _segment_path(self, segment_id: int) -> str:
+        return os.path.join(self.directory, f"{segment_id:012d}{SEGMENT_SUFFIX}")
+    
+    def _load_cursor(self) -> Tuple[int, int]:
+        """Lit la position de relecture persistée (segment, offset)"""
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as file:
+                segment_id, offset = file.read().split()
+                return int(segment_id), int(offset)
+        except (OSError, ValueError):
+            return (self._segments[0], 0) if self._segments else (0, 0)
+    
+    def _save_cursor(self) -> None:
+        """Persiste la position de relecture de manière atomique"""
+        path = os.path.join(self.directory, CURSOR_FILE)
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            file.write(f"{self._cursor[0]} {self._cursor[1]}")
+        os.replace(temporary_path, path)
+    
+    def _scan_pending(self) -> None:
+        """Compte les messages restant à relire au démarrage (sans charger leur contenu)"""
+        for segment_id in self._segments:
+            offset = self._cursor[1] if segment_id == self._cursor[0] else 0
+            with open(self._segment_path(segment_id), 'rb') as file:
+                file.seek(offset)
+                while True:
+                    frame = file.read(_FRAME.size)
+                    if len(frame) < _FRAME.size:
+                        break
+                    _, length = _FRAME.unpack(frame)
+                    file.seek(length, os.SEEK_CUR)
+                    self.pending_records += 1
+                    self.pending_bytes += _FRAME.size + length
+    
+    def is_empty(self) -> bool:
+        """Indique si tous les messages du journal ont été réinjectés"""
+        return self.pending_records == 0
+    
+    def append(self, topic: str, value: bytes, key: Optional[bytes] = None, headers: Optional[Headers] = None) -> None:
+        """
+        Ajoute un message à la fin du journal
+        
+        Raises:
+            BufferError: si la taille maximale du journal est atteinte
+        """
+        record = _encode_record(topic, value, key, headers)
+        with self._lock:
+            if self.pending_bytes + len(record) > self.max_bytes:
+                raise BufferError("Journal de débordement plein")
+            
+            if self._write_file is None or self._write_size >= self.segment_bytes:
+                self._roll_segment()
+            self._write_file.write(record)
+            self._write_file.flush()
+            self._write_size += len(record)
+            
+            self.pending_records += 1
+            self.pending_bytes += len(record)
+            self.spilled_total += 1
+        self._appended.set()
+    
+    def _roll_segment(self) -> None:
+        """Ferme le segment courant et en ouvre un nouveau (verrou détenu)"""
+        self._seal_segment()
+        self._write_id = (self._segments[-1] + 1) if self._segments else self._cursor[0]
+        self._segments.append(self._write_id)
+        self._write_file = open(self._segment_path(self._write_id), 'ab')
+        self._write_size = 0
+    
+    def _seal_segment(self) -> None:
+        """Ferme le segment en cours d'écriture (verrou détenu)"""
+        if self._write_file is not None:
+            self._write_file.close()
+            self._write_file = None
+            self._write_id = None
+    
+    def wait_for_records(self, timeout: float) -> None:
+        """Attend l'ajout d'un message au journal"""
+        self._appended.wait(timeout)
+        self._appended.clear()
+    
+    def read_batch(self, max_records: int) -> Tuple[List[SpillRecord], Optional[SpillPosition]]:
+        """
+        Lit les prochains messages à réinjecter, sans les retirer du journal
+        
+        Args:
+            max_records: Nombre maximum de messages lus (borne la mémoire utilisée)
+        
+        Returns:
+            Tuple (messages, position à passer à commit), position None si le journal est vide
+        """
+        with self._lock:
+            if not self._segments:
+                return [], None
+            segment_id = self._segments[0]
+            # Un segment n'est jamais relu pendant qu'on y écrit encore
+            if segment_id == self._write_id:
+                self._seal_segment()
+        
+        offset = self._cursor[1] if self._cursor[0] == segment_id else 0
+        records: List[SpillRecord] = []
+        reached_end = False
+        with open(self._segment_path(segment_id), 'rb') as file:
+            file.seek(offset)
+            while len(records) < max_records:
+                payload = _read_frame(file)
+                if payload is None:
+                    reached_end = True
+                    break
+                records.append(_decode_record(payload))
+                offset = file.tell()
+            else:
+                reached_end = _read_frame(file) is None
+        
+        return records, (segment_id, offset, reached_end)
+    
+    def commit(self, position: SpillPosition, count: int) -> None:
+        """
+        Retire du journal les messages lus, une fois confirmés par le broker
+        
+        Args:
+            position: Position renvoyée par read_batch
+            count: Nombre de messages lus
+        """
+        segment_id, offset, reached_end = position
+        with self._lock:
+            previous_offset = self._cursor[1] if self._cursor[0] == segment_id else 0
+            self.pending_records = max(0, self.pending_records - count)
+            self.pending_bytes = max(0, self.pending_bytes - (offset - previous_offset))
+            
+            if reached_end:
+                os.remove(self._segment_path(segment_id))
+                self._segments.popleft()
+                self._cursor = (self._segments[0], 0) if self._segments else (segment_id + 1, 0)
+                if not self._segments:
+                    # Journal vidé: on oublie les éventuels enregistrements tronqués
+                    self.pending_records = 0
+                    self.pending_bytes = 0
+            else:
+                self._cursor = (segment_id, offset)
+            self._save_cursor()
+            
+            self.drained_total += count
+            now = time.monotonic()
+            self._drain_samples.append((now, count))
+            self._prune_samples(now)
+    
+    def _prune_samples(self, now: float) -> None:
+        """Oublie les réinjections sorties de la fenêtre de débit (verrou détenu)"""
+        while self._drain_samples and now - self._drain_samples[0][0] > RATE_WINDOW_SECONDS:
+            self._drain_samples.popleft()
+    
+    def stats(self) -> dict:
+        """Métriques du journal: taille en attente, volumes et débit de réinjection"""
+        with self._lock:
+            self._prune_samples(time.monotonic())
+            drained_recently = sum(count for _, count in self._drain_samples)
+            return {
+                "pending_records": self.pending_records,
+                "pending_bytes": self.pending_bytes,
+                "segments": len(self._segments),
+                "spilled_total": self.spilled_total,
+                "drained_total": self.drained_total,
+                "drain_rate": round(drained_recently / RATE_WINDOW_SECONDS, 2)
+            }
+    
+    def close(self) -> None:
+        """Ferme le segment en cours d'écriture"""
+        with self._lock:
+            self._seal_segment()
@@ -0,0 +1,87 @@
+"""
+Microbenchmark de la validation/sérialisation des mesures
+
+Compare, pour une mesure seule et pour un lot, le chemin générique
+(json.loads + CapteurData.model_validate + model_dump_json) au chemin rapide
+(TypeAdapter.validate_json sur les octets bruts + dump_json).
+
+Usage (depuis ingestion-capteurs/):
+    python -m benchmarks.bench_validation
+"""
+
+from datetime import datetime, timedelta
+import json
+import random
+import timeit
+
+from app.models import CapteurData, CapteurDataAdapter, CapteurDataListAdapter
+
+SENSOR_IDS = ["TEMP001", "HUM001", "SOIL001", "PH001", "LIGHT001"]
+BATCH_SIZE = 500
+REPEAT = 5
+
+
+def generate_reading(timestamp: datetime) -> dict:
+    """Génère une mesure réaliste (même forme que le simulateur)"""
+    return {
+        "capteur_id": random.choice(SENSOR_IDS),
+        "timestamp": timestamp.isoformat(),
+        "temperature": round(random.uniform(15.0, 35.0), 2),
+        "humidite": round(random.uniform(30.0, 90.0), 2),
+        "humidite_sol": round(random.uniform(20.0, 80.0), 2),
+        "niveau_ph": round(random.uniform(5.5, 8.0), 2),
+        "luminosite": round(random.uniform(0.0, 100000.0), 2)
+    }
+
+
+def generic_single(body: bytes) -> bytes:
+    """Chemin générique: décodage JSON, validation du dict, re-sérialisation"""
+    data = CapteurData.model_validate(json.loads(body))
+    return data.model_dump_json().encode('utf-8')
+
+
+def fast_single(body: bytes) -> bytes:
+    """Chemin rapide: validation des octets bruts et sérialisation directe"""
+    return CapteurDataAdapter.dump_json(CapteurDataAdapter.validate_json(body))
+
+
+def generic_batch(body: bytes) -> list:
+    return [CapteurData.model_validate(item).model_dump_json().encode('utf-8') for item in json.loads(body)]
+
+
+def fast_batch(body: bytes) -> list:
+    return [CapteurDataAdapter.dump_json(data) for data in CapteurDataListAdapter.validate_json(body)]
+
+
+def measure(label: str, func, body: bytes, number: int, readings_per_call: int) -> float:
+    """Mesure le débit (mesures/s) du meilleur des REPEAT essais"""
+    best = min(timeit.repeat(lambda: func(body), number=number, repeat=REPEAT))
+    rate = number * readings_per_call / best
+    print(f"  {label:<10} {best / number * 1e6:10.2f} µs/appel  {rate:12,.0f} mesures/s")
+    return rate
+
+
+def main():
+    start = datetime.utcnow()
+    single = json.dumps(generate_reading(start)).encode('utf-8')
+    batch = json.dumps([
+        generate_reading(start + timedelta(seconds=i)) for i in range(BATCH_SIZE)
+    ]).encode('utf-8')
+
+    # Les deux chemins doivent produire exactement les mêmes messages Kafka
+    assert generic_single(single) == fast_single(single)
+    assert generic_batch(batch) == fast_batch(batch)
+
+    print("Mesure seule:")
+    generic_rate = measure("générique", generic_single, single, 20000, 1)
+    fast_rate = measure("rapide", fast_single, single, 20000, 1)
+    print(f"  gain: x{fast_rate / generic_rate:.2f}")
+
+    print(f"Lot de {BATCH_SIZE} mesures:")
+    generic_rate = measure("générique", generic_batch, batch, 50, BATCH_SIZE)
+    fast_rate = measure("rapide", fast_batch, batch, 50, BATCH_SIZE)
+    print(f"  gain: x{fast_rate / generic_rate:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,12 @@
 """
 WebSocket Consumer - Connects to the simulator and forwards data to the ingestion API
+over a single persistent WebSocket connection
 """
 
 import asyncio
 import websockets
 import json
 import logging
-import requests
 from datetime import datetime
 
 logging.basicConfig(
@@ -17,13 +17,27 @@ logger = logging.getLogger(__name__)
 
 # Configuration
 SIMULATOR_WS_URL = "ws://localhost:8001/ws/sensor-stream"
-INGESTION_API_URL = "http://localhost:8000/ingest"
+INGESTION_WS_URL = "ws://localhost:8000/ws/ingest"
+
+
+async def read_acks(ingestion_ws, stats: dict):
+    """
+    Read cumulative acknowledgements sent back by the ingestion API
+    """
+    async for message in ingestion_ws:
+        ack = json.loads(message)
+        if ack.get("type") != "ack":
+            continue
+        stats["acked"] = ack["seq"]
+        for rejection in ack.get("rejected", []):
+            stats["errors"] += 1
+            logger.error(f"❌ Message {rejection['seq']} rejected: {rejection['reason']}")
 
 
 async def consume_sensor_data():
     """
     Connect to WebSocket simulator and consume real-time sensor data
-    Forwards each message to the ingestion API
+    Forwards each message to the ingestion API WebSocket endpoint
     """
     retry_count = 0
     max_retries = 5
@@ -32,52 +46,39 @@ async def consume_sensor_data():
         try:
             logger.info(f"Connecting to sensor simulator at {SIMULATOR_WS_URL}...")
             
-            async with websockets.connect(SIMULATOR_WS_URL) as websocket:
-                logger.info("✅ Connected to sensor stream!")
+            async with websockets.connect(SIMULATOR_WS_URL) as websocket, \
+                    websockets.connect(INGESTION_WS_URL) as ingestion_ws:
+                logger.info("✅ Connected to sensor stream and ingestion API!")
                 retry_count = 0  # Reset on successful connection
                 
                 message_count = 0
-                error_count = 0
+                stats = {"acked": 0, "errors": 0}
+                ack_task = asyncio.create_task(read_acks(ingestion_ws, stats))
                 
-                while True:
-                    try:
-                        # Receive message from simulator
-                        message = await websocket.recv()
-                        data = json.loads(message)
-                        message_count += 1
-                        
-                        logger.info(f"📊 Received message {message_count} from sensor {data.get('capteur_id')}")
-                        
-                        # Forward to ingestion API
+                try:
+                    while True:
                         try:
-                            response = requests.post(
-                                INGESTION_API_URL,
-                                json=data,
-                                timeout=5
-                            )
+                            # Receive message from simulator
+                            message = await websocket.recv()
+                            data = json.loads(message)
+                            message_count += 1
+                            
+                            logger.debug(f"📊 Received message {message_count} from sensor {data.get('capteur_id')}")
+                            
+                            # Forward over the persistent ingestion connection
+                            await ingestion_ws.send(message)
                             
-                            if response.status_code == 200:
-                                logger.info(f"✅ Message {message_count} successfully sent to ingestion API")
-                            else:
-                                logger.error(f"❌ Failed to send message {message_count}: {response.status_code}")
-                                error_count += 1
-                                
-                        except requests.exceptions.RequestException as e:
-                            logger.error(f"❌ Error sending to ingestion API: {e}")
-                            error_count += 1
+                            # Log statistics periodically
+                            if message_count % 10 == 0:
+                                error_count = stats["errors"]
+                                success_rate = ((message_count - error_count) / message_count) * 100
+                                logger.info(f"📈 Stats - Total: {message_count}, Acked: {stats['acked']}, Errors: {error_count}, Success Rate: {success_rate:.1f}%")
                         
-                        # Log statistics periodically
-                        if message_count % 10 == 0:
-                            success_rate = ((message_count - error_count) / message_count) * 100
-                            logger.info(f"📈 Stats - Total: {message_count}, Errors: {error_count}, Success Rate: {success_rate:.1f}%")
-                    
-                    except json.JSONDecodeError as e:
-                        logger.error(f"❌ Invalid JSON received: {e}")
-                        error_count += 1
-                    
-                    except Exception as e:
-                        logger.error(f"❌ Error processing message: {e}")
-                        error_count += 1
+                        except json.JSONDecodeError as e:
+                            logger.error(f"❌ Invalid JSON received: {e}")
+                            stats["errors"] += 1
+                finally:
+                    ack_task.cancel()
         
         except websockets.exceptions.WebSocketException as e:
             retry_count += 1
@@ -102,7 +103,7 @@ async def main():
     """Main entry point"""
     logger.info("🚀 Starting WebSocket Consumer for AgroTrace")
     logger.info(f"Simulator: {SIMULATOR_WS_URL}")
-    logger.info(f"Ingestion API: {INGESTION_API_URL}")
+    logger.info(f"Ingestion API: {INGESTION_WS_URL}")
     logger.info("Press Ctrl+C to stop")
     logger.info("-" * 50)
     
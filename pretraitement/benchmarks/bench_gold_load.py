@@ -0,0 +1,143 @@
+"""
+Benchmark du chargement Gold dans clean_sensor_data
+
+Compare l'ancien chemin (df.iterrows() puis cursor.executemany, un aller-retour
+par ligne) au chargement par COPY vers une table de staging suivi d'un upsert
+ensembliste (GoldLoader.load_clean_data), pour 10k, 100k et 1M lignes.
+
+Nécessite une base TimescaleDB (variables DB_* comme le worker ETL). Les
+tables sont créées dans un schéma dédié, supprimé à la fin: les données
+réelles ne sont pas touchées. L'ancien chemin prend plusieurs minutes à 1M
+lignes; il n'est mesuré que jusqu'à --legacy-max-rows (100k par défaut).
+
+Usage (depuis pretraitement/):
+    python -m benchmarks.bench_gold_load [--sizes 10000 100000 1000000] [--legacy-max-rows N]
+"""
+
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from pipeline.gold import GoldLoader
+
+SCHEMA = "bench_gold_load"
+SENSOR_IDS = ["TEMP001", "HUM001", "SOIL001", "PH001", "LIGHT001"]
+
+
+def generate_clean_data(rows: int, offset: int = 0) -> pd.DataFrame:
+    """Génère des mesures nettoyées de forme réaliste, aux clés uniques"""
+    rng = np.random.default_rng(rows + offset)
+    index = np.arange(offset, offset + rows)
+    return pd.DataFrame({
+        'capteur_id': np.array(SENSOR_IDS)[index % len(SENSOR_IDS)],
+        'timestamp': pd.Timestamp('2025-01-01', tz='UTC') + pd.to_timedelta(index // len(SENSOR_IDS), unit='s'),
+        'temperature': rng.uniform(15.0, 35.0, rows).round(2),
+        'humidite': rng.uniform(30.0, 90.0, rows).round(2),
+        'humidite_sol': rng.uniform(20.0, 80.0, rows).round(2),
+        'niveau_ph': rng.uniform(5.5, 8.0, rows).round(2),
+        'luminosite': rng.uniform(0.0, 100000.0, rows).round(2)
+    })
+
+
+def legacy_load(connection: psycopg2.extensions.connection, df: pd.DataFrame) -> int:
+    """Ancien chemin de GoldLoader.load_clean_data (iterrows + executemany)"""
+    cursor = connection.cursor()
+    insert_query = """
+        INSERT INTO clean_sensor_data
+        (capteur_id, timestamp, temperature, humidite, humidite_sol, niveau_ph, luminosite)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (capteur_id, timestamp) DO UPDATE SET
+            temperature = EXCLUDED.temperature,
+            humidite = EXCLUDED.humidite,
+            humidite_sol = EXCLUDED.humidite_sol,
+            niveau_ph = EXCLUDED.niveau_ph,
+            luminosite = EXCLUDED.luminosite,
+            processed_at = NOW();
+    """
+    records = []
+    for _, row in df.iterrows():
+        records.append((
+            row['capteur_id'],
+            row['timestamp'],
+            row['temperature'],
+            row['humidite'],
+            row['humidite_sol'],
+            row['niveau_ph'],
+            row['luminosite']
+        ))
+    cursor.executemany(insert_query, records)
+    connection.commit()
+    cursor.close()
+    return len(records)
+
+
+def truncate(connection: psycopg2.extensions.connection) -> None:
+    cursor = connection.cursor()
+    cursor.execute("TRUNCATE clean_sensor_data")
+    connection.commit()
+    cursor.close()
+
+
+def measure(label: str, load, df: pd.DataFrame) -> float:
+    """Charge le DataFrame dans une table vide et renvoie le débit (lignes/s)"""
+    started_at = time.perf_counter()
+    load(df)
+    elapsed = time.perf_counter() - started_at
+    rate = len(df) / elapsed
+    print(f"  {label:<8} {elapsed:10.2f} s  {rate:12,.0f} lignes/s")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare les chargements Gold executemany et COPY")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--legacy-max-rows", type=int, default=100_000,
+                        help="taille maximale mesurée pour l'ancien chemin")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    
+    connection = psycopg2.connect(
+        host=os.getenv("DB_HOST", "localhost"),
+        port=os.getenv("DB_PORT", "5432"),
+        database=os.getenv("DB_NAME", "agrotrace_db"),
+        user=os.getenv("DB_USER", "admin"),
+        password=os.getenv("DB_PASSWORD", "password")
+    )
+    cursor = connection.cursor()
+    cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA}")
+    # Les noms non qualifiés (clean_sensor_data) désignent les tables du schéma de test
+    cursor.execute(f"SET search_path TO {SCHEMA}, public")
+    connection.commit()
+    cursor.close()
+    
+    loader = GoldLoader(connection)
+    try:
+        loader.create_clean_table()
+        for size in args.sizes:
+            df = generate_clean_data(size)
+            print(f"{size:,} lignes:")
+            
+            copy_rate = measure("copy", loader.load_clean_data, df)
+            truncate(connection)
+            if size <= args.legacy_max_rows:
+                legacy_rate = measure("legacy", lambda frame: legacy_load(connection, frame), df)
+                truncate(connection)
+                print(f"  gain: x{copy_rate / legacy_rate:.1f}")
+            else:
+                print("  legacy   non mesuré (--legacy-max-rows)")
+    finally:
+        connection.rollback()
+        cursor = connection.cursor()
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        connection.commit()
+        cursor.close()
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
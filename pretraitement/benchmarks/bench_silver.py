@@ -0,0 +1,85 @@
+"""
+Benchmark de l'interpolation Silver
+
+Compare l'ancienne interpolation (une série par colonne sur tout le lot, sans
+tenir compte du capteur ni du temps) à SilverTransformer._fill_missing_values
+(par capteur, pondérée par le temps, vectorisée), pour 10k, 100k et 1M lignes.
+
+Mesure uniquement les débits: l'exactitude est vérifiée par les tests
+(tests/test_silver.py). Aucune base de données n'est nécessaire.
+
+Usage (depuis pretraitement/):
+    python -m benchmarks.bench_silver [--sizes 10000 100000 1000000]
+"""
+
+import argparse
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from pipeline.silver import MEASURE_COLUMNS, SilverTransformer
+
+
+def generate_raw_data(rows: int, sensors: int = 50, missing_ratio: float = 0.05, seed: int = 0) -> pd.DataFrame:
+    """
+    Génère un lot brut ordonné comme l'extraction Bronze (timestamp, capteur_id)
+    
+    Chaque capteur émet à intervalles irréguliers; une fraction des mesures
+    manque, et le dernier capteur n'a aucune humidité du sol.
+    """
+    rng = np.random.default_rng(seed)
+    capteur_ids = np.array([f"CAPT{i:03d}" for i in range(sensors)])[rng.integers(0, sensors, rows)]
+    # Secondes entières distinctes: la clé (capteur_id, timestamp) reste unique
+    seconds = np.sort(rng.choice(rows * 10, rows, replace=False))
+    df = pd.DataFrame({
+        'id': np.arange(rows),
+        'capteur_id': capteur_ids,
+        'timestamp': pd.Timestamp('2025-01-01', tz='UTC') + pd.to_timedelta(seconds, unit='s')
+    })
+    for col in MEASURE_COLUMNS:
+        values = rng.uniform(0.0, 100.0, rows)
+        values[rng.random(rows) < missing_ratio] = np.nan
+        df[col] = values
+    df.loc[df['capteur_id'] == f"CAPT{sensors - 1:03d}", 'humidite_sol'] = np.nan
+    return df.sort_values(['timestamp', 'capteur_id'], ignore_index=True)
+
+
+def legacy_fill(df: pd.DataFrame) -> pd.DataFrame:
+    """Ancienne version de SilverTransformer._fill_missing_values"""
+    for col in MEASURE_COLUMNS:
+        if df[col].isna().sum() > 0:
+            df[col] = df[col].interpolate(method='linear', limit_direction='both')
+    return df
+
+
+def measure(label: str, fill, df: pd.DataFrame) -> float:
+    """Applique l'interpolation sur une copie du lot et renvoie le débit (lignes/s)"""
+    frame = df.copy()
+    started_at = time.perf_counter()
+    fill(frame)
+    elapsed = time.perf_counter() - started_at
+    rate = len(df) / elapsed
+    print(f"  {label:<8} {elapsed:10.3f} s  {rate:14,.0f} lignes/s")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mesure l'interpolation Silver")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    
+    transformer = SilverTransformer()
+    
+    for size in args.sizes:
+        df = generate_raw_data(size)
+        print(f"{size:,} lignes:")
+        legacy_rate = measure("legacy", legacy_fill, df)
+        silver_rate = measure("silver", transformer._fill_missing_values, df)
+        print(f"  gain: x{silver_rate / legacy_rate:.1f}")
+
+
+if __name__ == "__main__":
+    main()
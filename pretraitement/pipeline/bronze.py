@@ -4,46 +4,188 @@ Bronze Layer - Extraction des données brutes depuis TimescaleDB
 
 import psycopg2
 import pandas as pd
-from typing import Optional
+from typing import Iterator, List, Optional, Tuple
 import logging
+import queue
+import threading
+import uuid
 
 logger = logging.getLogger(__name__)
 
+RAW_COLUMNS = [
+    'id', 'capteur_id', 'timestamp', 'temperature', 'humidite', 'humidite_sol', 'niveau_ph', 'luminosite', 'row_version'
+]
+# Version de la ligne extraite (transaction qui l'a écrite): un upsert
+# postérieur à l'extraction la change, et la ligne n'est alors pas marquée
+# nettoyée avec les valeurs de l'extraction (voir GoldLoader._mark_stage)
+ROW_VERSION_EXPRESSION = "xmin::text::bigint"
+_RAW_SELECT = ', '.join(RAW_COLUMNS[:-1] + [f"{ROW_VERSION_EXPRESSION} AS row_version"])
+MEASURE_COLUMNS = ['temperature', 'humidite', 'humidite_sol', 'niveau_ph', 'luminosite']
+
+# Clé de parcours des données brutes: (timestamp, capteur_id)
+Watermark = Tuple[pd.Timestamp, str]
+
+# Shard enregistré dans etl_watermark pour un worker qui traite tous les capteurs
+ALL_PARTITIONS = -1
+
+# Shard des lignes sans partition Kafka (écrites avant l'ajout de
+# kafka_partition, ou hors Kafka): sans propriétaire, aucun worker
+# ETL_PARTITION ne les nettoierait
+NULL_PARTITION_SHARD = 0
+_SHARD_EXPRESSION = f"COALESCE(kafka_partition, {NULL_PARTITION_SHARD})"
+
 
 class BronzeExtractor:
     """Extraction des données brutes non nettoyées"""
     
-    def __init__(self, db_connection: psycopg2.extensions.connection):
+    def __init__(
+        self,
+        db_connection: psycopg2.extensions.connection,
+        stream_connection: Optional[psycopg2.extensions.connection] = None
+    ):
         self.db_connection = db_connection
+        # Connexion réservée au curseur serveur de iter_raw_data: les commits
+        # du chargement (Gold) sur db_connection fermeraient le curseur
+        self.stream_connection = stream_connection
     
-    def extract_raw_data(self, batch_size: int = 1000) -> Optional[pd.DataFrame]:
+    def create_watermark_table(self, partition: Optional[int] = None):
         """
-        Extrait les données non nettoyées de la table raw_capteur_data
+        Crée la table des positions d'extraction et l'index partiel des
+        données à nettoyer
+        
+        L'index ne contient que les lignes is_cleaned = FALSE, dans l'ordre de
+        parcours (timestamp, capteur_id): l'extraction est un parcours d'index
+        borné, sans tri, quelle que soit la taille de l'hypertable.
         
         Args:
-            batch_size: Nombre maximum de lignes à extraire
+            partition: Shard traité par ce worker (l'index commence alors par
+                le shard de la ligne, voir NULL_PARTITION_SHARD)
+        """
+        try:
+            cursor = self.db_connection.cursor()
+            
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS etl_watermark (
+                    shard INTEGER PRIMARY KEY,
+                    last_timestamp TIMESTAMPTZ NOT NULL,
+                    last_capteur_id VARCHAR(50) NOT NULL,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+            """)
             
+            if partition is None:
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_raw_capteur_data_to_clean
+                    ON raw_capteur_data (timestamp, capteur_id)
+                    WHERE is_cleaned = FALSE;
+                """)
+            else:
+                cursor.execute(f"""
+                    CREATE INDEX IF NOT EXISTS idx_raw_capteur_data_to_clean_by_shard
+                    ON raw_capteur_data (({_SHARD_EXPRESSION}), timestamp, capteur_id)
+                    WHERE is_cleaned = FALSE;
+                """)
+            
+            self.db_connection.commit()
+            logger.info("Table etl_watermark et index d'extraction créés/vérifiés")
+            cursor.close()
+        
+        except Exception as e:
+            logger.error(f"Erreur lors de la création de la table etl_watermark: {e}")
+            self.db_connection.rollback()
+            raise
+    
+    def load_watermark(self, partition: Optional[int] = None) -> Optional[Watermark]:
+        """
+        Lit la dernière position d'extraction enregistrée
+        
+        Args:
+            partition: Shard traité, None pour tous
+        
         Returns:
-            DataFrame avec les données brutes ou None si aucune donnée
-        """
-        query = """
-            SELECT 
-                id,
-                capteur_id,
-                timestamp,
-                temperature,
-                humidite,
-                humidite_sol,
-                niveau_ph,
-                luminosite
+            Clé (timestamp, capteur_id) de la dernière ligne extraite, ou None
+        """
+        shard = ALL_PARTITIONS if partition is None else partition
+        cursor = self.db_connection.cursor()
+        cursor.execute(
+            "SELECT last_timestamp, last_capteur_id FROM etl_watermark WHERE shard = %s",
+            (shard,)
+        )
+        row = cursor.fetchone()
+        cursor.close()
+        self.db_connection.commit()
+        return (row[0], row[1]) if row else None
+    
+    def save_watermark(self, watermark: Watermark, partition: Optional[int] = None):
+        """
+        Enregistre la position d'extraction
+        
+        Args:
+            watermark: Clé (timestamp, capteur_id) de la dernière ligne traitée
+            partition: Shard traité, None pour tous
+        """
+        shard = ALL_PARTITIONS if partition is None else partition
+        try:
+            cursor = self.db_connection.cursor()
+            cursor.execute("""
+                INSERT INTO etl_watermark (shard, last_timestamp, last_capteur_id)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (shard) DO UPDATE SET
+                    last_timestamp = EXCLUDED.last_timestamp,
+                    last_capteur_id = EXCLUDED.last_capteur_id,
+                    updated_at = NOW();
+            """, (shard, watermark[0], watermark[1]))
+            self.db_connection.commit()
+            cursor.close()
+        except Exception as e:
+            logger.error(f"Erreur lors de l'enregistrement de la position d'extraction: {e}")
+            self.db_connection.rollback()
+            raise
+    
+    def _raw_data_query(self, partition: Optional[int], after: Optional[Watermark]) -> Tuple[str, List]:
+        """Requête d'extraction des lignes à nettoyer, dans l'ordre (timestamp, capteur_id)"""
+        conditions = ["is_cleaned = FALSE"]
+        params = []
+        # Conditions écrites pour correspondre à l'index partiel du worker
+        if partition is not None:
+            conditions.append(f"{_SHARD_EXPRESSION} = %s")
+            params.append(partition)
+        if after is not None:
+            conditions.append("(timestamp, capteur_id) > (%s, %s)")
+            params.extend(after)
+        
+        query = f"""
+            SELECT {_RAW_SELECT}
             FROM raw_capteur_data
-            WHERE is_cleaned = FALSE
-            ORDER BY timestamp ASC
-            LIMIT %s
+            WHERE {' AND '.join(conditions)}
+            ORDER BY timestamp ASC, capteur_id ASC
+        """
+        return query, params
+    
+    def extract_raw_data(
+        self,
+        batch_size: int = 1000,
+        partition: Optional[int] = None,
+        after: Optional[Watermark] = None
+    ) -> Optional[pd.DataFrame]:
         """
+        Extrait les données non nettoyées de la table raw_capteur_data
+        
+        Args:
+            batch_size: Nombre maximum de lignes à extraire
+            partition: Shard à extraire (partition Kafka d'origine, NULL_PARTITION_SHARD
+                pour les lignes sans partition), None pour tous
+            after: Position (timestamp, capteur_id) après laquelle reprendre, None pour le début
+        
+        Returns:
+            DataFrame avec les données brutes (ordonnées par timestamp, capteur_id) ou None si aucune donnée
+        """
+        query, params = self._raw_data_query(partition, after)
+        query += " LIMIT %s"
+        params.append(batch_size)
         
         try:
-            df = pd.read_sql_query(query, self.db_connection, params=(batch_size,))
+            df = pd.read_sql_query(query, self.db_connection, params=tuple(params))
             
             if df.empty:
                 logger.info("Aucune donnée à traiter")
@@ -51,7 +193,104 @@ class BronzeExtractor:
             
             logger.info(f"Extraction de {len(df)} enregistrements bruts")
             return df
-            
+        
         except Exception as e:
             logger.error(f"Erreur lors de l'extraction des données: {e}")
             raise
+    
+    def _fetch_chunks(self, itersize: int, partition: Optional[int], after: Optional[Watermark]) -> Iterator[pd.DataFrame]:
+        """Lit les lignes à nettoyer par blocs de itersize avec un curseur serveur"""
+        connection = self.stream_connection or self.db_connection
+        query, params = self._raw_data_query(partition, after)
+        
+        # Curseur nommé: le résultat reste sur le serveur, chaque bloc est
+        # obtenu par un FETCH FORWARD itersize
+        cursor = connection.cursor(name=f"bronze_{uuid.uuid4().hex}")
+        cursor.itersize = itersize
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(itersize)
+                if not rows:
+                    return
+                df = pd.DataFrame.from_records(rows, columns=RAW_COLUMNS, coerce_float=True)
+                df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+                df[MEASURE_COLUMNS] = df[MEASURE_COLUMNS].astype(float)
+                yield df
+        finally:
+            cursor.close()
+            # Lecture seule: termine la transaction (et libère son snapshot)
+            connection.rollback()
+    
+    def iter_raw_data(
+        self,
+        itersize: int = 10000,
+        partition: Optional[int] = None,
+        after: Optional[Watermark] = None,
+        prefetch: int = 1
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Extrait les données non nettoyées par blocs, à mémoire bornée
+        
+        Le résultat est lu au fil de l'eau par un curseur serveur: seuls
+        itersize lignes par bloc, et prefetch blocs d'avance, sont en mémoire
+        quelle que soit la taille du backlog. Les blocs suivants sont lus dans
+        un thread pendant que l'appelant traite le bloc courant.
+        
+        Le générateur doit être fermé (fin de boucle, break ou close()) pour
+        libérer le curseur.
+        
+        Args:
+            itersize: Lignes par bloc
+            partition: Shard à extraire (partition Kafka d'origine, NULL_PARTITION_SHARD
+                pour les lignes sans partition), None pour tous
+            after: Position (timestamp, capteur_id) après laquelle reprendre, None pour le début
+            prefetch: Blocs lus d'avance (0 pour lire dans le thread appelant)
+        
+        Returns:
+            Itérateur de DataFrames (ordonnés par timestamp, capteur_id)
+        """
+        chunks = self._fetch_chunks(itersize, partition, after)
+        if prefetch <= 0:
+            yield from chunks
+            return
+        
+        buffer: queue.Queue = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+        end = object()
+        
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    buffer.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def produce():
+            # Le curseur est créé, lu et fermé dans ce thread uniquement
+            try:
+                for chunk in chunks:
+                    if not put(chunk):
+                        return
+                put(end)
+            except Exception as e:
+                put(e)
+            finally:
+                chunks.close()
+        
+        producer = threading.Thread(target=produce, name="bronze-prefetch", daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = buffer.get()
+                if item is end:
+                    return
+                if isinstance(item, Exception):
+                    logger.error(f"Erreur lors de l'extraction des données: {item}")
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            producer.join()
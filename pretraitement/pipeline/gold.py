@@ -4,60 +4,168 @@ Gold Layer - Chargement des données nettoyées
 
 import psycopg2
 import pandas as pd
-from typing import List
+from typing import Callable, Optional, Tuple
+import io
 import logging
 
+from agrotrace_common import silver_rules
+from agrotrace_common.silver_rules import MEASURE_COLUMNS
+
+from pipeline.bronze import ROW_VERSION_EXPRESSION
+
 logger = logging.getLogger(__name__)
 
+_EPOCH = pd.Timestamp(0, tz='UTC')
+_ONE_MICROSECOND = pd.Timedelta(microseconds=1)
+
 
 class GoldLoader:
     """Chargement des données nettoyées dans la base de données"""
     
     def __init__(self, db_connection: psycopg2.extensions.connection):
         self.db_connection = db_connection
+        self._stage_ready = False
     
     def create_clean_table(self):
         """Crée la table clean_sensor_data si elle n'existe pas"""
         try:
             cursor = self.db_connection.cursor()
             
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS clean_sensor_data (
-                    id SERIAL,
-                    capteur_id VARCHAR(50) NOT NULL,
-                    timestamp TIMESTAMPTZ NOT NULL,
-                    temperature DOUBLE PRECISION,
-                    humidite DOUBLE PRECISION,
-                    humidite_sol DOUBLE PRECISION,
-                    niveau_ph DOUBLE PRECISION,
-                    luminosite DOUBLE PRECISION,
-                    processed_at TIMESTAMPTZ DEFAULT NOW(),
-                    PRIMARY KEY (capteur_id, timestamp)
-                );
-            """)
-            
-            # Hypertable pour optimisation temporelle
-            cursor.execute("""
-                SELECT create_hypertable('clean_sensor_data', 'timestamp', 
-                                          if_not_exists => TRUE);
-            """)
+            # Même définition que le nettoyage en continu du consumer (hypertable,
+            # colonne quality_flags ajoutée aux tables existantes)
+            cursor.execute(silver_rules.CLEAN_TABLE_DDL)
             
             self.db_connection.commit()
             logger.info("Table clean_sensor_data créée/vérifiée")
             cursor.close()
-            
+        
         except Exception as e:
             logger.error(f"Erreur lors de la création de la table: {e}")
             self.db_connection.rollback()
             raise
     
+    def _ensure_stage_table(self):
+        """
+        Crée la table de staging du chargement sur la connexion
+        
+        Table temporaire: propre à la session, jamais journalisée dans le WAL
+        et vidée à chaque commit.
+        """
+        if self._stage_ready:
+            return
+        cursor = self.db_connection.cursor()
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS clean_sensor_data_stage (
+                capteur_id VARCHAR(50),
+                timestamp_us BIGINT,
+                temperature DOUBLE PRECISION,
+                humidite DOUBLE PRECISION,
+                humidite_sol DOUBLE PRECISION,
+                niveau_ph DOUBLE PRECISION,
+                luminosite DOUBLE PRECISION,
+                quality_flags INTEGER,
+                row_version BIGINT
+            ) ON COMMIT DELETE ROWS;
+        """)
+        self.db_connection.commit()
+        cursor.close()
+        self._stage_ready = True
+    
+    def _copy_to_stage(self, cursor, df: pd.DataFrame) -> pd.Series:
+        """
+        Envoie le DataFrame par COPY dans la table de staging
+        
+        Les colonnes sont sérialisées d'un bloc en CSV, sans objet Python par
+        ligne. Les timestamps voyagent en microsecondes depuis l'epoch: leur
+        mise en forme texte coûterait plus que tout le reste du CSV.
+        
+        Returns:
+            Timestamps (UTC) des lignes envoyées
+        """
+        timestamps = pd.to_datetime(df['timestamp'], utc=True, cache=False)
+        stage_df = df[['capteur_id'] + MEASURE_COLUMNS]
+        stage_df.insert(1, 'timestamp_us', (timestamps - _EPOCH) // _ONE_MICROSECOND)
+        stage_df.insert(len(stage_df.columns), 'quality_flags', df['quality_flags'] if 'quality_flags' in df else 0)
+        stage_df.insert(len(stage_df.columns), 'row_version', df['row_version'] if 'row_version' in df else None)
+        
+        buffer = io.StringIO()
+        # Valeurs manquantes: champ vide, lu comme NULL par COPY (FORMAT csv)
+        stage_df.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        
+        self._ensure_stage_table()
+        cursor.copy_expert("""
+            COPY clean_sensor_data_stage
+            (capteur_id, timestamp_us, temperature, humidite, humidite_sol, niveau_ph, luminosite, quality_flags, row_version)
+            FROM STDIN WITH (FORMAT csv)
+        """, buffer)
+        return timestamps
+    
+    def _upsert_stage(self, cursor) -> None:
+        """Fusionne la table de staging dans clean_sensor_data en un seul upsert"""
+        cursor.execute("""
+            INSERT INTO clean_sensor_data
+            (capteur_id, timestamp, temperature, humidite, humidite_sol, niveau_ph, luminosite, quality_flags)
+            SELECT capteur_id, TIMESTAMPTZ 'epoch' + timestamp_us * INTERVAL '1 microsecond',
+                temperature, humidite, humidite_sol, niveau_ph, luminosite, quality_flags
+            FROM clean_sensor_data_stage
+            ON CONFLICT (capteur_id, timestamp) DO UPDATE SET
+                temperature = EXCLUDED.temperature,
+                humidite = EXCLUDED.humidite,
+                humidite_sol = EXCLUDED.humidite_sol,
+                niveau_ph = EXCLUDED.niveau_ph,
+                luminosite = EXCLUDED.luminosite,
+                quality_flags = EXCLUDED.quality_flags,
+                processed_at = NOW();
+        """)
+    
+    def _mark_stage(self, cursor, timestamps: pd.Series, check_version: bool = True) -> int:
+        """
+        Marque comme nettoyées les lignes brutes présentes dans la table de staging
+        
+        Jointure sur la clé primaire (capteur_id, timestamp) de
+        raw_capteur_data et sur la version de la ligne lue à l'extraction
+        (row_version, voir bronze.ROW_VERSION_EXPRESSION): une mesure
+        réécrite par un upsert depuis l'extraction reste à nettoyer, avec ses
+        nouvelles valeurs. Les lignes sans version (reportées) ne sont pas
+        marquées. Les bornes du lot sont passées en constantes: seuls les
+        chunks de l'hypertable qui les recouvrent sont parcourus.
+        
+        Args:
+            cursor: Curseur de la transaction
+            timestamps: Timestamps des lignes de la table de staging
+            check_version: Faux pour marquer par clé seule
+        
+        Returns:
+            Nombre de lignes brutes marquées
+        """
+        version_condition = f"AND raw.{ROW_VERSION_EXPRESSION} = stage.row_version" if check_version else ""
+        # Table temporaire: sans statistiques, le planificateur ne connaît pas sa taille
+        cursor.execute("ANALYZE clean_sensor_data_stage")
+        cursor.execute(f"""
+            UPDATE raw_capteur_data AS raw
+            SET is_cleaned = TRUE
+            FROM clean_sensor_data_stage AS stage
+            WHERE raw.timestamp BETWEEN %s AND %s
+                AND raw.capteur_id = stage.capteur_id
+                AND raw.timestamp = TIMESTAMPTZ 'epoch' + stage.timestamp_us * INTERVAL '1 microsecond'
+                AND raw.is_cleaned = FALSE
+                {version_condition}
+        """, (timestamps.min().to_pydatetime(), timestamps.max().to_pydatetime()))
+        return cursor.rowcount
+    
     def load_clean_data(self, df: pd.DataFrame) -> int:
         """
         Insère les données nettoyées dans clean_sensor_data
         
+        Le DataFrame est envoyé par COPY dans la table de staging, puis
+        fusionné dans clean_sensor_data par un seul upsert ensembliste. Les
+        clés (capteur_id, timestamp) doivent être uniques dans le DataFrame,
+        comme dans raw_capteur_data.
+        
         Args:
             df: DataFrame nettoyé
-            
+        
         Returns:
             Nombre d'enregistrements insérés
         """
@@ -66,77 +174,100 @@ class GoldLoader:
         
         try:
             cursor = self.db_connection.cursor()
+            self._copy_to_stage(cursor, df)
+            self._upsert_stage(cursor)
+            self.db_connection.commit()
             
-            insert_query = """
-                INSERT INTO clean_sensor_data 
-                (capteur_id, timestamp, temperature, humidite, humidite_sol, niveau_ph, luminosite)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (capteur_id, timestamp) DO UPDATE SET
-                    temperature = EXCLUDED.temperature,
-                    humidite = EXCLUDED.humidite,
-                    humidite_sol = EXCLUDED.humidite_sol,
-                    niveau_ph = EXCLUDED.niveau_ph,
-                    luminosite = EXCLUDED.luminosite,
-                    processed_at = NOW();
-            """
-            
-            # Insertion en batch
-            records = []
-            for _, row in df.iterrows():
-                records.append((
-                    row['capteur_id'],
-                    row['timestamp'],
-                    row['temperature'],
-                    row['humidite'],
-                    row['humidite_sol'],
-                    row['niveau_ph'],
-                    row['luminosite']
-                ))
+            logger.info(f"{len(df)} enregistrements chargés dans clean_sensor_data")
+            cursor.close()
             
-            cursor.executemany(insert_query, records)
+            return len(df)
+        
+        except Exception as e:
+            logger.error(f"Erreur lors du chargement des données: {e}")
+            self.db_connection.rollback()
+            raise
+    
+    def load_and_mark(
+        self,
+        df: pd.DataFrame,
+        before_commit: Optional[Callable[[psycopg2.extensions.cursor], None]] = None
+    ) -> Tuple[int, int]:
+        """
+        Charge les données nettoyées et marque leurs lignes brutes, en une transaction
+        
+        L'upsert dans clean_sensor_data et le marquage is_cleaned de
+        raw_capteur_data sont validés ensemble: un arrêt entre les deux
+        étapes ne peut plus laisser des lignes chargées mais toujours à
+        nettoyer (qui seraient retraitées au cycle suivant). Le marquage
+        réutilise la table de staging du chargement, par clé primaire et version
+        de ligne (voir _mark_stage).
+        
+        Args:
+            df: DataFrame nettoyé (mêmes clés que les lignes brutes extraites)
+            before_commit: Écriture complémentaire à valider dans la même
+                transaction (report Silver), appelée avec le curseur
+        
+        Returns:
+            Nombre d'enregistrements chargés et marqués
+        """
+        if df is None or df.empty:
+            return 0, 0
+        
+        try:
+            cursor = self.db_connection.cursor()
+            timestamps = self._copy_to_stage(cursor, df)
+            self._upsert_stage(cursor)
+            updated_count = self._mark_stage(cursor, timestamps)
+            if before_commit is not None:
+                before_commit(cursor)
             self.db_connection.commit()
             
-            logger.info(f"{len(records)} enregistrements chargés dans clean_sensor_data")
+            logger.info(
+                f"{len(df)} enregistrements chargés dans clean_sensor_data, "
+                f"{updated_count} marqués comme nettoyés"
+            )
             cursor.close()
             
-            return len(records)
-            
+            return len(df), updated_count
+        
         except Exception as e:
             logger.error(f"Erreur lors du chargement des données: {e}")
             self.db_connection.rollback()
             raise
     
-    def mark_as_cleaned(self, ids: List[int]) -> int:
+    def mark_as_cleaned(self, df: pd.DataFrame) -> int:
         """
         Marque les enregistrements comme nettoyés dans raw_capteur_data
         
+        Les clés sont envoyées par COPY dans la table de staging et jointes
+        sur la clé primaire, plutôt qu'un tableau d'id (colonne SERIAL non
+        indexée, qui obligeait à parcourir chaque chunk de l'hypertable).
+        
         Args:
-            ids: Liste des IDs à marquer
-            
+            df: DataFrame des lignes à marquer (colonnes capteur_id et
+                timestamp, et row_version pour ne marquer que les lignes
+                inchangées depuis l'extraction)
+        
         Returns:
             Nombre d'enregistrements mis à jour
         """
-        if not ids:
+        if df is None or df.empty:
             return 0
         
         try:
             cursor = self.db_connection.cursor()
-            
-            update_query = """
-                UPDATE raw_capteur_data
-                SET is_cleaned = TRUE
-                WHERE id = ANY(%s)
-            """
-            
-            cursor.execute(update_query, (ids,))
+            check_version = 'row_version' in df
+            keys = df[['capteur_id', 'timestamp'] + (['row_version'] if check_version else [])]
+            timestamps = self._copy_to_stage(cursor, keys.assign(**{column: None for column in MEASURE_COLUMNS}))
+            updated_count = self._mark_stage(cursor, timestamps, check_version)
             self.db_connection.commit()
             
-            updated_count = cursor.rowcount
             logger.info(f"{updated_count} enregistrements marqués comme nettoyés")
             cursor.close()
             
             return updated_count
-            
+        
         except Exception as e:
             logger.error(f"Erreur lors de la mise à jour du statut: {e}")
             self.db_connection.rollback()
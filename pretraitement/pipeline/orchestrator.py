@@ -4,15 +4,19 @@ Orchestrator - Planification et exécution du pipeline ETL
 
 import os
 import logging
+import time
+import pandas as pd
 import psycopg2
+from typing import Tuple
 from dotenv import load_dotenv
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from pipeline.bronze import BronzeExtractor
-from pipeline.silver import SilverTransformer
+from pipeline.silver import SensorRegistry, SilverStateStore, SilverTransformer
 from pipeline.gold import GoldLoader
+from agrotrace_common import metrics
 
 # Configuration du logging
 logging.basicConfig(
@@ -24,84 +28,233 @@ logger = logging.getLogger(__name__)
 # Chargement des variables d'environnement
 load_dotenv()
 
+# Shard traité par ce worker (partition Kafka d'origine des capteurs).
+# Non défini: un seul worker traite tous les capteurs.
+ETL_PARTITION = os.getenv("ETL_PARTITION")
+
+# Lignes par bloc lu par le curseur serveur; chaque cycle enchaîne les blocs
+# jusqu'à épuisement des données à nettoyer ou de son budget de temps
+# (inférieur à l'intervalle de 5 minutes, pour qu'un cycle se termine avant le
+# suivant). La mémoire utilisée dépend de la taille des blocs, pas du backlog.
+ETL_BATCH_SIZE = int(os.getenv("ETL_BATCH_SIZE", "10000"))
+# Blocs lus d'avance pendant le nettoyage et le chargement du bloc courant
+ETL_PREFETCH_CHUNKS = int(os.getenv("ETL_PREFETCH_CHUNKS", "1"))
+ETL_RUN_BUDGET_SECONDS = float(os.getenv("ETL_RUN_BUDGET_SECONDS", "240"))
+# Retard maximal rattrapé: en fin de parcours, un second passage relit les
+# lignes à nettoyer depuis la position moins ce délai (0: pas de second passage)
+ETL_LATENESS_SECONDS = float(os.getenv("ETL_LATENESS_SECONDS", "86400"))
+
+# Port du serveur de métriques Prometheus (0 pour le désactiver)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9102"))
+
+STAGE_SECONDS = metrics.Histogram(
+    "etl_stage_seconds",
+    "Durée de chaque étape du pipeline (bronze, silver, gold: chargement et marquage)",
+    ["stage"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+)
+RECORDS = metrics.Counter(
+    "etl_records_total",
+    "Enregistrements traités par étape (extracted, loaded, marked)",
+    ["step"]
+)
+RUNS = metrics.Counter(
+    "etl_runs_total",
+    "Cycles du pipeline par issue (success, empty, error)",
+    ["result"]
+)
+LAST_SUCCESS = metrics.Gauge(
+    "etl_last_success_timestamp_seconds",
+    "Horodatage Unix de la dernière exécution réussie du pipeline"
+)
+BATCHES = metrics.Histogram(
+    "etl_run_batches",
+    "Lots traités par cycle du pipeline",
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500)
+)
+WATERMARK = metrics.Gauge(
+    "etl_watermark_timestamp_seconds",
+    "Timestamp de la dernière mesure extraite (position d'extraction)"
+)
+
 
 class ETLOrchestrator:
     """Orchestrateur du pipeline ETL de nettoyage de données"""
     
     def __init__(self):
         self.db_connection = None
+        self.stream_connection = None
         self.bronze_extractor = None
         self.silver_transformer = None
+        self.silver_state = None
+        self.sensor_registry = None
         self.gold_loader = None
+        self.partition = int(ETL_PARTITION) if ETL_PARTITION else None
         self.scheduler = BlockingScheduler()
     
+    @staticmethod
+    def _connect() -> psycopg2.extensions.connection:
+        return psycopg2.connect(
+            host=os.getenv("DB_HOST", "localhost"),
+            port=os.getenv("DB_PORT", "5432"),
+            database=os.getenv("DB_NAME", "agrotrace_db"),
+            user=os.getenv("DB_USER", "admin"),
+            password=os.getenv("DB_PASSWORD", "password")
+        )
+    
     def connect_database(self):
-        """Établit la connexion à la base de données"""
+        """Établit les connexions à la base de données (chargement et lecture en continu)"""
         try:
-            self.db_connection = psycopg2.connect(
-                host=os.getenv("DB_HOST", "localhost"),
-                port=os.getenv("DB_PORT", "5432"),
-                database=os.getenv("DB_NAME", "agrotrace_db"),
-                user=os.getenv("DB_USER", "admin"),
-                password=os.getenv("DB_PASSWORD", "password")
-            )
+            self.db_connection = self._connect()
+            self.stream_connection = self._connect()
             logger.info("Connexion à la base de données établie")
             
             # Initialiser les composants du pipeline
-            self.bronze_extractor = BronzeExtractor(self.db_connection)
-            self.silver_transformer = SilverTransformer()
+            self.bronze_extractor = BronzeExtractor(self.db_connection, self.stream_connection)
+            self.silver_state = SilverStateStore(self.db_connection)
+            self.sensor_registry = SensorRegistry(self.db_connection)
             self.gold_loader = GoldLoader(self.db_connection)
             
             # Créer la table de données nettoyées
             self.gold_loader.create_clean_table()
+            self.bronze_extractor.create_watermark_table(self.partition)
+            self.silver_state.create_table()
+            self.sensor_registry.create_table()
+            self.sensor_registry.refresh()
             
+            # Reprendre le nettoyage incrémental là où l'exécution précédente l'a laissé
+            self.silver_transformer = SilverTransformer(
+                self.silver_state.load(self.partition), registry=self.sensor_registry
+            )
+        
         except Exception as e:
             logger.error(f"Erreur de connexion à la base de données: {e}")
             raise
     
     def run_etl_pipeline(self):
-        """Exécute le pipeline ETL complet"""
+        """
+        Exécute le pipeline ETL complet, bloc par bloc
+        
+        L'extraction reprend à la position enregistrée (etl_watermark) et lit
+        les données à nettoyer en continu (curseur serveur), bloc après bloc,
+        jusqu'à ce qu'il n'en reste plus ou que le budget de temps du cycle
+        soit épuisé (le cycle suivant reprend alors là où celui-ci s'est
+        arrêté). Arrivé au bout, un second passage repart de la position moins
+        ETL_LATENESS_SECONDS pour rattraper les mesures arrivées en retard
+        (timestamp antérieur à la position) ou remises à nettoyer par un
+        upsert: le parcours reste borné quelle que soit la profondeur de
+        l'historique. Une mesure plus ancienne que ce délai n'est pas
+        rattrapée.
+        """
         try:
             start_time = datetime.now()
+            deadline = time.monotonic() + ETL_RUN_BUDGET_SECONDS
             logger.info("=" * 60)
             logger.info(f"Démarrage du pipeline ETL - {start_time}")
             logger.info("=" * 60)
             
-            # BRONZE: Extraction des données brutes
-            raw_df = self.bronze_extractor.extract_raw_data(batch_size=1000)
+            watermark = self.bronze_extractor.load_watermark(self.partition)
+            high_water = watermark
+            # Parcours depuis la position enregistrée, puis depuis la position
+            # moins le retard toléré (tout l'historique au premier cycle)
+            starts = [watermark]
+            if watermark is not None and ETL_LATENESS_SECONDS > 0:
+                starts.append((watermark[0] - timedelta(seconds=ETL_LATENESS_SECONDS), ''))
+            batches = 0
+            loaded_count = 0
+            updated_count = 0
+            budget_exhausted = False
+            for start in starts:
+                chunks = self.bronze_extractor.iter_raw_data(
+                    itersize=ETL_BATCH_SIZE, partition=self.partition, after=start, prefetch=ETL_PREFETCH_CHUNKS
+                )
+                try:
+                    while not budget_exhausted:
+                        # BRONZE: Extraction des données brutes (attente du bloc suivant)
+                        stage_start = time.perf_counter()
+                        raw_df = next(chunks, None)
+                        STAGE_SECONDS.labels("bronze").observe(time.perf_counter() - stage_start)
+                        if raw_df is None:
+                            break
+                        
+                        loaded, updated = self._process_batch(raw_df)
+                        loaded_count += loaded
+                        updated_count += updated
+                        batches += 1
+                        
+                        last_row = raw_df.iloc[-1]
+                        watermark = (last_row['timestamp'], last_row['capteur_id'])
+                        # La position enregistrée ne recule pas pendant le rattrapage
+                        if high_water is None or watermark > high_water:
+                            high_water = watermark
+                            self.bronze_extractor.save_watermark(watermark, self.partition)
+                            WATERMARK.set(pd.Timestamp(watermark[0]).timestamp())
+                        budget_exhausted = time.monotonic() >= deadline
+                finally:
+                    chunks.close()
+                
+                if budget_exhausted:
+                    logger.warning(
+                        f"Budget de {ETL_RUN_BUDGET_SECONDS:.0f}s épuisé après {batches} lots, "
+                        "reprise au prochain cycle"
+                    )
+                    break
             
-            if raw_df is None or raw_df.empty:
+            BATCHES.observe(batches)
+            if batches == 0:
                 logger.info("Aucune donnée à traiter, fin du cycle")
+                RUNS.labels("empty").inc()
                 return
-            
-            # Sauvegarder les IDs pour la mise à jour ultérieure
-            processed_ids = raw_df['id'].tolist()
-            
-            # SILVER: Nettoyage et transformation
-            cleaned_df = self.silver_transformer.transform(raw_df)
-            
-            # GOLD: Chargement des données nettoyées
-            loaded_count = self.gold_loader.load_clean_data(cleaned_df)
-            
-            # Marquer les données comme nettoyées
-            updated_count = self.gold_loader.mark_as_cleaned(processed_ids)
+            RUNS.labels("success").inc()
+            LAST_SUCCESS.set(time.time())
             
             end_time = datetime.now()
             duration = (end_time - start_time).total_seconds()
             
             logger.info("=" * 60)
-            logger.info(f"Pipeline ETL terminé en {duration:.2f}s")
+            logger.info(f"Pipeline ETL terminé en {duration:.2f}s ({batches} lots)")
             logger.info(f"Enregistrements traités: {loaded_count}")
             logger.info(f"Enregistrements marqués: {updated_count}")
             logger.info("=" * 60)
-            
+        
         except Exception as e:
+            RUNS.labels("error").inc()
             logger.error(f"Erreur lors de l'exécution du pipeline: {e}", exc_info=True)
     
+    def _process_batch(self, raw_df: pd.DataFrame) -> Tuple[int, int]:
+        """
+        Nettoie un lot extrait, puis le charge et le marque en une transaction
+        
+        Returns:
+            Nombre d'enregistrements chargés et marqués
+        """
+        RECORDS.labels("extracted").inc(len(raw_df))
+        
+        # SILVER: Nettoyage et transformation, avec le registre des capteurs à jour
+        stage_start = time.perf_counter()
+        self.sensor_registry.refresh()
+        cleaned_df = self.silver_transformer.transform(raw_df)
+        STAGE_SECONDS.labels("silver").observe(time.perf_counter() - stage_start)
+        
+        # GOLD: Chargement des données nettoyées, marquage des lignes brutes et
+        # report Silver, dans la même transaction
+        stage_start = time.perf_counter()
+        loaded_count, updated_count = self.gold_loader.load_and_mark(
+            cleaned_df, self.silver_state.writer(self.silver_transformer, self.partition)
+        )
+        self.silver_transformer.commit()
+        STAGE_SECONDS.labels("gold").observe(time.perf_counter() - stage_start)
+        RECORDS.labels("loaded").inc(loaded_count)
+        RECORDS.labels("marked").inc(updated_count)
+        
+        return loaded_count, updated_count
+    
     def start_scheduler(self):
         """Démarre le planificateur pour exécuter le pipeline toutes les 5 minutes"""
         logger.info("Démarrage du planificateur ETL")
         logger.info("Fréquence: Toutes les 5 minutes")
+        if self.partition is not None:
+            logger.info(f"Shard traité: partition {self.partition}")
         
         # Ajouter le job au planificateur
         self.scheduler.add_job(
@@ -135,6 +288,9 @@ class ETLOrchestrator:
         if self.db_connection:
             self.db_connection.close()
             logger.info("Connexion à la base de données fermée")
+        
+        if self.stream_connection:
+            self.stream_connection.close()
 
 
 def main():
@@ -145,6 +301,8 @@ def main():
     orchestrator = ETLOrchestrator()
     
     try:
+        if METRICS_PORT:
+            metrics.start_http_server(METRICS_PORT)
         orchestrator.connect_database()
         orchestrator.start_scheduler()
     except KeyboardInterrupt:
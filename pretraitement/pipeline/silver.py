@@ -4,79 +4,719 @@ Silver Layer - Nettoyage et transformation des données
 
 import pandas as pd
 import numpy as np
+import psycopg2
+from numpy.lib.stride_tricks import sliding_window_view
+from psycopg2.extras import execute_values
+from typing import Callable, Optional, Tuple
 import logging
 
+from agrotrace_common import silver_rules
+from agrotrace_common.silver_rules import (
+    FLAG_INTERPOLATED, FLAG_OUT_OF_RANGE, FLAG_OUTLIER, FLAG_STUCK,
+    MEASURE_COLUMNS, REGISTRY_COLUMNS, quality_flag
+)
+
+from pipeline.bronze import ALL_PARTITIONS
+
 logger = logging.getLogger(__name__)
 
+CLEAN_COLUMNS = ['capteur_id', 'timestamp'] + MEASURE_COLUMNS
+CARRY_OVER_COLUMNS = CLEAN_COLUMNS + ['quality_flags']
+
+
+def interpolate_by_group(groups: np.ndarray, times: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    Interpolation linéaire en temps des NaN, sans franchir les limites de groupe
+    
+    Entièrement vectorisée (aucune boucle sur les groupes): pour chaque
+    valeur manquante, la dernière et la prochaine valeur connues sont
+    trouvées par recherche dichotomique parmi les positions valides, puis
+    retenues si elles appartiennent au même groupe.
+    
+    Args:
+        groups: Code entier du groupe de chaque ligne, lignes triées par groupe
+        times: Timestamps entiers (même unité), croissants dans chaque groupe
+        values: Valeurs à compléter (NaN pour les manquantes)
+    
+    Returns:
+        Valeurs complétées; restent NaN celles d'un groupe sans aucune valeur
+    """
+    missing = np.isnan(values)
+    if not missing.any():
+        return values
+    known = np.flatnonzero(~missing)
+    if len(known) == 0:
+        return values
+    
+    # Dernière et prochaine valeur connues de chaque position manquante
+    at = np.flatnonzero(missing)
+    after = np.searchsorted(known, at)
+    prev_at = known[np.maximum(after - 1, 0)]
+    next_at = known[np.minimum(after, len(known) - 1)]
+    group = groups[at]
+    has_prev = (after > 0) & (groups[prev_at] == group)
+    has_next = (after < len(known)) & (groups[next_at] == group)
+    
+    prev_values = values[prev_at]
+    next_values = values[next_at]
+    span = (times[next_at] - times[prev_at]).astype(float)
+    weight = np.divide(
+        (times[at] - times[prev_at]).astype(float), span,
+        out=np.zeros(len(at)), where=span > 0
+    )
+    interpolated = prev_values + (next_values - prev_values) * weight
+    
+    result = values.copy()
+    result[at] = np.where(
+        has_prev & has_next, interpolated,
+        np.where(has_prev, prev_values, np.where(has_next, next_values, np.nan))
+    )
+    return result
+
+
+def _sorted_median(rows: np.ndarray, count: np.ndarray) -> np.ndarray:
+    """Médiane de lignes triées dont les count premières valeurs sont valides (NaN ensuite)"""
+    window = rows.shape[1]
+    median = (rows[:, (window - 1) // 2] + rows[:, window // 2]) / 2
+    partial = np.flatnonzero(count < window)
+    if len(partial):
+        count = count[partial]
+        low = np.maximum((count - 1) // 2, 0)
+        median[partial] = (rows[partial, low] + rows[partial, count // 2]) / 2
+    return median
+
+
+def rolling_median_mad(
+    groups: np.ndarray,
+    values: np.ndarray,
+    window: int,
+    block_rows: int = 65536
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Médiane et écart absolu médian (MAD) glissants, sans franchir les limites de groupe
+    
+    Chaque fenêtre contient la ligne et les window - 1 précédentes du même
+    groupe; les NaN sont ignorés. Entièrement vectorisé: les fenêtres sont
+    des vues glissantes triées ligne à ligne par blocs de block_rows lignes
+    (mémoire bornée), en float32.
+    
+    Args:
+        groups: Code entier du groupe de chaque ligne, lignes triées par groupe
+        values: Valeurs (NaN pour les manquantes), dans l'ordre de chaque groupe
+        window: Taille de la fenêtre, en lignes
+        block_rows: Lignes traitées par bloc
+    
+    Returns:
+        Médiane, MAD, nombre de valeurs de la fenêtre, et fenêtre pleine
+        dont toutes les valeurs sont identiques
+    """
+    n = len(values)
+    positions = np.arange(n)
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    offset = positions - np.repeat(starts, np.diff(np.r_[starts, n]))
+    
+    # Nombre de valeurs par fenêtre, par sommes cumulées
+    valid_sum = np.r_[0, np.cumsum(~np.isnan(values))]
+    count = valid_sum[positions + 1] - valid_sum[positions - np.minimum(offset, window - 1)]
+    
+    padded = np.r_[np.full(window - 1, np.nan), values].astype(np.float32)
+    windows = sliding_window_view(padded, window)
+    columns = np.arange(window)
+    median = np.empty(n)
+    mad = np.empty(n)
+    flat = np.zeros(n, dtype=bool)
+    for begin in range(0, n, block_rows):
+        end = min(begin + block_rows, n)
+        block = windows[begin:end].copy()
+        # Fenêtres débutant avant le premier point du groupe
+        edge = np.flatnonzero(offset[begin:end] < window - 1)
+        if len(edge):
+            block[edge] = np.where(columns >= window - 1 - offset[begin + edge, None], block[edge], np.nan)
+        
+        block_count = count[begin:end]
+        block.sort(axis=1)
+        median[begin:end] = _sorted_median(block, block_count)
+        flat[begin:end] = (block_count == window) & (block[:, 0] == block[:, -1])
+        np.abs(block - median[begin:end, None].astype(np.float32), out=block)
+        block.sort(axis=1)
+        mad[begin:end] = _sorted_median(block, block_count)
+    return median, mad, count, flat
+
+
+def sensor_order(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Ordre (capteur, timestamp) des lignes: les mesures de chaque capteur deviennent contiguës
+    
+    Returns:
+        Codes des capteurs et timestamps (entiers) dans cet ordre, et la
+        permutation qui y mène
+    """
+    groups, uniques = pd.factorize(df['capteur_id'])
+    times = pd.to_datetime(df['timestamp'], utc=True, cache=False).to_numpy(dtype='int64')
+    if len(uniques) < np.iinfo(np.int16).max and (np.diff(times) >= 0).all():
+        # Lot déjà dans l'ordre des timestamps (extraction Bronze): un tri
+        # stable par capteur suffit, en temps linéaire (tri par base sur int16)
+        order = np.argsort(groups.astype(np.int16), kind='stable')
+    else:
+        order = np.lexsort((times, groups))
+    return groups[order], times[order], order
+
 
 class SilverTransformer:
     """Nettoyage et transformation des données de capteurs"""
     
-    # Plages valides pour chaque métrique
-    VALID_RANGES = {
-        'temperature': (-10, 50),      # °C
-        'humidite': (0, 100),          # %
-        'humidite_sol': (0, 100),      # %
-        'niveau_ph': (0, 14),          # pH
-        'luminosite': (0, 150000)      # lux
-    }
+    # Plages valides par défaut de chaque métrique (voir SensorRegistry)
+    VALID_RANGES = silver_rules.VALID_RANGES
+    
+    # Détection des valeurs aberrantes (filtre de Hampel glissant, par capteur)
+    OUTLIER_WINDOW = 15            # lignes: la mesure et les 14 précédentes du capteur
+    OUTLIER_MIN_PERIODS = 8        # mesures minimales dans la fenêtre
+    OUTLIER_THRESHOLD = 3.0        # écarts à la médiane, en MAD normalisés (x 1.4826)
+    OUTLIER_MIN_SCALE = 0.01       # écart minimal significatif: 1 % de la plage valide
+    OUTLIER_MIN_WINDOW_SECONDS = 30  # durée minimale couverte par la fenêtre (rafales, doublons)
+    
+    def __init__(
+        self,
+        carry_over: Optional[pd.DataFrame] = None,
+        registry: Optional['SensorRegistry'] = None
+    ):
+        """
+        Args:
+            carry_over: Report des lots précédents (voir SilverStateStore.load)
+            registry: Plages et étalonnage par capteur (VALID_RANGES pour tous si absent)
+        """
+        self.registry = registry if registry is not None else SensorRegistry()
+        # Lignes reportées au lot suivant, par capteur (colonnes CARRY_OVER_COLUMNS)
+        self.carry_over = carry_over if carry_over is not None else pd.DataFrame(columns=CARRY_OVER_COLUMNS)
+        self._pending: Optional[Tuple[np.ndarray, pd.DataFrame]] = None
     
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
         """
         Nettoie et transforme les données
         
+        Les mesures sont étalonnées et les valeurs hors de la plage valide
+        de leur capteur (voir SensorRegistry) sont écartées, puis les valeurs
+        manquantes ou écartées sont interpolées. Les valeurs aberrantes
+        (écart à la médiane glissante du capteur) et figées sont conservées
+        mais signalées: chaque ligne reçoit une colonne quality_flags (bits
+        FLAG_* par métrique, voir quality_flag).
+        
+        Le lot est complété par le report des lots précédents: pour chaque
+        capteur, la dernière mesure connue de chaque métrique et la fenêtre
+        glissante (voir _next_carry_over). Une valeur manquante en bordure
+        de lot est ainsi interpolée avec ses vraies voisines, et la
+        détection des valeurs aberrantes dispose de l'historique du capteur.
+        Les lignes reportées dont une valeur manquante est complétée par ce
+        lot sont renvoyées avec lui; l'upsert du chargement les corrige. Une
+        ligne reportée extraite de nouveau est remplacée par celle du lot.
+        
+        Le report n'est pas modifié: il ne doit l'être qu'une fois le lot
+        chargé (voir commit).
+        
         Args:
             df: DataFrame brut
-            
+        
         Returns:
-            DataFrame nettoyé
+            DataFrame nettoyé (colonnes CLEAN_COLUMNS et quality_flags, plus
+            row_version si df l'a, vide pour les lignes reportées; lignes du
+            lot, puis lignes reportées corrigées)
         """
         if df is None or df.empty:
             return df
         
         logger.info(f"Début du nettoyage de {len(df)} enregistrements")
         
+        sensors = df['capteur_id'].unique()
+        # Reportées en tête, dans l'ordre des timestamps: le lot reste ordonné
+        carry_over = self.carry_over[self.carry_over['capteur_id'].isin(sensors)].sort_values('timestamp')
+        if len(carry_over):
+            carry_over = carry_over[~self._reextracted(carry_over, df)]
+        carried = len(carry_over)
+        
         # Copie pour éviter les modifications directes
-        cleaned_df = df.copy()
+        batch_df = df[CLEAN_COLUMNS]
+        cleaned_df = pd.concat([carry_over[CLEAN_COLUMNS], batch_df], ignore_index=True) if carried else batch_df.copy()
+        ordering = sensor_order(cleaned_df)
+        codes = self.registry.codes(cleaned_df['capteur_id'])
+        flags = np.zeros(len(cleaned_df), dtype=np.int64)
+        flags[:carried] = carry_over['quality_flags'].to_numpy(dtype=np.int64)
         
-        # 1. Remplir les valeurs manquantes par interpolation
-        cleaned_df = self._fill_missing_values(cleaned_df)
+        # 1. Étalonner et écarter les valeurs hors plage (les lignes reportées le sont déjà)
+        self._calibrate(cleaned_df, codes, carried)
+        flags |= self._reject_out_of_range(cleaned_df, codes, carried)
         
-        # 2. Corriger les anomalies avec clipping
-        cleaned_df = self._fix_anomalies(cleaned_df)
+        # 2. Signaler les valeurs aberrantes et figées des lignes du lot
+        flags[carried:] |= self._detect_outliers(cleaned_df, flags, ordering, codes)[carried:]
         
-        logger.info(f"Nettoyage terminé: {len(cleaned_df)} enregistrements")
+        # 3. Remplir les valeurs manquantes par interpolation (par capteur)
+        values = cleaned_df[MEASURE_COLUMNS].to_numpy(dtype=float)
+        cleaned_df = self._fill_missing_values(cleaned_df, ordering)
+        filled = np.isnan(values) & cleaned_df[MEASURE_COLUMNS].notna().to_numpy()
+        for index, col in enumerate(MEASURE_COLUMNS):
+            flags[filled[:, index]] |= quality_flag(col, FLAG_INTERPOLATED)
+        cleaned_df['quality_flags'] = flags
+        
+        self._pending = (sensors, self._next_carry_over(cleaned_df, values, ordering))
+        
+        # Ne renvoyer, parmi les lignes reportées, que celles complétées par ce lot
+        reemitted = filled[:carried].any(axis=1)
+        if carried:
+            cleaned_df = pd.concat([cleaned_df[carried:], cleaned_df[:carried][reemitted]])
+        if 'row_version' in df:
+            # Version des lignes brutes extraites (voir GoldLoader._mark_stage):
+            # les lignes reportées, déjà marquées, n'en ont pas
+            versions = np.zeros(len(cleaned_df), dtype=np.int64)
+            versions[:len(df)] = df['row_version'].to_numpy(dtype=np.int64)
+            cleaned_df['row_version'] = pd.arrays.IntegerArray(versions, np.arange(len(cleaned_df)) >= len(df))
+        
+        logger.info(
+            f"Nettoyage terminé: {len(cleaned_df)} enregistrements"
+            + (f" (dont {reemitted.sum()} reportés, corrigés)" if reemitted.any() else "")
+            + f", {np.count_nonzero(flags[carried:])} signalés"
+        )
         
         return cleaned_df
     
-    def _fill_missing_values(self, df: pd.DataFrame) -> pd.DataFrame:
+    @staticmethod
+    def _reextracted(carry_over: pd.DataFrame, df: pd.DataFrame) -> np.ndarray:
+        """
+        Lignes reportées dont la clé (capteur_id, timestamp) revient dans le lot
+        
+        Une mesure renvoyée (upsert qui remet is_cleaned à FALSE) ou relue par
+        la passe des données tardives est à la fois reportée et extraite: la
+        ligne du lot l'emporte, sans quoi la clé serait chargée deux fois.
+        """
+        candidates = df[df['timestamp'] <= carry_over['timestamp'].max()]
+        if candidates.empty:
+            return np.zeros(len(carry_over), dtype=bool)
+        keys = pd.MultiIndex.from_frame(candidates[['capteur_id', 'timestamp']])
+        return pd.MultiIndex.from_frame(carry_over[['capteur_id', 'timestamp']]).isin(keys)
+    
+    @property
+    def pending_carry_over(self) -> pd.DataFrame:
+        """Report des capteurs du dernier lot nettoyé, à enregistrer avec ce lot"""
+        return self._pending[1] if self._pending else pd.DataFrame(columns=CARRY_OVER_COLUMNS)
+    
+    @property
+    def sensors_pending(self) -> np.ndarray:
+        """Capteurs du dernier lot nettoyé, dont le report est remplacé"""
+        return self._pending[0] if self._pending else np.array([], dtype=object)
+    
+    def commit(self) -> None:
+        """Retient le report du dernier lot nettoyé, une fois ce lot chargé"""
+        if self._pending is None:
+            return
+        sensors, carry_over = self._pending
+        others = self.carry_over[~self.carry_over['capteur_id'].isin(sensors)]
+        self.carry_over = pd.concat([others, carry_over], ignore_index=True) if len(others) else carry_over
+        self._pending = None
+    
+    def _next_carry_over(self, df: pd.DataFrame, values: np.ndarray, ordering: Tuple) -> pd.DataFrame:
+        """
+        Lignes à reporter au lot suivant, pour chaque capteur du lot
+        
+        La ligne de la dernière mesure connue de chaque métrique et les
+        OUTLIER_WINDOW - 1 dernières lignes, soit au plus OUTLIER_WINDOW - 1
+        + len(MEASURE_COLUMNS) lignes par capteur: le lot suivant y trouve la
+        voisine précédente de toute valeur manquante et la fenêtre glissante
+        de chaque capteur. Les valeurs déjà interpolées entre deux mesures
+        sont définitives et reportées comme telles (signalées
+        FLAG_INTERPOLATED); seules restent manquantes, pour être corrigées
+        par le lot suivant, celles de la fenêtre qui suivent la dernière
+        mesure de leur métrique (ou qui précèdent sa première mesure).
+        
+        Le résultat est donc celui d'un retraitement complet de l'historique,
+        sauf pour les lacunes en fin de lot plus longues que la fenêtre: leurs
+        lignes antérieures à la fenêtre gardent la dernière mesure connue
+        (ou restent manquantes si la métrique n'a encore jamais été mesurée),
+        là où un retraitement complet les interpolerait avec la mesure
+        suivante. Avec des lots courts (quelques lignes par capteur), c'est
+        le cas des premières lignes d'un capteur dont une métrique manque au
+        départ.
+        
+        Args:
+            df: Lignes nettoyées du lot (reportées comprises), avec quality_flags
+            values: Valeurs des métriques avant interpolation
+            ordering: Ordre des lignes par capteur (voir sensor_order)
+        """
+        groups, _, order = ordering
+        n = len(order)
+        positions = np.arange(n)
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        ends = np.r_[starts[1:], n]
+        
+        values = values[order]
+        last_known = np.maximum.reduceat(np.where(np.isnan(values), -1, positions[:, None]), starts, axis=0)
+        
+        sizes = ends - starts
+        kept = positions >= np.repeat(ends - (self.OUTLIER_WINDOW - 1), sizes)
+        known = last_known[last_known >= 0]
+        kept[known] = True
+        final = positions[:, None] <= np.repeat(last_known, sizes, axis=0)
+        filled = df[MEASURE_COLUMNS].to_numpy(dtype=float)[order]
+        
+        carry_over = df[['capteur_id', 'timestamp']].iloc[order[kept]].reset_index(drop=True)
+        carry_over[MEASURE_COLUMNS] = np.where(final, filled, values)[kept]
+        carry_over['quality_flags'] = df['quality_flags'].to_numpy()[order[kept]]
+        return carry_over
+    
+    def _fill_missing_values(self, df: pd.DataFrame, ordering: Optional[Tuple] = None) -> pd.DataFrame:
         """
-        Remplit les valeurs manquantes par interpolation linéaire
+        Remplit les valeurs manquantes par interpolation linéaire, capteur par
+        capteur et pondérée par le temps
+        
+        Une valeur manquante est interpolée entre les mesures voisines du
+        même capteur, au prorata de leur écart de timestamp; aux extrémités,
+        la mesure la plus proche du capteur est reprise. Une métrique sans
+        aucune mesure pour un capteur dans le lot reste manquante.
+        
+        Args:
+            df: DataFrame à compléter (modifié)
+            ordering: Ordre des lignes par capteur, s'il est déjà calculé (voir sensor_order)
         """
-        numeric_cols = ['temperature', 'humidite', 'humidite_sol', 'niveau_ph', 'luminosite']
+        numeric_cols = [col for col in MEASURE_COLUMNS if col in df.columns]
+        missing = df[numeric_cols].isna().sum()
+        numeric_cols = [col for col in numeric_cols if missing[col] > 0]
+        if not numeric_cols:
+            return df
+        
+        groups, times, order = ordering or sensor_order(df)
         
         for col in numeric_cols:
-            if col in df.columns:
-                missing_count = df[col].isna().sum()
-                if missing_count > 0:
-                    # Interpolation linéaire, remplissage des bords avec forward/backward fill
-                    df[col] = df[col].interpolate(method='linear', limit_direction='both')
-                    logger.debug(f"{col}: {missing_count} valeurs manquantes interpolées")
+            values = df[col].to_numpy(dtype=float)
+            filled = np.empty_like(values)
+            filled[order] = interpolate_by_group(groups, times, values[order])
+            df[col] = filled
+            logger.debug(f"{col}: {missing[col] - np.isnan(filled).sum()} valeurs manquantes interpolées")
         
         return df
     
-    def _fix_anomalies(self, df: pd.DataFrame) -> pd.DataFrame:
+    def _calibrate(self, df: pd.DataFrame, codes: np.ndarray, start: int = 0) -> None:
+        """
+        Étalonne les mesures brutes: valeur * scale + calibration_offset du capteur
+        
+        Args:
+            df: DataFrame à corriger (modifié)
+            codes: Code de chaque ligne dans le registre (voir SensorRegistry.codes)
+            start: Première ligne à étalonner
+        """
+        for col in MEASURE_COLUMNS:
+            if col not in self.registry.calibrated:
+                continue
+            values = df[col].to_numpy(dtype=float, copy=True)
+            batch_codes = codes[start:]
+            values[start:] = values[start:] * self.registry.scale[col][batch_codes] + self.registry.offset[col][batch_codes]
+            df[col] = values
+    
+    def _reject_out_of_range(self, df: pd.DataFrame, codes: np.ndarray, start: int = 0) -> np.ndarray:
+        """
+        Écarte les valeurs hors de la plage valide de leur capteur (remplacées par NaN, puis interpolées)
+        
+        Un écrêtage transformerait une valeur sentinelle (-999.9) en mesure
+        plausible (-10 °C): la valeur est écartée et signalée.
+        
+        Args:
+            df: DataFrame à corriger (modifié)
+            codes: Code de chaque ligne dans le registre (voir SensorRegistry.codes)
+            start: Première ligne à examiner
+        
+        Returns:
+            quality_flags des lignes (FLAG_OUT_OF_RANGE)
+        """
+        flags = np.zeros(len(df), dtype=np.int64)
+        for col in MEASURE_COLUMNS:
+            values = df[col].to_numpy(dtype=float)
+            rejected = (values < self.registry.lower[col][codes]) | (values > self.registry.upper[col][codes])
+            rejected[:start] = False
+            if rejected.any():
+                values = values.copy()
+                values[rejected] = np.nan
+                df[col] = values
+                flags[rejected] |= quality_flag(col, FLAG_OUT_OF_RANGE)
+                logger.debug(f"{col}: {rejected.sum()} valeurs hors plage écartées")
+        
+        return flags
+    
+    def _detect_outliers(self, df: pd.DataFrame, flags: np.ndarray, ordering: Tuple, codes: np.ndarray) -> np.ndarray:
         """
-        Corrige les anomalies en utilisant le clipping (écrêtage)
+        Signale les valeurs aberrantes et figées, capteur par capteur (filtre de Hampel)
+        
+        Une mesure est aberrante si elle s'écarte de la médiane de la fenêtre
+        glissante du capteur (elle-même et les OUTLIER_WINDOW - 1 lignes
+        précédentes) de plus de OUTLIER_THRESHOLD MAD normalisés; figée si
+        toute la fenêtre porte la même valeur, strictement comprise dans la
+        plage valide du capteur: une valeur à une borne (luminosité nulle la
+        nuit, humidité saturée à 100 %) est un état physique normal, pas une
+        panne. Une fenêtre qui couvre moins de OUTLIER_MIN_WINDOW_SECONDS
+        (rafale de mesures, réémission) ne signale rien. Seules les mesures
+        comptent: les valeurs interpolées sont ignorées.
+        
+        Args:
+            df: DataFrame (valeurs hors plage déjà écartées)
+            flags: quality_flags courants (valeurs interpolées des lignes reportées)
+            ordering: Ordre des lignes par capteur (voir sensor_order)
+            codes: Code de chaque ligne dans le registre (voir SensorRegistry.codes)
+        
+        Returns:
+            quality_flags des lignes (FLAG_OUTLIER, FLAG_STUCK)
         """
-        for col, (min_val, max_val) in self.VALID_RANGES.items():
-            if col in df.columns:
-                # Compter les anomalies avant correction
-                anomalies = ((df[col] < min_val) | (df[col] > max_val)).sum()
-                
-                if anomalies > 0:
-                    # Appliquer le clipping
-                    df[col] = df[col].clip(lower=min_val, upper=max_val)
-                    logger.debug(f"{col}: {anomalies} anomalies corrigées par clipping")
+        groups, times, order = ordering
+        codes = codes[order]
+        result = np.zeros(len(df), dtype=np.int64)
+        
+        # Durée couverte par la fenêtre de chaque ligne (première ligne du capteur au plus)
+        n = len(order)
+        positions = np.arange(n)
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        offset = positions - np.repeat(starts, np.diff(np.r_[starts, n]))
+        first = positions - np.minimum(offset, self.OUTLIER_WINDOW - 1)
+        long_enough = times - times[first] >= self.OUTLIER_MIN_WINDOW_SECONDS * 1_000_000_000
+        
+        for col in MEASURE_COLUMNS:
+            values = df[col].to_numpy(dtype=float)[order]
+            values[(flags[order] & quality_flag(col, FLAG_INTERPOLATED)) != 0] = np.nan
+            
+            median, mad, count, flat = rolling_median_mad(groups, values, self.OUTLIER_WINDOW)
+            lower, upper = self.registry.lower[col][codes], self.registry.upper[col][codes]
+            scale = np.maximum(1.4826 * mad, self.OUTLIER_MIN_SCALE * (upper - lower))
+            with np.errstate(invalid='ignore'):
+                outlier = (count >= self.OUTLIER_MIN_PERIODS) & (np.abs(values - median) > self.OUTLIER_THRESHOLD * scale)
+                stuck = flat & (values > lower) & (values < upper)
+            outlier &= long_enough
+            stuck &= long_enough
+            
+            result[order[outlier]] |= quality_flag(col, FLAG_OUTLIER)
+            result[order[stuck]] |= quality_flag(col, FLAG_STUCK)
+            if outlier.any() or stuck.any():
+                logger.debug(f"{col}: {outlier.sum()} valeurs aberrantes, {stuck.sum()} figées")
         
+        return result
+
+
+class SilverStateStore:
+    """Enregistrement du report Silver entre deux exécutions du worker"""
+    
+    def __init__(self, db_connection: psycopg2.extensions.connection):
+        self.db_connection = db_connection
+    
+    def create_table(self):
+        """Crée la table etl_silver_carry_over si elle n'existe pas"""
+        try:
+            cursor = self.db_connection.cursor()
+            
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS etl_silver_carry_over (
+                    shard INTEGER NOT NULL,
+                    capteur_id VARCHAR(50) NOT NULL,
+                    timestamp TIMESTAMPTZ NOT NULL,
+                    temperature DOUBLE PRECISION,
+                    humidite DOUBLE PRECISION,
+                    humidite_sol DOUBLE PRECISION,
+                    niveau_ph DOUBLE PRECISION,
+                    luminosite DOUBLE PRECISION,
+                    quality_flags INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (shard, capteur_id, timestamp)
+                );
+            """)
+            # Tables créées avant l'ajout de quality_flags
+            cursor.execute("""
+                ALTER TABLE etl_silver_carry_over
+                ADD COLUMN IF NOT EXISTS quality_flags INTEGER NOT NULL DEFAULT 0;
+            """)
+            
+            self.db_connection.commit()
+            logger.info("Table etl_silver_carry_over créée/vérifiée")
+            cursor.close()
+        
+        except Exception as e:
+            logger.error(f"Erreur lors de la création de la table etl_silver_carry_over: {e}")
+            self.db_connection.rollback()
+            raise
+    
+    def load(self, partition: Optional[int] = None) -> pd.DataFrame:
+        """
+        Lit le report enregistré
+        
+        Args:
+            partition: Shard traité, None pour tous
+        
+        Returns:
+            Lignes reportées (colonnes CARRY_OVER_COLUMNS)
+        """
+        shard = ALL_PARTITIONS if partition is None else partition
+        df = pd.read_sql_query(
+            f"SELECT {', '.join(CARRY_OVER_COLUMNS)} FROM etl_silver_carry_over WHERE shard = %s",
+            self.db_connection, params=(shard,)
+        )
+        self.db_connection.commit()
+        df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+        df[MEASURE_COLUMNS] = df[MEASURE_COLUMNS].astype(float)
+        df['quality_flags'] = df['quality_flags'].astype('int64')
+        logger.info(f"Report Silver: {len(df)} lignes pour {df['capteur_id'].nunique()} capteurs")
         return df
+    
+    def writer(self, transformer: SilverTransformer, partition: Optional[int] = None) -> Callable:
+        """
+        Écriture du report du dernier lot nettoyé, à exécuter dans la
+        transaction de son chargement (GoldLoader.load_and_mark)
+        
+        Seules les différences avec le report précédent des capteurs du lot
+        sont écrites: lignes sorties du report supprimées, lignes nouvelles
+        ou modifiées insérées (upsert); les lignes inchangées de la fenêtre
+        ne sont pas réécrites.
+        
+        Args:
+            transformer: Transformateur dont le dernier lot est chargé
+            partition: Shard traité, None pour tous
+        
+        Returns:
+            Fonction recevant le curseur de la transaction
+        """
+        shard = ALL_PARTITIONS if partition is None else partition
+        previous = transformer.carry_over[transformer.carry_over['capteur_id'].isin(transformer.sensors_pending)]
+        removed, changed = self._diff(previous, transformer.pending_carry_over)
+        
+        def write(cursor: psycopg2.extensions.cursor) -> None:
+            if len(removed):
+                cursor.execute("""
+                    DELETE FROM etl_silver_carry_over
+                    WHERE shard = %s
+                        AND (capteur_id, timestamp) IN (SELECT * FROM unnest(%s::varchar[], %s::timestamptz[]))
+                """, (shard, list(removed['capteur_id']), [ts.to_pydatetime() for ts in removed['timestamp']]))
+            if changed.empty:
+                return
+            # NaN -> NULL
+            rows = changed.astype(object).where(changed.notna(), None)
+            execute_values(cursor, f"""
+                INSERT INTO etl_silver_carry_over (shard, {', '.join(CARRY_OVER_COLUMNS)}) VALUES %s
+                ON CONFLICT (shard, capteur_id, timestamp) DO UPDATE SET
+                    {', '.join(f'{col} = EXCLUDED.{col}' for col in MEASURE_COLUMNS + ['quality_flags'])}
+            """, [(shard, *row) for row in rows.itertuples(index=False)])
+        
+        return write
+    
+    @staticmethod
+    def _diff(previous: pd.DataFrame, carry_over: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Différences entre deux reports
+        
+        Returns:
+            Clés (capteur_id, timestamp) sorties du report, et lignes
+            nouvelles ou modifiées (colonnes CARRY_OVER_COLUMNS)
+        """
+        keys = ['capteur_id', 'timestamp']
+        if previous.empty:
+            return previous[keys], carry_over[CARRY_OVER_COLUMNS]
+        merged = carry_over[CARRY_OVER_COLUMNS].merge(
+            previous[CARRY_OVER_COLUMNS], on=keys, how='outer', suffixes=('', '_previous'), indicator=True
+        )
+        removed = merged.loc[merged['_merge'] == 'right_only', keys]
+        
+        current = merged['_merge'] != 'right_only'
+        changed = merged['_merge'] == 'left_only'
+        for col in MEASURE_COLUMNS + ['quality_flags']:
+            new, old = merged[col], merged[f'{col}_previous']
+            changed |= ~((new == old) | (new.isna() & old.isna()))
+        return removed, merged.loc[current & changed, CARRY_OVER_COLUMNS]
+
+
+class SensorRegistry:
+    """
+    Registre des capteurs (table sensor_registry): plages valides et étalonnage par capteur
+    
+    Une ligne (capteur_id, metric) remplace, pour ce capteur, la plage par
+    défaut de la métrique (SilverTransformer.VALID_RANGES; borne NULL: borne
+    par défaut) et corrige ses mesures brutes: valeur * scale +
+    calibration_offset, unit étant l'unité des mesures brutes. Le registre
+    est tenu en mémoire sous forme de tableaux indexés par un code de
+    capteur (dernière ligne: valeurs par défaut, pour les capteurs absents
+    du registre), appliqués à tout un lot sans boucle Python par ligne.
+    """
+    
+    def __init__(self, db_connection: Optional[psycopg2.extensions.connection] = None):
+        self.db_connection = db_connection
+        # Plus grande version chargée (voir refresh)
+        self.version = 0
+        self._entries: silver_rules.RegistryEntries = {}
+        self._build()
+    
+    def __len__(self) -> int:
+        return len(self._sensors)
+    
+    def create_table(self):
+        """
+        Crée la table sensor_registry si elle n'existe pas
+        
+        Un trigger attribue à chaque ligne insérée ou modifiée la version
+        suivante (voir silver_rules.REGISTRY_TABLE_DDL): refresh ne relit que
+        les lignes de version supérieure à la dernière chargée.
+        """
+        try:
+            cursor = self.db_connection.cursor()
+            cursor.execute(silver_rules.REGISTRY_TABLE_DDL)
+            self.db_connection.commit()
+            logger.info("Table sensor_registry créée/vérifiée")
+            cursor.close()
+        
+        except Exception as e:
+            logger.error(f"Erreur lors de la création de la table sensor_registry: {e}")
+            self.db_connection.rollback()
+            raise
+    
+    def refresh(self) -> bool:
+        """
+        Met à jour le registre en mémoire (lignes modifiées seulement, voir
+        silver_rules.read_registry)
+        
+        Returns:
+            True si le registre a changé
+        """
+        cursor = self.db_connection.cursor()
+        entries = silver_rules.read_registry(cursor, self._entries, self.version)
+        cursor.close()
+        self.db_connection.commit()
+        if entries is None:
+            return False
+        
+        self._entries = entries
+        self.version = silver_rules.registry_version(entries)
+        self._build()
+        logger.info(f"Registre des capteurs: {len(self._sensors)} capteurs (version {self.version})")
+        return True
+    
+    def _build(self):
+        """Construit les tableaux de correspondance (une ligne par capteur, puis les valeurs par défaut)"""
+        entries = pd.DataFrame(list(self._entries.values()), columns=REGISTRY_COLUMNS)
+        self._sensors = pd.Index(entries['capteur_id'].unique())
+        rows = self._sensors.get_indexer(entries['capteur_id'])
+        metrics = entries['metric'].to_numpy()
+        
+        self.lower, self.upper, self.scale, self.offset = {}, {}, {}, {}
+        # Métriques dont au moins un capteur est étalonné (les autres ne sont pas recalculées)
+        self.calibrated = set()
+        for col, (min_val, max_val) in SilverTransformer.VALID_RANGES.items():
+            selected = metrics == col
+            for target, source, default in (
+                (self.lower, 'min_value', min_val),
+                (self.upper, 'max_value', max_val),
+                (self.scale, 'scale', 1.0),
+                (self.offset, 'calibration_offset', 0.0)
+            ):
+                values = np.full(len(self._sensors) + 1, float(default))
+                values[rows[selected]] = entries[source].to_numpy(dtype=float)[selected]
+                target[col] = np.where(np.isnan(values), default, values)
+            if (self.scale[col] != 1).any() or (self.offset[col] != 0).any():
+                self.calibrated.add(col)
+    
+    def codes(self, capteur_ids: pd.Series) -> np.ndarray:
+        """
+        Code de chaque ligne dans les tableaux lower, upper, scale et offset
+        
+        Args:
+            capteur_ids: Capteur de chaque ligne
+        
+        Returns:
+            Codes (-1, dernière ligne des tableaux: capteur absent du registre)
+        """
+        groups, uniques = pd.factorize(capteur_ids)
+        return self._sensors.get_indexer(uniques)[groups]
@@ -0,0 +1,357 @@
+"""
+Tests du nettoyage Silver (pipeline/silver.py), sans base de données
+
+    cd pretraitement && python -m pytest
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from agrotrace_common.silver_rules import read_registry
+from benchmarks.bench_silver import generate_raw_data
+from pipeline.silver import (
+    FLAG_INTERPOLATED, FLAG_OUT_OF_RANGE, FLAG_OUTLIER, FLAG_STUCK, MEASURE_COLUMNS,
+    SensorRegistry, SilverStateStore, SilverTransformer, quality_flag
+)
+
+T0 = pd.Timestamp('2025-01-01', tz='UTC')
+
+
+def reference_fill(df: pd.DataFrame) -> pd.DataFrame:
+    """Référence: interpolation pandas en temps, capteur par capteur (boucle sur les groupes)"""
+    result = df.copy()
+    for _, group in df.groupby('capteur_id'):
+        series = group.set_index('timestamp')[MEASURE_COLUMNS].sort_index()
+        filled = series.interpolate(method='time', limit_direction='both')
+        # Une colonne entièrement vide reste vide
+        filled[series.isna().all()[lambda empty: empty].index] = np.nan
+        result.loc[group.sort_values('timestamp').index, MEASURE_COLUMNS] = filled.to_numpy()
+    return result
+
+
+def sensor_data(rows: int, seed: int = 1) -> pd.DataFrame:
+    """Lot de mesures plausibles: valeurs manquantes, pics, sentinelles et valeurs hors plage"""
+    df = generate_raw_data(rows, sensors=20, seed=seed)
+    rng = np.random.default_rng(seed)
+    df['temperature'] = 20 + rng.normal(0, 1, rows)
+    df.loc[rng.random(rows) < 0.05, 'temperature'] = np.nan
+    df.loc[rng.random(rows) < 0.01, 'temperature'] = 45.0
+    df.loc[rng.random(rows) < 0.005, 'temperature'] = -999.9
+    df.loc[rng.random(rows) < 0.005, 'humidite'] = 150
+    df['niveau_ph'] = df['niveau_ph'] / 10
+    df.loc[df['capteur_id'] == 'CAPT003', 'temperature'] = 25.0
+    return df
+
+
+def series(values, seconds: float = 60.0, capteur_id: str = 'A', **columns) -> pd.DataFrame:
+    """Lot d'un capteur: une mesure toutes les `seconds` secondes, 1.0 pour les autres métriques"""
+    df = pd.DataFrame({
+        'capteur_id': capteur_id,
+        'timestamp': T0 + pd.to_timedelta(np.arange(len(values)) * seconds, unit='s'),
+    })
+    for col in MEASURE_COLUMNS:
+        df[col] = 1.0
+    df['temperature'] = np.asarray(values, dtype=float)
+    for col, col_values in columns.items():
+        df[col] = np.asarray(col_values, dtype=float)
+    return df
+
+
+def run_incremental(df: pd.DataFrame, batch_size: int) -> pd.DataFrame:
+    """Nettoie df par lots successifs; dernière version de chaque ligne, indexée par clé"""
+    transformer = SilverTransformer()
+    results = []
+    for start in range(0, len(df), batch_size):
+        results.append(transformer.transform(df.iloc[start:start + batch_size].reset_index(drop=True)))
+        transformer.commit()
+    result = pd.concat(results).drop_duplicates(['capteur_id', 'timestamp'], keep='last')
+    return result.set_index(['capteur_id', 'timestamp']).sort_index()
+
+
+def flagged(df: pd.DataFrame, col: str, flag: int) -> np.ndarray:
+    return (df['quality_flags'].to_numpy() & quality_flag(col, flag)) != 0
+
+
+# Interpolation
+
+def test_fill_missing_values_by_sensor_and_time():
+    df = pd.DataFrame({
+        'capteur_id': ['A', 'B', 'A', 'B', 'A', 'C', 'A'],
+        'timestamp': [T0 + pd.Timedelta(seconds=s) for s in (0, 0, 1, 2, 4, 5, 6)],
+    })
+    for col in MEASURE_COLUMNS:
+        df[col] = 0.0
+    df['temperature'] = [0.0, 100.0, np.nan, np.nan, 4.0, np.nan, np.nan]
+    
+    result = SilverTransformer()._fill_missing_values(df.copy())
+    
+    # A: pondéré par le temps (1 s sur 4 s), puis dernière valeur à l'extrémité;
+    # B: pas de mesure de A utilisée; C: aucune mesure, reste manquante
+    expected = [0.0, 100.0, 1.0, 100.0, 4.0, np.nan, 4.0]
+    assert np.allclose(result['temperature'], expected, equal_nan=True)
+    # Ordre des lignes et valeurs présentes inchangés
+    assert result['capteur_id'].tolist() == df['capteur_id'].tolist()
+    assert result['humidite'].tolist() == df['humidite'].tolist()
+    
+    # Lot non ordonné par timestamp: même résultat ligne à ligne
+    shuffled = SilverTransformer()._fill_missing_values(df.sample(frac=1, random_state=0))
+    assert np.allclose(shuffled['temperature'].sort_index(), expected, equal_nan=True)
+
+
+def test_fill_missing_values_matches_pandas_reference():
+    df = generate_raw_data(5000)
+    
+    result = SilverTransformer()._fill_missing_values(df.copy())
+    expected = reference_fill(df)
+    
+    for col in MEASURE_COLUMNS:
+        assert np.allclose(result[col], expected[col], equal_nan=True), col
+
+
+# Nettoyage incrémental (report d'un lot au suivant)
+
+@pytest.mark.parametrize('batch_size', [7, 50, 333, 1000])
+def test_incremental_matches_full_recompute(batch_size):
+    df = sensor_data(10000)
+    full = SilverTransformer().transform(df.copy()).set_index(['capteur_id', 'timestamp']).sort_index()
+    
+    incremental = run_incremental(df, batch_size)
+    
+    assert len(incremental) == len(full)
+    for col in MEASURE_COLUMNS:
+        assert np.allclose(incremental[col], full[col], equal_nan=True), col
+    assert (incremental['quality_flags'] == full['quality_flags']).all()
+
+
+def test_gap_at_batch_edge_is_corrected_by_next_measurement():
+    values = [10.0, 10.0, 10.0, np.nan, np.nan, 16.0]
+    
+    incremental = run_incremental(series(values), batch_size=4)
+    
+    # Reprise de la dernière mesure, puis interpolation à l'arrivée de la suivante
+    assert np.allclose(incremental['temperature'], [10.0, 10.0, 10.0, 12.0, 14.0, 16.0])
+    assert flagged(incremental, 'temperature', FLAG_INTERPOLATED).tolist() == [False] * 3 + [True] * 2 + [False]
+
+
+def test_gap_longer_than_window_keeps_last_measurement():
+    """Lacune plus longue que la fenêtre: les lignes sorties du report ne sont plus corrigées"""
+    window = SilverTransformer.OUTLIER_WINDOW
+    gap = 2 * window
+    values = [10.0] + [np.nan] * gap + [10.0 + gap + 1]
+    
+    incremental = run_incremental(series(values), batch_size=window)
+    full = SilverTransformer().transform(series(values))
+    
+    assert np.allclose(full['temperature'], 10.0 + np.arange(gap + 2))
+    kept = incremental['temperature'].to_numpy()
+    # Dernier lot: lignes 30-31, report des lignes 16-29 du lot précédent
+    # Lignes sorties du report: dernière mesure connue
+    assert np.allclose(kept[1:16], 10.0)
+    # Lignes reportées: interpolées comme par un retraitement complet
+    assert np.allclose(kept[16:], full['temperature'].to_numpy()[16:])
+
+
+def test_reextracted_carried_row_is_replaced_by_batch_row():
+    """Mesure renvoyée ou relue par la passe tardive alors qu'elle est déjà reportée"""
+    transformer = SilverTransformer()
+    transformer.transform(series([10.0, 11.0, np.nan]))
+    transformer.commit()
+    
+    # Minute 2 (reportée, valeur manquante) extraite de nouveau avec la minute 3
+    batch = series([10.0, 11.0, 13.0, 14.0]).iloc[2:].reset_index(drop=True).assign(row_version=[7, 8])
+    result = transformer.transform(batch)
+    
+    assert not result.duplicated(['capteur_id', 'timestamp']).any()
+    assert result['temperature'].tolist() == [13.0, 14.0]
+    assert result['row_version'].tolist() == [7, 8]
+
+
+def test_carry_over_is_bounded_per_sensor():
+    df = sensor_data(5000)
+    transformer = SilverTransformer()
+    
+    transformer.transform(df)
+    transformer.commit()
+    
+    sizes = transformer.carry_over.groupby('capteur_id').size()
+    assert sizes.max() <= SilverTransformer.OUTLIER_WINDOW - 1 + len(MEASURE_COLUMNS)
+
+
+def test_carry_over_writes_only_changed_rows():
+    transformer = SilverTransformer()
+    transformer.transform(series(np.arange(20.0)))
+    transformer.commit()
+    
+    transformer.transform(series(np.arange(20.0, 22.0)).assign(
+        timestamp=lambda df: df['timestamp'] + pd.Timedelta(minutes=20)
+    ))
+    previous = transformer.carry_over
+    removed, changed = SilverStateStore._diff(previous, transformer.pending_carry_over)
+    
+    # Fenêtre décalée de deux lignes: deux sorties, deux nouvelles
+    assert len(removed) == 2
+    assert len(changed) == 2
+    assert (changed['timestamp'] > previous['timestamp'].max()).all()
+
+
+# Valeurs hors plage, aberrantes et figées
+
+def test_out_of_range_value_is_rejected_and_interpolated():
+    result = SilverTransformer().transform(series([20.0, -999.9, 22.0]))
+    
+    assert np.allclose(result['temperature'], [20.0, 21.0, 22.0])
+    assert flagged(result, 'temperature', FLAG_OUT_OF_RANGE).tolist() == [False, True, False]
+    assert flagged(result, 'temperature', FLAG_INTERPOLATED).tolist() == [False, True, False]
+
+
+def test_spike_is_flagged_as_outlier_and_kept():
+    values = 20.0 + 0.1 * np.sin(np.arange(30))
+    values[20] = 35.0
+    
+    result = SilverTransformer().transform(series(values))
+    
+    assert np.flatnonzero(flagged(result, 'temperature', FLAG_OUTLIER)).tolist() == [20]
+    assert result['temperature'].iloc[20] == 35.0
+
+
+def test_too_few_measurements_are_not_flagged():
+    values = [20.0] * (SilverTransformer.OUTLIER_MIN_PERIODS - 2) + [35.0]
+    
+    result = SilverTransformer().transform(series(values))
+    
+    assert not flagged(result, 'temperature', FLAG_OUTLIER).any()
+
+
+def test_constant_value_inside_range_is_flagged_as_stuck():
+    window = SilverTransformer.OUTLIER_WINDOW
+    
+    result = SilverTransformer().transform(series([25.0] * (window + 5)))
+    
+    stuck = flagged(result, 'temperature', FLAG_STUCK)
+    assert not stuck[:window - 1].any()
+    assert stuck[window - 1:].all()
+
+
+def test_constant_value_at_range_bound_is_not_stuck():
+    """Luminosité nulle la nuit, humidité saturée: états normaux, pas des pannes"""
+    rows = 2 * SilverTransformer.OUTLIER_WINDOW
+    
+    result = SilverTransformer().transform(series(
+        [25.0 + 0.1 * (i % 3) for i in range(rows)], luminosite=[0.0] * rows, humidite=[100.0] * rows
+    ))
+    
+    assert not flagged(result, 'luminosite', FLAG_STUCK).any()
+    assert not flagged(result, 'humidite', FLAG_STUCK).any()
+
+
+def test_window_shorter_than_minimum_duration_is_not_flagged():
+    window = SilverTransformer.OUTLIER_WINDOW
+    burst = [25.0] * (window + 5)
+    burst[-1] = 40.0
+    
+    result = SilverTransformer().transform(series(burst, seconds=1.0))
+    
+    assert not flagged(result, 'temperature', FLAG_STUCK).any()
+    assert not flagged(result, 'temperature', FLAG_OUTLIER).any()
+
+
+# Registre des capteurs (plages et étalonnage par capteur)
+
+class FakeRegistryDB:
+    """Table sensor_registry en mémoire: répond aux requêtes de read_registry"""
+    
+    def __init__(self, rows):
+        # (capteur_id, metric, min_value, max_value, scale, calibration_offset, unit, version)
+        self.rows = list(rows)
+        self.queries = []
+    
+    def cursor(self):
+        return self
+    
+    def execute(self, query, params=None):
+        self.queries.append(params)
+        if 'MAX(version)' in query:
+            self._result = [(max((row[-1] for row in self.rows), default=0), len(self.rows))]
+        else:
+            self._result = [row for row in self.rows if row[-1] > params[0]]
+    
+    def fetchone(self):
+        return self._result[0]
+    
+    def fetchall(self):
+        return self._result
+    
+    def close(self):
+        pass
+    
+    def commit(self):
+        pass
+
+
+def registry(*rows) -> SensorRegistry:
+    sensor_registry = SensorRegistry(FakeRegistryDB(rows))
+    sensor_registry.refresh()
+    return sensor_registry
+
+
+def test_registry_bounds_are_per_sensor_with_default_fallback():
+    # A: maximum abaissé à 30 °C, minimum NULL (défaut -10 °C); B: absent du registre
+    transformer = SilverTransformer(registry=registry(('A', 'temperature', None, 30.0, 1.0, 0.0, '°C', 1)))
+    values = [20.0, 35.0, -5.0, -20.0, 25.0]
+    batch = pd.concat([series(values), series(values, capteur_id='B')], ignore_index=True)
+    
+    result = transformer.transform(batch)
+    
+    rejected = flagged(result, 'temperature', FLAG_OUT_OF_RANGE)
+    assert rejected[:5].tolist() == [False, True, False, True, False]
+    assert rejected[5:].tolist() == [False, False, False, True, False]
+    assert result['temperature'].iloc[5:].tolist()[:3] == [20.0, 35.0, -5.0]
+
+
+def test_registry_calibration_is_applied_before_range_check():
+    # Mesures brutes en dixièmes de degré, décalées de 5 °C
+    transformer = SilverTransformer(registry=registry(('A', 'temperature', None, None, 0.1, -5.0, 'd°C', 1)))
+    
+    result = transformer.transform(series([250.0, 600.0, 270.0]))
+    
+    assert np.allclose(result['temperature'], [20.0, 21.0, 22.0])
+    assert flagged(result, 'temperature', FLAG_OUT_OF_RANGE).tolist() == [False, True, False]
+
+
+def test_registry_refresh_reads_only_changed_rows():
+    db = FakeRegistryDB([
+        ('A', 'temperature', None, 30.0, 1.0, 0.0, '°C', 1),
+        ('B', 'temperature', None, 40.0, 1.0, 0.0, '°C', 2),
+    ])
+    sensor_registry = SensorRegistry(db)
+    
+    assert sensor_registry.refresh()
+    assert sensor_registry.version == 2
+    assert not sensor_registry.refresh()
+    
+    db.rows[0] = ('A', 'temperature', None, 25.0, 1.0, 0.0, '°C', 3)
+    db.queries.clear()
+    assert sensor_registry.refresh()
+    # Seules les lignes de version supérieure à 2 sont relues
+    assert db.queries == [None, (2,)]
+    assert sensor_registry.version == 3
+    assert sensor_registry.upper['temperature'][sensor_registry.codes(pd.Series(['A', 'B', 'C']))].tolist() == [25.0, 40.0, 50.0]
+
+
+def test_read_registry_reloads_everything_after_a_deletion():
+    rows = [
+        ('A', 'temperature', None, 30.0, 1.0, 0.0, '°C', 1),
+        ('B', 'temperature', None, 40.0, 1.0, 0.0, '°C', 2),
+    ]
+    db = FakeRegistryDB(rows)
+    entries = read_registry(db, {}, 0)
+    
+    db.rows = rows[1:]
+    db.queries.clear()
+    reloaded = read_registry(db, entries, 2)
+    
+    # Moins de lignes en base qu'en mémoire: rechargement complet (version > 0)
+    assert db.queries == [None, (2,), (0,)]
+    assert list(reloaded) == [('B', 'temperature')]
+    assert read_registry(db, reloaded, 2) is None